@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import hashlib
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from Bot_tg.config import (
+    AGENT_CACHE_ENABLED, AGENT_CACHE_SIZE, AGENT_CACHE_TTL, AGENT_CACHE_FILE
+)
+from Bot_tg.profile_store import profile_store
+from Bot_tg.utils import read_file_sync, write_file_sync
+from Bot_tg.metrics import registry, timed_io
+from Bot_tg.tracing import create_detached_task
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class AgentCache:
+    """
+    Кэш ответов агентов, генерирующих вопросы по профилю (agent_04/06/07/08).
+    Ключ — (агент, хэш шаблона промпта, хэш текста профиля): пока профиль не изменился,
+    повторный /profile или /analysis отдается из памяти. LRU с TTL, опционально на диске.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 86400,
+                 persist_file: Optional[str] = None, enabled: bool = True):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl_seconds
+        self.persist_file = persist_file
+        self.enabled = enabled
+        # key -> (expires_at, chat_id, value)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._by_chat: Dict[str, Set[str]] = {}
+        self._template_hashes: Dict[str, str] = {}
+        self._save_task: Optional[asyncio.Task] = None
+        # Вычисления в полете: повторный запрос того же ключа ждет уже идущий вызов LLM
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, agent: str, template: str, profile_text: str) -> str:
+        template_hash = self._template_hashes.get(agent)
+        if template_hash is None:
+            template_hash = self._template_hashes[agent] = content_hash(template)
+        return f"{agent}:{template_hash}:{content_hash(profile_text)}"
+
+    # --- Базовые операции ---
+    def get(self, key: str):
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        expires_at, chat_id, value = item
+        if expires_at < time.time():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, chat_id, value):
+        cid = str(chat_id)
+        self._entries[key] = (time.time() + self.ttl, cid, value)
+        self._entries.move_to_end(key)
+        self._by_chat.setdefault(cid, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+        self._schedule_save()
+
+    def _drop(self, key: str):
+        item = self._entries.pop(key, None)
+        if item is None:
+            return
+        keys = self._by_chat.get(item[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_chat[item[1]]
+
+    def invalidate_chat(self, chat_id, version: int = 0):
+        """Сбрасывает все ответы для чата (вызывается при записи профиля)."""
+        keys = self._by_chat.pop(str(chat_id), set())
+        for key in keys:
+            self._entries.pop(key, None)
+        if keys:
+            self._schedule_save()
+
+    async def get_or_compute(self, agent: str, template: str, chat_id, profile_text: str,
+                             compute: Callable[[], Awaitable[Any]]):
+        """Возвращает ответ из кэша или вычисляет его; пустые ответы (ошибки) не кэшируются."""
+        if not self.enabled:
+            return await compute()
+        key = self.key(agent, template, profile_text)
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            logger.info(f"[CACHE] {agent}: ответ для {chat_id} из кэша.")
+            return value
+        task = self._in_flight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._compute(key, chat_id, profile_store.version(chat_id), compute))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._in_flight[key] = task
+        else:
+            logger.info(f"[CACHE] {agent}: присоединяемся к уже идущему вызову для {chat_id}.")
+        # shield: отмена одного ожидающего (например, префетча) не отменяет вызов для остальных
+        return await asyncio.shield(task)
+
+    async def _compute(self, key: str, chat_id, version: int, compute: Callable[[], Awaitable[Any]]):
+        try:
+            value = await compute()
+            # Если профиль перезаписали, пока шел вызов, ответ отдаем ждавшим, но в кэш не кладем
+            if value and profile_store.version(chat_id) == version:
+                self.put(key, chat_id, value)
+            return value
+        finally:
+            self._in_flight.pop(key, None)
+
+    # --- Персистентность ---
+    @timed_io("agent_cache_load")
+    def load(self):
+        if not self.persist_file or not os.path.exists(self.persist_file):
+            return
+        try:
+            data = json.loads(read_file_sync(self.persist_file))
+        except json.JSONDecodeError as e:
+            logger.error(f"[CACHE] Не удалось прочитать {self.persist_file}: {e}")
+            return
+        now = time.time()
+        for key, expires_at, chat_id, value in data:
+            if expires_at > now:
+                self._entries[key] = (expires_at, chat_id, value)
+                self._by_chat.setdefault(chat_id, set()).add(key)
+        print(f"[CACHE] Загружено {len(self._entries)} ответов агентов.")
+
+    @timed_io("agent_cache_save")
+    def save(self):
+        if not self.persist_file:
+            return
+        data = [[key, *item] for key, item in self._entries.items()]
+        tmp_path = f"{self.persist_file}.tmp"
+        write_file_sync(tmp_path, json.dumps(data, ensure_ascii=False))
+        os.replace(tmp_path, self.persist_file)
+
+    def _schedule_save(self, delay: float = 5.0):
+        if not self.persist_file or (self._save_task and not self._save_task.done()):
+            return
+        try:
+            self._save_task = create_detached_task(self._delayed_save(delay))
+        except RuntimeError:
+            pass  # нет цикла событий — сохранится при остановке
+
+    async def _delayed_save(self, delay: float):
+        await asyncio.sleep(delay)
+        try:
+            await asyncio.to_thread(self.save)
+        except OSError as e:
+            logger.error(f"[CACHE] Ошибка сохранения кэша: {e}")
+
+
+agent_cache = AgentCache(
+    max_entries=AGENT_CACHE_SIZE,
+    ttl_seconds=AGENT_CACHE_TTL,
+    persist_file=AGENT_CACHE_FILE,
+    enabled=AGENT_CACHE_ENABLED
+)
+profile_store.add_listener(agent_cache.invalidate_chat)
+registry.counter("askme_agent_cache_requests_total", "Обращения к кэшу ответов агентов", ["result"],
+                 collect=lambda: {("hit",): agent_cache.hits, ("miss",): agent_cache.misses})
+registry.gauge("askme_agent_cache_entries", "Записи в кэше ответов агентов", collect=lambda: len(agent_cache._entries))
+registry.gauge("askme_agent_cache_in_flight", "Вызовы агентов, которые ждут несколько запросов",
+               collect=lambda: len(agent_cache._in_flight))
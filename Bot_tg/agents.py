@@ -1,27 +1,32 @@
 import json
-import asyncio
+import time
 import logging
-from typing import List, Dict
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
+from typing import AsyncIterator, List, Dict
 
 from Bot_tg.config import (
-    llm_pro, llm_flash, 
-    PROFILE_FILE, WEBAPP_HTML_FILE,
-    Interaction, 
-    JsonParser
+    WEBAPP_HTML_FILE,
+    PROFILE_PATCH_ENABLED, PROFILE_PATCH_MIN_CHARS,
+    Interaction
 )
 from Bot_tg.prompts import (
     PROMPT_AGENT_01_PSYCHOLOGY_INSTRUCTION,
     PROMPT_AGENT_02_INSTRUCTION,
     PROMPT_AGENT_03_INSTRUCTION,
+    PROMPT_AGENT_03_PATCH,
     PROMPT_AGENT_04_INSTRUCTION,
     PROMPT_AGENT_05_TASK_DECOMPOSITION,
     PROMPT_AGENT_06_DEEP_ANALYSIS,
     PROMPT_AGENT_07_IKIGAI,
     PROMPT_AGENT_07_IKIGAI_ANALYSIS
 )
-from .utils import read_file_sync, write_file_sync, generate_webapp_url
+from .utils import generate_webapp_url
+from .profile_store import profile_store
+from .context_builder import profile_context
+from .agent_cache import agent_cache
+from .llm_scheduler import llm_scheduler, Lane, LLMBusyError
+from .chains import LazyChain
+from .metrics import registry
+from .profile_sections import ProfileDocument, parse_patches, apply_patches, PatchError
 
 # --- Logging Configuration ---
 logger = logging.getLogger(__name__)
@@ -32,88 +37,124 @@ logger = logging.getLogger(__name__)
 
 # --- Agent 01: Psychology Analysis ---
 
-agent_01_chain = (
-    ChatPromptTemplate.from_template(PROMPT_AGENT_01_PSYCHOLOGY_INSTRUCTION) 
-    | llm_pro 
-    | JsonParser()
-)
+agent_01_chain = LazyChain(PROMPT_AGENT_01_PSYCHOLOGY_INSTRUCTION, llm="llm_pro", parser="json", name="agent_01")
 
-async def agent_01(user_text: str) -> List[Dict[str, list]]:
+async def agent_01(chat_id: int, user_text: str) -> List[Dict[str, list]]:
     """Асинхронно запускает цепочку Агента 1."""
     logger.info(f"[AGENT_01] Запуск (pro) для текста: '{user_text[:50]}...'")
-    user_profile = await asyncio.to_thread(read_file_sync, PROFILE_FILE)
+    user_profile = await profile_context(chat_id, "agent_01")
     try:
-        return await agent_01_chain.ainvoke({"user_text": user_text, "user_profile": user_profile})
+        return await llm_scheduler.run(chat_id, Lane.INTERACTIVE, lambda: agent_01_chain.ainvoke(
+            {"user_text": user_text, "user_profile": user_profile}
+        ))
+    except LLMBusyError:
+        raise
     except Exception as e:
         logger.error(f"[AGENT_01] Ошибка в цепочке: {e}")
         return []
 
 # --- Agent 02: Text Rewriter ---
 
-agent_02_chain = (
-    ChatPromptTemplate.from_template(PROMPT_AGENT_02_INSTRUCTION) 
-    | llm_flash 
-    | StrOutputParser()
-)
+agent_02_chain = LazyChain(PROMPT_AGENT_02_INSTRUCTION, llm="llm_flash", parser="str", name="agent_02")
 
-async def agent_02(original_text: str, interactions: List[Interaction]) -> str:
+async def agent_02(chat_id: int, original_text: str, interactions: List[Interaction]) -> str:
     """Асинхронно запускает цепочку Агента 2."""
     logger.info("[AGENT_02] Запуск (flash) для переписывания текста...")
     
-    user_profile = await asyncio.to_thread(read_file_sync, PROFILE_FILE)
+    user_profile = await profile_context(chat_id, "agent_02")
     history = "\n".join([f"- На вопрос \"{item.question}\" был дан ответ \"{item.answer}\"." for item in interactions])
     
     try:
-        return await agent_02_chain.ainvoke({"original_text": original_text, "history": history, "user_profile": user_profile})
+        return await llm_scheduler.run(chat_id, Lane.INTERACTIVE, lambda: agent_02_chain.ainvoke(
+            {"original_text": original_text, "history": history, "user_profile": user_profile}
+        ))
+    except LLMBusyError:
+        raise
     except Exception as e:
         logger.error(f"[AGENT_02] Ошибка в цепочке: {e}")
         return "Не удалось переписать текст из-за ошибки."
 
 # --- Agent 03: Profile Analyst (Background) ---
 
-agent_03_chain = (
-    ChatPromptTemplate.from_template(PROMPT_AGENT_03_INSTRUCTION) 
-    | llm_pro 
-    | StrOutputParser()
-)
+agent_03_chain = LazyChain(PROMPT_AGENT_03_INSTRUCTION, llm="llm_pro", parser="str", name="agent_03")
+
+agent_03_patch_chain = LazyChain(PROMPT_AGENT_03_PATCH, llm="llm_pro", parser="str", name="agent_03_patch")
 
-async def agent_03(json_data: str) -> bool:
+# Счетчики режимов Агента 3 (каждый вызов — ровно один режим): точечные правки,
+# откаты с отклоненного патча на полную перезапись, полные перезаписи без попытки патча
+agent_03_stats = {"patched": 0, "fallback": 0, "full": 0}
+registry.counter("askme_agent_03_updates_total", "Обновления профиля Агентом 3 по режимам", ["mode"],
+                 collect=lambda: {(mode,): n for mode, n in agent_03_stats.items()})
+
+async def _agent_03_patch(chat_id: int, document: ProfileDocument, json_data: str, lane: Lane):
+    """Пробует обновить профиль правками разделов. None — правки неприменимы, нужна полная перезапись."""
+    raw = await llm_scheduler.run(chat_id, lane, lambda: agent_03_patch_chain.ainvoke(
+        {"existing_profile": document.text, "json_data": json_data}
+    ))
+    try:
+        patches = parse_patches(raw)
+        updated = apply_patches(document, patches)
+    except PatchError as e:
+        agent_03_stats["fallback"] += 1
+        logger.warning(f"[AGENT_03] Патч для {chat_id} отклонен ({e}), выполняю полную перезапись.")
+        return None
+    agent_03_stats["patched"] += 1
+    logger.info(f"[AGENT_03] Профиль {chat_id}: применено правок разделов — {len(patches)}.")
+    return updated
+
+async def agent_03(chat_id: int, json_data: str, lane: Lane = Lane.BACKGROUND) -> bool:
     """Асинхронно запускает цепочку Агента 3. Возвращает True при успешном обновлении."""
     logger.info("[AGENT_03] Асинхронный запуск (pro) для обновления профиля.")
     
-    existing_profile = await asyncio.to_thread(read_file_sync, PROFILE_FILE)
+    document = await profile_store.get_document(chat_id)
+    existing_profile = document.text
+    started = time.monotonic()
 
     try:
-        profile_text = await agent_03_chain.ainvoke({"existing_profile": existing_profile, "json_data": json_data})
-        
-        await asyncio.to_thread(write_file_sync, PROFILE_FILE, profile_text)
-        logger.info(f"[AGENT_03] Файл {PROFILE_FILE} успешно обновлен.")
+        updated = None
+        patching = PROFILE_PATCH_ENABLED and len(existing_profile) >= PROFILE_PATCH_MIN_CHARS and bool(document.sections)
+        if patching:
+            updated = await _agent_03_patch(chat_id, document, json_data, lane)
+        if updated is not None:
+            await profile_store.put_document(chat_id, updated)
+        else:
+            if not patching:
+                agent_03_stats["full"] += 1  # откат уже посчитан как fallback
+            profile_text = await llm_scheduler.run(chat_id, lane, lambda: agent_03_chain.ainvoke(
+                {"existing_profile": existing_profile, "json_data": json_data}
+            ))
+            await profile_store.put(chat_id, profile_text)
+        logger.info(f"[AGENT_03] Профиль {chat_id} успешно обновлен за {time.monotonic() - started:.1f} с.")
         return True
 
+    except LLMBusyError:
+        logger.warning(f"[AGENT_03] Обновление профиля {chat_id} отложено: планировщик перегружен.")
+        return False
     except Exception as e:
         logger.error(f"[AGENT_03] Ошибка в цепочке: {e}")
         return False
 
 # --- Agent 04: Profile Growth ---
 
-agent_04_chain = (
-    ChatPromptTemplate.from_template(PROMPT_AGENT_04_INSTRUCTION) 
-    | llm_flash 
-    | JsonParser()
-)
+agent_04_chain = LazyChain(PROMPT_AGENT_04_INSTRUCTION, llm="llm_flash", parser="json", name="agent_04")
 
-async def agent_04() -> List[Dict[str, list]]:
+async def agent_04(chat_id: int, lane: Lane = Lane.INTERACTIVE) -> List[Dict[str, list]]:
     """Асинхронно запускает цепочку Агента 4."""
     logger.info("[AGENT_04] Асинхронный запуск (flash) для анализа файла профиля...")
     
-    profile_text = await asyncio.to_thread(read_file_sync, PROFILE_FILE)
+    profile_text = await profile_context(chat_id, "agent_04")
     
     if not profile_text:
-        logger.warning("[AGENT_04] Файл профиля пуст или не найден.")
+        logger.warning(f"[AGENT_04] Профиль {chat_id} пуст или не найден.")
         return []
 
     try:
-        return await agent_04_chain.ainvoke({"profile_text": profile_text})
+        return await agent_cache.get_or_compute(
+            "agent_04", PROMPT_AGENT_04_INSTRUCTION, chat_id, profile_text,
+            lambda: llm_scheduler.run(chat_id, lane, lambda: agent_04_chain.ainvoke({"profile_text": profile_text}))
+        )
+    except LLMBusyError:
+        raise
     except Exception as e:
         logger.error(f"[AGENT_04] Ошибка в цепочке: {e}")
         return []
@@ -122,79 +163,101 @@ async def agent_04() -> List[Dict[str, list]]:
 
 # --- Agent 05: Task Architect (Goal Decomposition) ---
 
-agent_05_chain = (
-    ChatPromptTemplate.from_template(PROMPT_AGENT_05_TASK_DECOMPOSITION) 
-    | llm_flash 
-    | JsonParser()
-)
+agent_05_chain = LazyChain(PROMPT_AGENT_05_TASK_DECOMPOSITION, llm="llm_flash", parser="json", name="agent_05")
 
-async def agent_05(final_goal: str) -> List[Dict]:
+async def agent_05(chat_id: int, final_goal: str) -> List[Dict]:
     """Асинхронно запускает цепочку Агента 5 для декомпозиции цели."""
     logger.info(f"[AGENT_05] Запуск (flash) для декомпозиции цели: '{final_goal[:50]}...'")
-    user_profile = await asyncio.to_thread(read_file_sync, PROFILE_FILE)
+    user_profile = await profile_context(chat_id, "agent_05")
     try:
-        return await agent_05_chain.ainvoke({"final_goal": final_goal, "user_profile": user_profile})
+        return await llm_scheduler.run(chat_id, Lane.INTERACTIVE, lambda: agent_05_chain.ainvoke(
+            {"final_goal": final_goal, "user_profile": user_profile}
+        ))
+    except LLMBusyError:
+        raise
     except Exception as e:
         logger.error(f"[AGENT_05] Ошибка в цепочке: {e}")
         return []
 
 # --- Agent 06: Deep Profiler ---
 
-agent_06_chain = (
-    ChatPromptTemplate.from_template(PROMPT_AGENT_06_DEEP_ANALYSIS)
-    | llm_pro
-    | JsonParser()
-)
+agent_06_chain = LazyChain(PROMPT_AGENT_06_DEEP_ANALYSIS, llm="llm_pro", parser="json", name="agent_06")
 
-async def agent_06() -> List[Dict[str, list]]:
+async def agent_06(chat_id: int, lane: Lane = Lane.INTERACTIVE) -> List[Dict[str, list]]:
     """Асинхронно запускает цепочку Агента 6 для глубокого анализа профиля."""
     logger.info("[AGENT_06] Запуск (pro) для глубокого анализа профиля...")
     
-    profile_text = await asyncio.to_thread(read_file_sync, PROFILE_FILE)
+    profile_text = await profile_context(chat_id, "agent_06")
     
     if not profile_text:
-        logger.warning("[AGENT_06] Файл профиля пуст или не найден.")
+        logger.warning(f"[AGENT_06] Профиль {chat_id} пуст или не найден.")
         return []
 
     try:
-        return await agent_06_chain.ainvoke({"profile_text": profile_text})
+        return await agent_cache.get_or_compute(
+            "agent_06", PROMPT_AGENT_06_DEEP_ANALYSIS, chat_id, profile_text,
+            lambda: llm_scheduler.run(chat_id, lane, lambda: agent_06_chain.ainvoke({"profile_text": profile_text}))
+        )
+    except LLMBusyError:
+        raise
     except Exception as e:
         logger.error(f"[AGENT_06] Ошибка в цепочке: {e}")
         return []
 
 # --- Agent 07: Ikigai Sensei ---
 
-agent_07_questions_chain = (
-    ChatPromptTemplate.from_template(PROMPT_AGENT_07_IKIGAI)
-    | llm_pro
-    | JsonParser()
-)
+agent_07_questions_chain = LazyChain(PROMPT_AGENT_07_IKIGAI, llm="llm_pro", parser="json", name="agent_07_questions")
 
-agent_07_analysis_chain = (
-    ChatPromptTemplate.from_template(PROMPT_AGENT_07_IKIGAI_ANALYSIS)
-    | llm_pro
-    | StrOutputParser()
-)
+agent_07_analysis_chain = LazyChain(PROMPT_AGENT_07_IKIGAI_ANALYSIS, llm="llm_pro", parser="str", name="agent_07_analysis")
 
-async def agent_07_questions() -> List[Dict[str, list]]:
+async def agent_07_questions(chat_id: int) -> List[Dict[str, list]]:
     """Generates 5 Ikigai questions."""
     logger.info("[AGENT_07] Generating Ikigai questions...")
-    profile_text = await asyncio.to_thread(read_file_sync, PROFILE_FILE)
+    profile_text = await profile_context(chat_id, "agent_07")
     try:
-        return await agent_07_questions_chain.ainvoke({"profile_text": profile_text})
+        return await agent_cache.get_or_compute(
+            "agent_07_questions", PROMPT_AGENT_07_IKIGAI, chat_id, profile_text,
+            lambda: llm_scheduler.run(chat_id, Lane.INTERACTIVE, lambda: agent_07_questions_chain.ainvoke(
+                {"profile_text": profile_text}
+            ))
+        )
+    except LLMBusyError:
+        raise
     except Exception as e:
         logger.error(f"[AGENT_07] Error generating questions: {e}")
         return []
 
-async def agent_07_analysis(interactions_json: str) -> str:
+async def agent_07_analysis(chat_id: int, interactions_json: str) -> str:
     """Performs deep Ikigai analysis."""
     logger.info("[AGENT_07] Performing Ikigai analysis...")
-    profile_text = await asyncio.to_thread(read_file_sync, PROFILE_FILE)
+    profile_text = await profile_context(chat_id, "agent_07")
     try:
-        return await agent_07_analysis_chain.ainvoke({
+        return await llm_scheduler.run(chat_id, Lane.INTERACTIVE, lambda: agent_07_analysis_chain.ainvoke({
             "interactions_json": interactions_json,
             "profile_text": profile_text
-        })
+        }))
+    except LLMBusyError:
+        raise
     except Exception as e:
         logger.error(f"[AGENT_07] Error interacting Ikigai analysis: {e}")
         return "Ошибка анализа Ikigai."
+
+async def agent_07_analysis_stream(chat_id: int, interactions_json: str) -> AsyncIterator[str]:
+    """Streaming variant of agent_07_analysis: yields the blueprint chunk by chunk."""
+    logger.info("[AGENT_07] Streaming Ikigai analysis...")
+    profile_text = await profile_context(chat_id, "agent_07")
+    produced = False
+    try:
+        async with llm_scheduler.slot(chat_id, Lane.INTERACTIVE):
+            async for chunk in agent_07_analysis_chain.astream({
+                "interactions_json": interactions_json,
+                "profile_text": profile_text
+            }):
+                produced = True
+                yield chunk
+    except LLMBusyError:
+        raise
+    except Exception as e:
+        logger.error(f"[AGENT_07] Error streaming Ikigai analysis: {e}")
+        if not produced:
+            yield "Ошибка анализа Ikigai."
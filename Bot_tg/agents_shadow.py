@@ -1,54 +1,70 @@
 import json
-import asyncio
 import logging
-from typing import List, Dict
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-
-from Bot_tg.config import (
-    llm_pro, llm_flash, 
-    PROFILE_FILE, 
-    Interaction, 
-    JsonParser
-)
+from typing import AsyncIterator, List, Dict
+
+from Bot_tg.config import Interaction
 from Bot_tg.prompts.agent_08 import PROMPT_AGENT_08_SHADOW_WORK, PROMPT_AGENT_08_SHADOW_ANALYSIS
-from Bot_tg.utils import read_file_sync, write_file_sync
+from Bot_tg.context_builder import profile_context
+from Bot_tg.agent_cache import agent_cache
+from Bot_tg.llm_scheduler import llm_scheduler, Lane, LLMBusyError
+from Bot_tg.chains import LazyChain
 
 logger = logging.getLogger(__name__)
 
 # --- Agent 08 Chains ---
 
-agent_08_questions_chain = (
-    ChatPromptTemplate.from_template(PROMPT_AGENT_08_SHADOW_WORK)
-    | llm_pro
-    | JsonParser()
-)
+agent_08_questions_chain = LazyChain(PROMPT_AGENT_08_SHADOW_WORK, llm="llm_pro", parser="json", name="agent_08_questions")
 
-agent_08_analysis_chain = (
-    ChatPromptTemplate.from_template(PROMPT_AGENT_08_SHADOW_ANALYSIS)
-    | llm_pro
-    | StrOutputParser()
-)
+agent_08_analysis_chain = LazyChain(PROMPT_AGENT_08_SHADOW_ANALYSIS, llm="llm_pro", parser="str", name="agent_08_analysis")
 
-async def agent_08_questions() -> List[Dict[str, list]]:
+async def agent_08_questions(chat_id: int) -> List[Dict[str, list]]:
     """Generates 3-5 Shadow Work questions in Zen style."""
     logger.info("[AGENT_08] Generating Shadow Work questions...")
-    profile_text = await asyncio.to_thread(read_file_sync, PROFILE_FILE)
+    profile_text = await profile_context(chat_id, "agent_08")
     try:
-        return await agent_08_questions_chain.ainvoke({"profile_text": profile_text})
+        return await agent_cache.get_or_compute(
+            "agent_08_questions", PROMPT_AGENT_08_SHADOW_WORK, chat_id, profile_text,
+            lambda: llm_scheduler.run(chat_id, Lane.INTERACTIVE, lambda: agent_08_questions_chain.ainvoke(
+                {"profile_text": profile_text}
+            ))
+        )
+    except LLMBusyError:
+        raise
     except Exception as e:
         logger.error(f"[AGENT_08] Error generating questions: {e}")
         return []
 
-async def agent_08_analysis(interactions_json: str) -> str:
+async def agent_08_analysis(chat_id: int, interactions_json: str) -> str:
     """Performs deep Shadow Work analysis."""
     logger.info("[AGENT_08] Performing Shadow analysis...")
-    profile_text = await asyncio.to_thread(read_file_sync, PROFILE_FILE)
+    profile_text = await profile_context(chat_id, "agent_08")
     try:
-        return await agent_08_analysis_chain.ainvoke({
+        return await llm_scheduler.run(chat_id, Lane.INTERACTIVE, lambda: agent_08_analysis_chain.ainvoke({
             "interactions_json": interactions_json,
             "profile_text": profile_text
-        })
+        }))
+    except LLMBusyError:
+        raise
     except Exception as e:
         logger.error(f"[AGENT_08] Error in Shadow analysis: {e}")
         return "Ошибка анализа Тени."
+
+async def agent_08_analysis_stream(chat_id: int, interactions_json: str) -> AsyncIterator[str]:
+    """Streaming variant of agent_08_analysis: yields the archetype chunk by chunk."""
+    logger.info("[AGENT_08] Streaming Shadow analysis...")
+    profile_text = await profile_context(chat_id, "agent_08")
+    produced = False
+    try:
+        async with llm_scheduler.slot(chat_id, Lane.INTERACTIVE):
+            async for chunk in agent_08_analysis_chain.astream({
+                "interactions_json": interactions_json,
+                "profile_text": profile_text
+            }):
+                produced = True
+                yield chunk
+    except LLMBusyError:
+        raise
+    except Exception as e:
+        logger.error(f"[AGENT_08] Error streaming Shadow analysis: {e}")
+        if not produced:
+            yield "Ошибка анализа Тени."
@@ -1,5 +1,6 @@
 import os
 import sys
+import signal
 import asyncio
 from telebot.async_telebot import AsyncTeleBot
 from telebot.types import BotCommand
@@ -9,22 +10,46 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
+# Быстрая проверка настроек без запуска бота: python Bot_tg/app.py --check-config
+if __name__ == "__main__" and "--check-config" in sys.argv[1:]:
+    from Bot_tg.config import main as config_main
+    sys.exit(config_main(["--check-config"]))
+
 # --- Импорты ---
-from Bot_tg.config import TELEGRAM_BOT_TOKEN, USER_PROGRESS_FILE
+from Bot_tg.config import (
+    TELEGRAM_BOT_TOKEN, USER_PROGRESS_FILE, PROGRESS_DB_FILE, PROFILE_FLUSH_INTERVAL, BOT_MODE,
+    METRICS_PORT, METRICS_HOST, WORKER_COUNT
+)
 from Bot_tg.state_manager import load_user_progress
+from Bot_tg.question_pool import get_telos_pool
 from Bot_tg.handlers import register_handlers
 from Bot_tg.handlers_shadow import register_shadow_handlers # Новое
 from Bot_tg.app_logic import cleanup_user_states, daily_scheduler
+from Bot_tg.profile_store import profile_store
+from Bot_tg.agent_cache import agent_cache
+from Bot_tg.profile_updater import profile_updater
+from Bot_tg.session_store import session_store
+from Bot_tg.prefetch import prefetcher  # noqa: F401 — подписывается на запись профилей
+from Bot_tg.results_journal import results_journal, open_results_journal
+from Bot_tg.chains import warm_up
+from Bot_tg.metrics import start_metrics_server
+from Bot_tg.tracing import tracer, create_detached_task
 
 if not TELEGRAM_BOT_TOKEN:
     raise ValueError("Не найден TELEGRAM_BOT_TOKEN в .env файле.")
+# getUpdates отдает все апдейты каждому воркеру: шардирование чатов работает только через вебхук
+if WORKER_COUNT > 1 and BOT_MODE != "webhook":
+    raise ValueError("WORKER_COUNT > 1 требует BOT_MODE=webhook: в режиме polling каждый воркер получит все чаты.")
 
 bot = AsyncTeleBot(TELEGRAM_BOT_TOKEN)
 
 # --- Инициализация ---
-load_user_progress(USER_PROGRESS_FILE)
-register_handlers(bot)
+load_user_progress(PROGRESS_DB_FILE, legacy_file=USER_PROGRESS_FILE, pool=get_telos_pool())
+open_results_journal()
+agent_cache.load()
+# Команды теней — до register_handlers: там последним стоит обработчик любого текста
 register_shadow_handlers(bot) # Новое
+register_handlers(bot)
 
 async def set_bot_commands(bot_instance):
     commands = [
@@ -35,20 +60,66 @@ async def set_bot_commands(bot_instance):
         BotCommand("continue", "Продолжить заполнение"),
         BotCommand("ikigai", "Найти Икигай"),
         BotCommand("shadow", "Теневая работа (Дзен)"), # Новое
-        BotCommand("tasks", "Мои задачи")
+        BotCommand("tasks", "Мои задачи"),
+        BotCommand("schedule", "Время ежедневных вопросов")
     ]
     await bot_instance.set_my_commands(commands)
     print("[APP] Команды меню установлены.")
 
+def _background_done(task: asyncio.Task):
+    """Фоновые задачи работают до остановки бота: завершение с ошибкой нужно увидеть в логе сразу."""
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[APP] Фоновая задача {task.get_name()} остановилась с ошибкой: {task.exception()!r}")
+
+def start_background(coro, name: str) -> asyncio.Task:
+    task = create_detached_task(coro)
+    task.set_name(name)
+    task.add_done_callback(_background_done)
+    return task
+
 async def main():
     await set_bot_commands(bot)
+    # langchain и клиенты Gemini импортируются в фоне, пока бот уже принимает сообщения
+    warming = start_background(asyncio.to_thread(warm_up), "warm_up")
     
-    # Запуск фоновых задач
-    asyncio.create_task(cleanup_user_states())
-    asyncio.create_task(daily_scheduler(bot))
+    # Запуск фоновых задач (ссылки держим до остановки)
+    background = [
+        warming,
+        start_background(cleanup_user_states(), "cleanup_user_states"),
+        start_background(daily_scheduler(bot), "daily_scheduler"),
+        start_background(profile_store.run_flusher(PROFILE_FLUSH_INTERVAL), "profile_flusher"),
+    ]
+    if tracer.enabled:
+        background.append(start_background(tracer.run_flusher(), "trace_flusher"))
+    metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
     
-    print("[APP] Бот запускается...")
-    await bot.polling()
+    print(f"[APP] Бот запускается (режим: {BOT_MODE})...")
+    try:
+        if BOT_MODE == "webhook":
+            from Bot_tg.webhook import run_webhook
+            stop_event = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.add_signal_handler(sig, stop_event.set)
+                except (NotImplementedError, RuntimeError):
+                    pass  # Windows: остановка по Ctrl+C через KeyboardInterrupt
+            await run_webhook(bot, stop_event)
+        else:
+            await bot.remove_webhook()
+            await bot.polling()
+    finally:
+        await profile_updater.drain()
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        await profile_store.flush()
+        await results_journal.close()
+        await asyncio.to_thread(agent_cache.save)
+        await session_store.close()
+        await asyncio.to_thread(tracer.flush)
+        if metrics_runner:
+            await metrics_runner.cleanup()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,81 +1,66 @@
+import time
 import asyncio
-from datetime import datetime, timedelta
 from telebot.types import ReplyKeyboardMarkup, KeyboardButton, WebAppInfo
-from Bot_tg.config import (
-    GITHUB_PAGES_URL, TELOS_QUESTIONS_FILE, USER_PROGRESS_FILE
-)
-from Bot_tg.agents import generate_webapp_url
-from Bot_tg.utils import load_json_sync
-from Bot_tg.state_manager import user_states, user_progress, save_user_progress, register_user_activity
+from Bot_tg.config import GITHUB_PAGES_URL
+from Bot_tg.question_packs import pack_webapp_url
+from Bot_tg.question_pool import get_telos_pool
+from Bot_tg.sender import send_message, Priority
+from Bot_tg.scheduler import daily_schedule
+from Bot_tg.state_manager import get_answered_bits, register_user_activity
+from Bot_tg.session import SessionMode
+from Bot_tg.session_store import session_store, new_session
 
-async def cleanup_user_states(interval_seconds: int = 300, timeout_minutes: int = 60):
+async def cleanup_user_states(report_interval: int = 300):
+    """
+    Удаляет сессии, истекшие по SESSION_TTL, с точностью до секунды: спит до ближайшего
+    срока истечения, а не просматривает все сессии по таймеру. Раз в report_interval
+    печатает, сколько сессий истекло (Redis истекает сам, там счетчик не растет).
+    """
     print("[APP] Запущен сборщик мусора сессий.")
+    reported_at, reported_total = time.monotonic(), session_store.expired_total
     while True:
         try:
-            await asyncio.sleep(interval_seconds)
-            now = datetime.now()
-            expired_keys = []
-            for chat_id, state in user_states.items():
-                last_activity = state.get("last_activity")
-                if last_activity and (now - last_activity) > timedelta(minutes=timeout_minutes):
-                    expired_keys.append(chat_id)
-                elif not last_activity:
-                    state["last_activity"] = now
-            for key in expired_keys:
-                print(f"[CLEANUP] Удалена неактивная сессия: {key}")
-                user_states.pop(key, None)
+            next_at = await session_store.next_expiry()
+            delay = session_store.ttl if next_at is None else next_at - time.time()
+            await asyncio.sleep(min(max(delay, 1.0), report_interval))
+            await session_store.expire()
+            if time.monotonic() - reported_at >= report_interval:
+                expired = session_store.expired_total - reported_total
+                if expired:
+                    print(f"[CLEANUP] За {report_interval} с истекло сессий: {expired} (всего {session_store.expired_total}).")
+                reported_at, reported_total = time.monotonic(), session_store.expired_total
         except Exception as e:
             print(f"[CLEANUP] Ошибка: {e}")
+            await asyncio.sleep(1.0)
 
 async def trigger_daily_questions(bot, chat_id, manual=False):
     try:
-        all_questions = await asyncio.to_thread(load_json_sync, TELOS_QUESTIONS_FILE)
-        if not all_questions:
-            if manual: await bot.send_message(chat_id, "Не удалось загрузить вопросы.")
+        pool = get_telos_pool()
+        if not len(pool):
+            if manual: await send_message(bot, chat_id, "Не удалось загрузить вопросы.")
             return
 
-        cid = str(chat_id)
-        answered = user_progress.get(cid, [])
-        available = [q for q in all_questions if q['question_text'] not in answered]
+        positions = pool.next_unanswered_positions(get_answered_bits(chat_id), 10)
+        batch = [pool.questions[i] for i in positions]
         
-        if not available:
+        if not batch:
             if manual:
-                await bot.send_message(chat_id, "Вы ответили на все вопросы базового профиля! 🏆")
+                await send_message(bot, chat_id, "Вы ответили на все вопросы базового профиля! 🏆")
             return
 
-        batch = available[:10]
-        url = generate_webapp_url(GITHUB_PAGES_URL, batch)
+        url = pack_webapp_url(GITHUB_PAGES_URL, batch, pack_id=pool.pack_id, indices=positions)
         markup = ReplyKeyboardMarkup(resize_keyboard=True)
         markup.add(KeyboardButton("✍️ ПРОДОЛЖИТЬ ЗАПОЛНЕНИЕ", web_app=WebAppInfo(url=url)))
         
         msg = "Настало время продолжить профиль." if not manual else "Вот следующая порция вопросов."
-        await bot.send_message(chat_id, msg, reply_markup=markup)
+        priority = Priority.INTERACTIVE if manual else Priority.SCHEDULED
+        await send_message(bot, chat_id, msg, reply_markup=markup, priority=priority)
         
-        user_states[chat_id] = {
-            "mode": "continuing_profile", 
-            "questions": batch, 
-            "step": 0, 
-            "interactions": [],
-            "last_activity": datetime.now()
-        }
-        register_user_activity(chat_id, USER_PROGRESS_FILE)
+        await session_store.set(chat_id, new_session(SessionMode.CONTINUING_PROFILE, batch))
+        register_user_activity(chat_id)
     except Exception as e:
         print(f"[LOGIC] Error in trigger_daily_questions: {e}")
 
 async def daily_scheduler(bot):
-    print("[SCHEDULER] Daily scheduler started.")
-    while True:
-        try:
-            now = datetime.now()
-            if now.hour == 18 and now.minute == 0:
-                for chat_id_str in list(user_progress.keys()):
-                    try:
-                        cid = int(chat_id_str)
-                        asyncio.create_task(trigger_daily_questions(bot, cid, manual=False))
-                    except ValueError: pass
-                await asyncio.sleep(61)
-            else:
-                await asyncio.sleep(30)
-        except Exception as e:
-            print(f"[SCHEDULER] Error: {e}")
-            await asyncio.sleep(30)
+    """Ежедневные вопросы по персональному расписанию (см. DailyScheduler)."""
+    await daily_schedule.run(lambda chat_id: trigger_daily_questions(bot, chat_id, manual=False))
@@ -0,0 +1,125 @@
+import time
+import threading
+import logging
+from typing import Any, AsyncIterator, List
+
+from Bot_tg import config
+from Bot_tg.metrics import agent_latency, agent_first_chunk, agent_errors, agent_tokens
+from Bot_tg.tracing import tracer, KIND_CLIENT
+
+logger = logging.getLogger(__name__)
+
+
+class LazyChain:
+    """
+    Цепочка `ChatPromptTemplate | llm | parser`, собираемая при первом вызове.
+    Импорт агентов не тянет langchain и не создает клиентов Gemini; это происходит
+    при первом запросе к модели (или заранее, в warm_up).
+    Каждый вызов попадает в метрики агента name (время, ошибки, токены) и в спан name текущей трассы.
+    """
+
+    def __init__(self, prompt: str, llm: str = "llm_pro", parser: str = "str", name: str = "agent"):
+        self.prompt = prompt
+        self.llm = llm          # имя модели в config: llm_pro или llm_flash
+        self.parser = parser    # str — текст как есть, json — JsonParser
+        self.name = name        # метка agent в метриках
+        self._chain = None
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def build(self):
+        if self._chain is None:
+            with self._lock:
+                if self._chain is None:
+                    from langchain_core.prompts import ChatPromptTemplate
+                    from langchain_core.output_parsers import StrOutputParser
+                    parser = config.JsonParser(agent=self.name) if self.parser == "json" else StrOutputParser()
+                    chain = ChatPromptTemplate.from_template(self.prompt) | getattr(config, self.llm) | parser
+                    self._chain = chain.with_config(callbacks=[_create_usage_handler(self.name)])
+        return self._chain
+
+    async def ainvoke(self, inputs: dict, **kwargs) -> Any:
+        chain = self.build()
+        started = time.perf_counter()
+        try:
+            with tracer.span(self.name, KIND_CLIENT, mode="invoke", model=self.llm):
+                return await chain.ainvoke(inputs, **kwargs)
+        except Exception:
+            agent_errors.inc(agent=self.name)
+            raise
+        finally:
+            agent_latency.observe(time.perf_counter() - started, agent=self.name, mode="invoke")
+
+    async def astream(self, inputs: dict, **kwargs) -> AsyncIterator[Any]:
+        chain = self.build()
+        started = time.perf_counter()
+        first = True
+        chunks = 0
+        # Не текущий спан: между yield управление у потребителя, его спаны — не внутри вызова модели
+        span = tracer.start_span(self.name, KIND_CLIENT, activate=False, mode="stream", model=self.llm)
+        error = None
+        try:
+            async for chunk in chain.astream(inputs, **kwargs):
+                if first:
+                    agent_first_chunk.observe(time.perf_counter() - started, agent=self.name)
+                    if span:
+                        span.set(first_chunk_s=round(time.perf_counter() - started, 6))
+                    first = False
+                chunks += 1
+                yield chunk
+        except GeneratorExit:
+            raise  # потребитель остановился сам
+        except BaseException as e:
+            error = e
+            if isinstance(e, Exception):
+                agent_errors.inc(agent=self.name)
+            raise
+        finally:
+            agent_latency.observe(time.perf_counter() - started, agent=self.name, mode="stream")
+            if span:
+                span.set(chunks=chunks)
+            tracer.end_span(span, error)
+
+
+def _create_usage_handler(agent: str):
+    """Callback langchain: токены из usage_metadata ответа (или оценка по длине текста, если модель их не вернула)."""
+    from langchain_core.callbacks import BaseCallbackHandler
+    from Bot_tg.context_builder import estimate_tokens
+
+    class UsageHandler(BaseCallbackHandler):
+        run_inline = True
+
+        def __init__(self):
+            self._prompt_tokens = {}
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+            text = "".join(str(m.content) for batch in messages for m in batch)
+            self._prompt_tokens[run_id] = estimate_tokens(text)
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            estimated_input = self._prompt_tokens.pop(run_id, 0)
+            for generations in response.generations:
+                for generation in generations:
+                    usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    agent_tokens.observe(usage.get("input_tokens") or estimated_input, agent=agent, direction="input")
+                    agent_tokens.observe(usage.get("output_tokens") or estimate_tokens(generation.text),
+                                         agent=agent, direction="output")
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            self._prompt_tokens.pop(run_id, None)
+
+    return UsageHandler()
+
+
+_registry: List[LazyChain] = []
+
+
+def warm_up():
+    """
+    Собирает все объявленные цепочки (для фонового прогрева при старте бота).
+    Ошибка (нет GOOGLE_API_KEY, не ставится langchain) не фатальна, но пробрасывается:
+    app пишет ее в лог, а цепочка повторит сборку при первом вызове.
+    """
+    for chain in list(_registry):
+        chain.build()
+    logger.info(f"[CHAINS] Прогреты цепочки агентов: {len(_registry)}.")
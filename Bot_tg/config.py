@@ -1,11 +1,11 @@
 import os
 import re
+import sys
 import json
-from typing import List, Dict, Optional
+import threading
+from typing import Any, Callable, List, Dict, Optional, Tuple
 from datetime import datetime
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.output_parsers import StrOutputParser
 from pydantic import BaseModel, Field
 
 # --- Загрузка и настройки ---
@@ -16,15 +16,118 @@ TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
 PROFILE_FILE = os.path.join(PROJECT_ROOT, "profile.md")
-RESULTS_DIR = os.path.join(PROJECT_ROOT, "results")
-RESULTS_FILE = os.path.join(RESULTS_DIR, "results.json")
+# Каталог данных бота (профили, журнал, прогресс); бенчмарки подменяют его на временный
+RESULTS_DIR = os.getenv("RESULTS_DIR", os.path.join(PROJECT_ROOT, "results"))
+RESULTS_FILE = os.path.join(RESULTS_DIR, "results.json")  # устаревший формат, переносится в журнал
+RESULTS_JOURNAL_DIR = os.path.join(RESULTS_DIR, "journal")
+RESULTS_SEGMENT_MAX_BYTES = int(os.getenv("RESULTS_SEGMENT_MAX_BYTES", str(8 * 1024 * 1024)))
+RESULTS_COMMIT_WINDOW = float(os.getenv("RESULTS_COMMIT_WINDOW", "0.05"))
 WEBAPP_HTML_FILE = os.path.join(PROJECT_ROOT, "index.html")
 # Ссылка на GitHub Pages для WebApp
 GITHUB_PAGES_URL = "https://magneticdogson.github.io/Ask_me_bot/" 
+# Формат вопросов в ссылке WebApp: 2 — #v=2&z=<deflate+base64url>, 1 — старый #d=<base64url JSON>
+WEBAPP_PAYLOAD_VERSION = int(os.getenv("WEBAPP_PAYLOAD_VERSION", "2"))
+# Статические анкеты как паки на GitHub Pages (#p=<id>&i=...): собираются scripts/build_question_packs.py
+WEBAPP_PACKS_ENABLED = os.getenv("WEBAPP_PACKS_ENABLED", "true").lower() == "true"
+WEBAPP_PACKS_DIR = os.path.join(PROJECT_ROOT, "docs", "packs")
+WEBAPP_PACKS_SOURCE_DIR = os.path.join(PROJECT_ROOT, "web", "public", "packs")
 GREETING_QUESTIONS_FILE = os.path.join(PROJECT_ROOT, "data", "greeting_questions.json") 
 TELOS_DEFAULT_FILE = os.path.join(PROJECT_ROOT, "data", "telos.md") 
 TELOS_QUESTIONS_FILE = os.path.join(PROJECT_ROOT, "data", "telos_questions.json")
-USER_PROGRESS_FILE = os.path.join(RESULTS_DIR, "user_progress.json") 
+USER_PROGRESS_FILE = os.path.join(RESULTS_DIR, "user_progress.json")  # устаревший формат, переносится в SQLite
+PROGRESS_DB_FILE = os.path.join(RESULTS_DIR, "progress.sqlite3")
+
+# Сессии опросов: memory (один процесс), sqlite (несколько процессов на машине), redis (несколько машин)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory").lower()
+SESSION_DB_FILE = os.getenv("SESSION_DB_FILE", os.path.join(RESULTS_DIR, "sessions.sqlite3"))
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "redis://127.0.0.1:6379/0")  # через запятую — шарды
+SESSION_TTL = float(os.getenv("SESSION_TTL", "3600"))
+
+# Несколько воркеров одного бота: чат закреплен за воркером WORKER_INDEX из WORKER_COUNT.
+# Только в режиме webhook: в polling каждый воркер получил бы все апдейты.
+# WORKER_PEERS — базовые URL всех воркеров по порядку (для пересылки чужих апдейтов в режиме webhook)
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "1"))
+WORKER_PEERS = [u.strip().rstrip("/") for u in os.getenv("WORKER_PEERS", "").split(",") if u.strip()]
+
+# Режим получения апдейтов: polling (по умолчанию) или webhook (HTTP-сервер, можно несколько реплик)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный адрес; если пуст, вебхук регистрируется вручную
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+# Сколько апдейтов (разных чатов) обрабатываются одновременно; апдейты одного чата — строго по очереди
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", os.getenv("WEBHOOK_WORKERS", "64")))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "20"))
+# Запись принятых апдейтов в JSONL для воспроизведения нагрузки (benchmarks/load.py --replay); пусто — не писать
+WEBHOOK_RECORD_FILE = os.getenv("WEBHOOK_RECORD_FILE") or None
+
+# Метрики Prometheus (/metrics и /metrics.json) на отдельном порту; 0 — не поднимать
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Трассировка апдейтов: спаны в JSONL (OTLP/JSON, строка на трассу), разбор — scripts/slow_traces.py.
+# Пустой TRACE_FILE — выключено. Медленные (от TRACE_SLOW_SECONDS) и упавшие трассы пишутся всегда,
+# остальные — с вероятностью TRACE_SAMPLE_RATE. При TRACE_MAX_BYTES файл уезжает в .1
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join(RESULTS_DIR, "traces.jsonl")) or None
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.05"))
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "5"))
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Планировщик LLM-вызовов: общий лимит, доля фона, размеры очередей и таймаут ожидания слота
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_BACKGROUND_MAX_CONCURRENCY = int(os.getenv("LLM_BACKGROUND_MAX_CONCURRENCY", "4"))
+LLM_MAX_INTERACTIVE_QUEUE = int(os.getenv("LLM_MAX_INTERACTIVE_QUEUE", "50"))
+LLM_MAX_BACKGROUND_QUEUE = int(os.getenv("LLM_MAX_BACKGROUND_QUEUE", "200"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "20"))
+
+# Агент 3: точечные правки разделов вместо полной перезаписи (для профилей от PROFILE_PATCH_MIN_CHARS)
+PROFILE_PATCH_ENABLED = os.getenv("PROFILE_PATCH_ENABLED", "1") == "1"
+PROFILE_PATCH_MIN_CHARS = int(os.getenv("PROFILE_PATCH_MIN_CHARS", "1500"))
+
+# Контекст профиля для промптов: только нужные агенту разделы, в пределах бюджета токенов
+PROFILE_CONTEXT_ENABLED = os.getenv("PROFILE_CONTEXT_ENABLED", "1") == "1"
+PROFILE_CONTEXT_BUDGET = int(os.getenv("PROFILE_CONTEXT_BUDGET", "2500"))
+PROFILE_CONTEXT_EXCERPT_CHARS = int(os.getenv("PROFILE_CONTEXT_EXCERPT_CHARS", "400"))
+
+# Кэш ответов агентов-генераторов вопросов (ключ — хэш профиля)
+AGENT_CACHE_ENABLED = os.getenv("AGENT_CACHE_ENABLED", "1") == "1"
+AGENT_CACHE_SIZE = int(os.getenv("AGENT_CACHE_SIZE", "1024"))
+AGENT_CACHE_TTL = float(os.getenv("AGENT_CACHE_TTL", str(24 * 3600)))
+AGENT_CACHE_FILE = os.getenv("AGENT_CACHE_FILE", os.path.join(RESULTS_DIR, "agent_cache.json")) or None
+
+# Префетч: фоновая генерация вопросов после каждой записи профиля (по умолчанию выключен)
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "0") == "1"
+PREFETCH_AGENTS = [a.strip() for a in os.getenv("PREFETCH_AGENTS", "agent_04,agent_06").split(",") if a.strip()]
+PREFETCH_DELAY = float(os.getenv("PREFETCH_DELAY", "2.0"))
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "2"))
+
+# Исходящие сообщения: лимиты Telegram (~30 msg/s на бота, ~1 msg/s на чат)
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "25"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+SEND_QUEUE_WARN_DEPTH = int(os.getenv("SEND_QUEUE_WARN_DEPTH", "500"))
+
+# Ежедневные вопросы: час и часовой пояс по умолчанию (пусто — зона сервера), разброс волны
+DAILY_DEFAULT_HOUR = int(os.getenv("DAILY_DEFAULT_HOUR", "18"))
+DAILY_DEFAULT_TZ = os.getenv("DAILY_DEFAULT_TZ") or None
+DAILY_JITTER_SECONDS = float(os.getenv("DAILY_JITTER_SECONDS", "900"))
+DAILY_MISSED_GRACE_HOURS = float(os.getenv("DAILY_MISSED_GRACE_HOURS", "6"))
+
+# Стриминг длинных анализов (Икигай, Тень) правками сообщения
+STREAMING_ENABLED = os.getenv("STREAMING_ENABLED", "1") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+
+# Хранилище профилей: по файлу на chat_id в шардированных папках
+PROFILES_DIR = os.path.join(RESULTS_DIR, "profiles")
+PROFILE_SHARDS = int(os.getenv("PROFILE_SHARDS", "64"))
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "512"))
+PROFILE_FLUSH_INTERVAL = float(os.getenv("PROFILE_FLUSH_INTERVAL", "2.0"))
+# chat_id владельца старого единого profile.md (подхватывается, пока нет личного файла)
+LEGACY_PROFILE_CHAT_ID = os.getenv("LEGACY_PROFILE_CHAT_ID")
 
 if not os.path.exists(RESULTS_DIR):
     os.makedirs(RESULTS_DIR)
@@ -54,28 +157,71 @@ def setup_proxy():
     else:
         print("[PROXY] Переменные для прокси не найдены, работаем напрямую.")
 
-# Активация прокси
-setup_proxy()
+# --- Инициализация LLM (лениво) ---
+# langchain и SDK Google тяжелые: импортируются и создаются при первом обращении
+# к llm_pro / llm_flash / JsonParser (PEP 562), а не при импорте config.
+_lazy_lock = threading.RLock()
+_proxy_ready = False
+
+def _create_llm():
+    if not GOOGLE_API_KEY:
+        raise ValueError("Не найден GOOGLE_API_KEY в .env файле.")
+    global _proxy_ready
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    # Прокси нужен только клиенту Gemini: выставляем его перед созданием первой модели
+    if not _proxy_ready:
+        setup_proxy()
+        _proxy_ready = True
+    llm = ChatGoogleGenerativeAI(
+        model="gemini-3-flash-preview",
+        google_api_key=GOOGLE_API_KEY,
+        temperature=0.7
+    )
+    print("[CONFIG] Модель Gemini инициализирована (gemini-3-flash-preview).")
+    return llm
+
+def _create_json_parser():
+    from langchain_core.output_parsers import StrOutputParser
+
+    from Bot_tg.metrics import json_parse_failures
+    from Bot_tg.tracing import tracer
+
+    class JsonParser(StrOutputParser):
+        """Парсер для извлечения JSON из ответа модели, даже если он обернут в markdown."""
+        agent: str = ""  # метка в askme_json_parse_failures_total
 
-# --- Инициализация LLM ---
-if not GOOGLE_API_KEY:
-    raise ValueError("Не найден GOOGLE_API_KEY в .env файле.")
+        def parse(self, text: str) -> List[Dict]:
+            with tracer.span("json_parse", agent=self.agent, chars=len(text)) as span:
+                try:
+                    json_match = re.search(r"```json\n(.*)\n```", text, re.DOTALL)
+                    if json_match:
+                        text = json_match.group(1)
+                    return json.loads(text)
+                except (json.JSONDecodeError, AttributeError) as e:
+                    json_parse_failures.inc(agent=self.agent)
+                    print(f"[ERROR] Ошибка парсинга JSON ({self.agent or 'агент?'}): {e}")
+                    if span:
+                        span.set(failed=True)
+                    return []
 
-# Модель для сложных, аналитических задач
-llm_pro = ChatGoogleGenerativeAI(
-    model="gemini-3-flash-preview", 
-    google_api_key=GOOGLE_API_KEY,
-    temperature=0.7
-)
+    return JsonParser
 
-# Модель для быстрых, утилитарных задач
-llm_flash = ChatGoogleGenerativeAI(
-    model="gemini-3-flash-preview",
-    google_api_key=GOOGLE_API_KEY,
-    temperature=0.7
-)
+_LAZY: Dict[str, Callable[[], Any]] = {
+    # Модель для сложных, аналитических задач
+    "llm_pro": _create_llm,
+    # Модель для быстрых, утилитарных задач
+    "llm_flash": _create_llm,
+    "JsonParser": _create_json_parser,
+}
 
-print("[CONFIG] Модели Gemini инициализированы (gemini-3-flash-preview).")
+def __getattr__(name: str):
+    factory = _LAZY.get(name)
+    if factory is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _lazy_lock:
+        if name not in globals():
+            globals()[name] = factory()
+    return globals()[name]
 
 # --- Схемы данных (Schemas) ---
 class Interaction(BaseModel):
@@ -99,14 +245,71 @@ def load_prompt_text(file_path: str) -> str:
         print(f"[ERROR] Файл промпта не найден: {file_path}")
         return ""
 
-class JsonParser(StrOutputParser):
-    """Парсер для извлечения JSON из ответа модели, даже если он обернут в markdown."""
-    def parse(self, text: str) -> List[Dict]:
-        try:
-            json_match = re.search(r"```json\n(.*)\n```", text, re.DOTALL)
-            if json_match:
-                text = json_match.group(1)
-            return json.loads(text)
-        except (json.JSONDecodeError, AttributeError) as e:
-            print(f"[ERROR] Ошибка парсинга JSON: {e}")
-            return []
+# --- Проверка настроек (python -m Bot_tg.config --check-config) ---
+def check_config() -> Tuple[List[str], List[str]]:
+    """Проверяет настройки без импорта langchain и без сети. Возвращает (ошибки, предупреждения)."""
+    import importlib.util
+    errors, warnings = [], []
+    if not TELEGRAM_BOT_TOKEN:
+        errors.append("TELEGRAM_BOT_TOKEN не задан")
+    elif not re.fullmatch(r"\d+:[\w-]{30,}", TELEGRAM_BOT_TOKEN):
+        warnings.append("TELEGRAM_BOT_TOKEN не похож на токен бота (<id>:<secret>)")
+    if not GOOGLE_API_KEY:
+        errors.append("GOOGLE_API_KEY не задан")
+    if importlib.util.find_spec("langchain_google_genai") is None:
+        errors.append("пакет langchain-google-genai не установлен")
+
+    for path in (GREETING_QUESTIONS_FILE, TELOS_QUESTIONS_FILE, TELOS_DEFAULT_FILE):
+        if not os.path.exists(path):
+            errors.append(f"нет файла {path}")
+    if not os.access(RESULTS_DIR, os.W_OK):
+        errors.append(f"нет прав на запись в {RESULTS_DIR}")
+
+    if BOT_MODE not in ("polling", "webhook"):
+        errors.append(f"BOT_MODE={BOT_MODE}: ожидается polling или webhook")
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_SECRET:
+            warnings.append("WEBHOOK_SECRET не задан: вебхук примет запросы от кого угодно")
+        if not WEBHOOK_URL:
+            warnings.append("WEBHOOK_URL не задан: вебхук нужно зарегистрировать вручную")
+    if SESSION_BACKEND not in ("memory", "sqlite", "redis"):
+        errors.append(f"SESSION_BACKEND={SESSION_BACKEND}: ожидается memory, sqlite или redis")
+    if not 0 <= WORKER_INDEX < max(WORKER_COUNT, 1):
+        errors.append(f"WORKER_INDEX={WORKER_INDEX} вне диапазона 0..{WORKER_COUNT - 1}")
+    if WORKER_COUNT > 1:
+        if SESSION_BACKEND == "memory":
+            errors.append("WORKER_COUNT > 1 требует общего SESSION_BACKEND (sqlite или redis)")
+        if BOT_MODE == "polling":
+            errors.append("WORKER_COUNT > 1 требует BOT_MODE=webhook: getUpdates отдает все чаты каждому воркеру")
+        if BOT_MODE == "webhook" and len(WORKER_PEERS) != WORKER_COUNT:
+            errors.append(f"WORKER_PEERS: {len(WORKER_PEERS)} адресов, а воркеров {WORKER_COUNT}")
+    if WEBAPP_PAYLOAD_VERSION not in (1, 2):
+        errors.append(f"WEBAPP_PAYLOAD_VERSION={WEBAPP_PAYLOAD_VERSION}: поддерживаются 1 и 2")
+    if LLM_BACKGROUND_MAX_CONCURRENCY > LLM_MAX_CONCURRENCY:
+        warnings.append("LLM_BACKGROUND_MAX_CONCURRENCY больше LLM_MAX_CONCURRENCY")
+    return errors, warnings
+
+def _mask(value: Optional[str]) -> str:
+    return f"{value[:4]}…({len(value)})" if value else "—"
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+    parser = argparse.ArgumentParser(description="Настройки бота")
+    parser.add_argument("--check-config", action="store_true", help="проверить настройки и выйти")
+    args = parser.parse_args(argv)
+    if not args.check_config:
+        parser.print_help()
+        return 0
+    errors, warnings = check_config()
+    print(f"[CONFIG] TELEGRAM_BOT_TOKEN={_mask(TELEGRAM_BOT_TOKEN)} GOOGLE_API_KEY={_mask(GOOGLE_API_KEY)}")
+    print(f"[CONFIG] BOT_MODE={BOT_MODE} SESSION_BACKEND={SESSION_BACKEND} "
+          f"WORKER={WORKER_INDEX}/{WORKER_COUNT}")
+    for warning in warnings:
+        print(f"[CONFIG] Предупреждение: {warning}")
+    for error in errors:
+        print(f"[CONFIG] Ошибка: {error}")
+    print("[CONFIG] Настройки в порядке." if not errors else f"[CONFIG] Ошибок: {len(errors)}.")
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+import math
+import logging
+from typing import Dict, List, NamedTuple, Tuple
+
+from Bot_tg.config import PROFILE_CONTEXT_ENABLED, PROFILE_CONTEXT_BUDGET, PROFILE_CONTEXT_EXCERPT_CHARS
+from Bot_tg.profile_sections import ProfileDocument, Section
+from Bot_tg.profile_store import profile_store
+from Bot_tg.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Грубая оценка: русский текст в токенизаторах Gemini/GPT — около 3 символов на токен
+CHARS_PER_TOKEN = 3.0
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+class ContextSpec(NamedTuple):
+    priority: Tuple[int, ...]   # номера разделов по убыванию важности для агента
+    include_rest: bool = False  # остальные разделы — низкий приоритет, если влезают в бюджет
+
+
+# Какие разделы TELOS нужны каждому агенту (agent_03 всегда получает профиль целиком)
+AGENT_CONTEXT: Dict[str, ContextSpec] = {
+    "agent_01": ContextSpec((5, 6, 3, 2)),
+    "agent_02": ContextSpec((2, 11, 12, 1)),
+    "agent_04": ContextSpec((1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15), include_rest=True),
+    "agent_05": ContextSpec((5, 4, 7, 10, 9)),
+    "agent_06": ContextSpec((3, 5, 6, 15, 4, 7), include_rest=True),
+    "agent_07": ContextSpec((5, 6, 4, 3, 8, 14, 15, 16), include_rest=True),
+    "agent_08": ContextSpec((3, 12, 9, 6, 5, 15, 17)),
+}
+
+# Накопительная статистика: сколько токенов было бы в полном профиле и сколько ушло на самом деле
+context_stats = {"calls": 0, "tokens_full": 0, "tokens_sent": 0}
+registry.counter("askme_context_builds_total", "Сборки контекста профиля для агентов",
+                 collect=lambda: context_stats["calls"])
+registry.counter("askme_context_tokens_total", "Токены профиля: полный текст и реально отправленный контекст", ["kind"],
+                 collect=lambda: {("full",): context_stats["tokens_full"], ("sent",): context_stats["tokens_sent"]})
+
+
+def _excerpt(body: str, limit: int) -> str:
+    """Краткое изложение раздела: начало текста до границы предложения или строки."""
+    if len(body) <= limit:
+        return body
+    cut = max(body.rfind(". ", 0, limit), body.rfind("\n", 0, limit))
+    if cut < limit // 2:
+        cut = limit
+    return body[:cut + 1].rstrip() + " …"
+
+
+def _render(parts: List[Tuple[Section, str]]) -> str:
+    return "\n\n".join(f"{section.header.strip()}\n{body}".rstrip() for section, body in parts) + "\n"
+
+
+def build_context(document: ProfileDocument, agent: str, budget: int = PROFILE_CONTEXT_BUDGET,
+                  excerpt_chars: int = PROFILE_CONTEXT_EXCERPT_CHARS) -> str:
+    """
+    Собирает профиль для промпта агента: нужные ему разделы в порядке документа,
+    в пределах бюджета токенов. При превышении сначала сокращаются до выдержек, а затем
+    выбрасываются разделы с наименьшим приоритетом; самый важный раздел только сокращается.
+    """
+    full_text = document.text
+    spec = AGENT_CONTEXT.get(agent)
+    if spec is None:
+        return full_text
+    if not document.sections:
+        # Профиль без разделов TELOS: только ограничиваем длину
+        return _excerpt(full_text, int(budget * CHARS_PER_TOKEN))
+
+    rank = {number: i for i, number in enumerate(spec.priority)}
+    chosen = [s for s in document.sections if s.number in rank or spec.include_rest]
+    # Очередь на сокращение: сначала "прочие" разделы с конца документа, затем приоритетные с конца списка
+    order = sorted(range(len(chosen)), key=lambda i: (rank.get(chosen[i].number, len(rank)), i), reverse=True)
+
+    bodies = {i: chosen[i].body for i in range(len(chosen))}
+    used = sum(estimate_tokens(chosen[i].header) + estimate_tokens(b) for i, b in bodies.items())
+    if used > budget:
+        for i in order:
+            short = _excerpt(bodies[i], excerpt_chars)
+            used -= estimate_tokens(bodies[i]) - estimate_tokens(short)
+            bodies[i] = short
+            if used <= budget:
+                break
+    if used > budget:
+        for i in order[:-1]:
+            used -= estimate_tokens(chosen[i].header) + estimate_tokens(bodies.pop(i))
+            if used <= budget:
+                break
+
+    text = _render([(chosen[i], bodies[i]) for i in sorted(bodies)])
+    full_tokens, sent_tokens = estimate_tokens(full_text), estimate_tokens(text)
+    context_stats["calls"] += 1
+    context_stats["tokens_full"] += full_tokens
+    context_stats["tokens_sent"] += sent_tokens
+    logger.info(f"[CONTEXT] {agent}: {sent_tokens} из {full_tokens} токенов профиля "
+                f"(сэкономлено {full_tokens - sent_tokens}).")
+    return text
+
+
+async def profile_context(chat_id, agent: str) -> str:
+    """Профиль пользователя в виде, подготовленном для промпта конкретного агента."""
+    if not PROFILE_CONTEXT_ENABLED:
+        return await profile_store.get(chat_id)
+    document = await profile_store.get_document(chat_id)
+    return build_context(document, agent)
@@ -2,35 +2,50 @@ import json
 import asyncio
 from datetime import datetime
 from Bot_tg.config import (
-    PROFILE_FILE, RESULTS_FILE, USER_PROGRESS_FILE, GITHUB_PAGES_URL,
-    FinalResult, Interaction
+    GITHUB_PAGES_URL, STREAMING_ENABLED,
+    FinalResult
 )
 from Bot_tg.agents import (
-    agent_03, agent_04, agent_06, agent_07_analysis, generate_webapp_url
+    agent_04, agent_06, agent_07_analysis, agent_07_analysis_stream, generate_webapp_url
 )
-from Bot_tg.utils import read_file_sync, write_file_sync, load_json_sync, write_json_sync, create_initial_profile
-from Bot_tg.state_manager import user_states, save_user_progress, user_progress
+from Bot_tg.utils import create_initial_profile
+from Bot_tg.profile_store import profile_store
+from Bot_tg.profile_updater import profile_updater
+from Bot_tg.profile_sections import IKIGAI_HEADER, strip_section_header
+from Bot_tg.sender import send_message
+from Bot_tg.llm_scheduler import Lane, LLMBusyError
+from Bot_tg.streaming import stream_to_chat
+from Bot_tg.results_journal import results_journal
+from Bot_tg.question_pool import get_telos_pool
+from Bot_tg.state_manager import add_answered
+from Bot_tg.session import SessionMode
+from Bot_tg.session_store import session_store, new_session
 
-def append_to_json_file(result: FinalResult):
+async def record_result(chat_id, result: FinalResult):
     try:
-        all_results = load_json_sync(RESULTS_FILE)
-        all_results.append(result.model_dump())
-        write_json_sync(RESULTS_FILE, all_results)
+        await results_journal.append(chat_id, result)
     except IOError as e:
-        print(f"[FLOW] Ошибка при работе с файлом результатов: {e}")
+        print(f"[FLOW] Ошибка при записи в журнал результатов: {e}")
+
+async def update_profile_now(chat_id, state):
+    """
+    Обновляет профиль ответами сессии и ждет agent_03. Если обновление сброшено или
+    не удалось, бросает LLMBusyError: обработчик оставит сессию, и ответы можно отправить снова.
+    """
+    answers_list = [i.model_dump() for i in state.interactions]
+    if not await profile_updater.submit(chat_id, answers_list, lane=Lane.INTERACTIVE):
+        raise LLMBusyError("agent_03")
 
 async def on_default_completion(bot, chat_id, state):
-    await bot.send_message(chat_id, "Спасибо за ответы. Обрабатываю информацию и обновляю ваш профиль...")
-    answers_list = [i.model_dump() for i in state["interactions"]]
-    answers_json = json.dumps(answers_list, ensure_ascii=False, indent=2)
-    await agent_03(answers_json)
-    await bot.send_message(chat_id, "Профиль обновлен. Теперь, чтобы закрепить результат, я проведу глубокий анализ...")
+    await send_message(bot, chat_id, "Спасибо за ответы. Обрабатываю информацию и обновляю ваш профиль...")
+    await update_profile_now(chat_id, state)
+    await send_message(bot, chat_id, "Профиль обновлен. Теперь, чтобы закрепить результат, я проведу глубокий анализ...")
     
     try:
-        questions_data = await agent_06()
+        questions_data = await agent_06(chat_id)
         if not questions_data or len(questions_data) < 1:
-            await bot.send_message(chat_id, "На данном этапе вопросов больше нет.")
-            user_states.pop(chat_id, None)
+            await send_message(bot, chat_id, "На данном этапе вопросов больше нет.")
+            await session_store.delete(chat_id)
             return
 
         questions_data = questions_data[:5]
@@ -39,102 +54,88 @@ async def on_default_completion(bot, chat_id, state):
         markup = ReplyKeyboardMarkup(resize_keyboard=True)
         markup.add(KeyboardButton("🧠 НАЧАТЬ ИССЛЕДОВАНИЕ", web_app=WebAppInfo(url=url)))
         
-        await bot.send_message(chat_id, f"Я сформировал {len(questions_data)} глубоких вопросов для уточнения вашего портрета.", reply_markup=markup)
+        await send_message(bot, chat_id, f"Я сформировал {len(questions_data)} глубоких вопросов для уточнения вашего портрета.", reply_markup=markup)
         
-        user_states[chat_id] = {
-            "mode": "analysis", 
-            "questions": questions_data, 
-            "step": 0, 
-            "interactions": [],
-            "last_activity": datetime.now()
-        }
+        await session_store.set(chat_id, new_session(SessionMode.ANALYSIS, questions_data))
     except Exception as e:
         print(f"[FLOW] Ошибка при переходе к Agent 06: {e}")
-        await bot.send_message(chat_id, "Произошла ошибка при генерации дополнительных вопросов.")
-        user_states.pop(chat_id, None)
+        await send_message(bot, chat_id, "Произошла ошибка при генерации дополнительных вопросов.")
+        await session_store.delete(chat_id)
 
     final_result = FinalResult(
         session_id=f"{chat_id}_initial_{datetime.now().strftime('%Y%m%d%H%M%S')}", 
-        original_text=state.get("original_text", ""), 
-        interactions=state["interactions"], 
+        original_text=state.original_text or "", 
+        interactions=state.interactions, 
         final_text="Первичный сбор данных через Agent 01 завершен.", 
         timestamp=datetime.now().isoformat()
     )
-    await asyncio.to_thread(append_to_json_file, final_result)
+    await record_result(chat_id, final_result)
 
 async def on_profiling_completion(bot, chat_id, state):
-    await bot.send_message(chat_id, "Спасибо за ответы! Обновляю ваш профиль...")
+    await send_message(bot, chat_id, "Спасибо за ответы! Обновляю ваш профиль...")
     final_result = FinalResult(
         session_id=f"{chat_id}_profile_{datetime.now().strftime('%Y%m%d%H%M%S')}", 
         original_text="Профилирование по команде /profile", 
-        interactions=state["interactions"], 
+        interactions=state.interactions, 
         final_text="Пользователь ответил на вопросы для углубления профиля.", 
         timestamp=datetime.now().isoformat()
     )
-    await asyncio.to_thread(append_to_json_file, final_result)
+    await record_result(chat_id, final_result)
     
-    # Run Agent 03 in background
-    answers_list = [i.model_dump() for i in state["interactions"]]
-    answers_json = json.dumps(answers_list, ensure_ascii=False, indent=2)
-    asyncio.create_task(agent_03(answers_json))
+    # Agent 03 in background (coalesced per chat)
+    answers_list = [i.model_dump() for i in state.interactions]
+    profile_updater.submit(chat_id, answers_list)
     
-    user_states.pop(chat_id, None)
+    await session_store.delete(chat_id)
 
 async def on_onboarding_completion(bot, chat_id, state):
-    await bot.send_message(chat_id, "Большое спасибо за ответы! Создаю ваш персональный профиль...")
-    await asyncio.to_thread(create_initial_profile, state["interactions"])
-    await bot.send_message(chat_id, "Профиль успешно заполнен! Теперь вы можете использовать команду /profile для его дополнения или просто общаться со мной.")
-    user_states.pop(chat_id, None)
+    await send_message(bot, chat_id, "Большое спасибо за ответы! Создаю ваш персональный профиль...")
+    profile_text = await asyncio.to_thread(create_initial_profile, state.interactions)
+    await profile_store.put(chat_id, profile_text, backup=True)
+    await send_message(bot, chat_id, "Профиль успешно заполнен! Теперь вы можете использовать команду /profile для его дополнения или просто общаться со мной.")
+    await session_store.delete(chat_id)
 
 async def on_analysis_completion(bot, chat_id, state):
-    await bot.send_message(chat_id, "Благодарю за откровенность. Это ценная информация.")
-    await bot.send_message(chat_id, "⏳ Обновляю ваш профиль, добавляя новые грани личности...")
-    
-    answers_list = [i.model_dump() for i in state["interactions"]]
-    answers_json = json.dumps(answers_list, ensure_ascii=False, indent=2)
-    await agent_03(answers_json)
+    await send_message(bot, chat_id, "Благодарю за откровенность. Это ценная информация.")
+    await send_message(bot, chat_id, "⏳ Обновляю ваш профиль, добавляя новые грани личности...")
+    await update_profile_now(chat_id, state)
     
-    user_states.pop(chat_id, None)
+    await session_store.delete(chat_id)
 
 async def on_ikigai_completion(bot, chat_id, state):
-    await bot.send_message(chat_id, "Ответы приняты. Медитирую над вашим Икигай...")
-    answers_list = [i.model_dump() for i in state["interactions"]]
+    await send_message(bot, chat_id, "Ответы приняты. Медитирую над вашим Икигай...")
+    answers_list = [i.model_dump() for i in state.interactions]
     answers_json = json.dumps(answers_list, ensure_ascii=False, indent=2)
-    analysis_text = await agent_07_analysis(answers_json)
-    await bot.send_message(chat_id, f"**ВАШ ИКИГАЙ BLUEPRINT (2026):**\n\n{analysis_text}", parse_mode='Markdown')
-
-    current_profile = await asyncio.to_thread(read_file_sync, PROFILE_FILE)
-    header = "### 16. IKIGAI BLUEPRINT"
-    if header in current_profile:
-        parts = current_profile.split(header)
-        new_profile = parts[0].strip() + "\n\n" + analysis_text
+    title = "**ВАШ ИКИГАЙ BLUEPRINT (2026):**\n\n"
+    if STREAMING_ENABLED:
+        analysis_text = await stream_to_chat(bot, chat_id, agent_07_analysis_stream(chat_id, answers_json), header=title)
     else:
-        new_profile = current_profile.strip() + "\n\n" + analysis_text
-    
-    await asyncio.to_thread(write_file_sync, PROFILE_FILE, new_profile)
-    await bot.send_message(chat_id, "Этот анализ навсегда сохранен в вашем профиле.")
-    user_states.pop(chat_id, None)
+        analysis_text = await agent_07_analysis(chat_id, answers_json)
+        await send_message(bot, chat_id, f"{title}{analysis_text}", parse_mode='Markdown')
+
+    document = await profile_store.get_document(chat_id)
+    document.replace(IKIGAI_HEADER, strip_section_header(analysis_text, IKIGAI_HEADER))
+    await profile_store.put_document(chat_id, document)
+    await send_message(bot, chat_id, "Этот анализ навсегда сохранен в вашем профиле.")
+    await session_store.delete(chat_id)
 
 async def on_continuing_completion(bot, chat_id, state):
-    await bot.send_message(chat_id, "Ответы приняты! Обновляю ваш прогресс и профиль...")
-    cid = str(chat_id)
-    answered_texts = [i.question for i in state["interactions"]]
-    if cid not in user_progress: user_progress[cid] = []
-    user_progress[cid].extend(answered_texts)
-    await asyncio.to_thread(save_user_progress, USER_PROGRESS_FILE)
+    await send_message(bot, chat_id, "Ответы приняты! Обновляю ваш прогресс и профиль...")
+    pool = get_telos_pool()
+    answered_ids = [pool.id_for_text(i.question) for i in state.interactions]
+    await asyncio.to_thread(add_answered, chat_id, [qid for qid in answered_ids if qid])
     
-    answers_list = [i.model_dump() for i in state["interactions"]]
-    answers_json = json.dumps(answers_list, ensure_ascii=False, indent=2)
-    asyncio.create_task(agent_03(answers_json))
+    answers_list = [i.model_dump() for i in state.interactions]
+    profile_updater.submit(chat_id, answers_list)
     
-    await bot.send_message(chat_id, "Профиль успешно обновлен! Следующая порция вопросов будет доступна завтра или по команде /continue.")
-    user_states.pop(chat_id, None)
+    await send_message(bot, chat_id, "Профиль успешно обновлен! Следующая порция вопросов будет доступна завтра или по команде /continue.")
+    await session_store.delete(chat_id)
 
 COMPLETION_HANDLERS = {
-    "default": on_default_completion,
-    "profiling": on_profiling_completion,
-    "onboarding": on_onboarding_completion,
-    "analysis": on_analysis_completion,
-    "ikigai": on_ikigai_completion,
-    "continuing_profile": on_continuing_completion
+    SessionMode.DEFAULT: on_default_completion,
+    SessionMode.PROFILING: on_profiling_completion,
+    SessionMode.ONBOARDING: on_onboarding_completion,
+    SessionMode.ANALYSIS: on_analysis_completion,
+    SessionMode.IKIGAI: on_ikigai_completion,
+    SessionMode.CONTINUING_PROFILE: on_continuing_completion
 }
@@ -1,224 +1,277 @@
 import json
 import asyncio
-import re
 from datetime import datetime
+from zoneinfo import ZoneInfoNotFoundError
 from telebot.types import ReplyKeyboardMarkup, KeyboardButton, WebAppInfo
+from telebot.asyncio_handler_backends import BaseMiddleware
 from Bot_tg.config import (
-    PROFILE_FILE, GITHUB_PAGES_URL, GREETING_QUESTIONS_FILE, 
-    TELOS_QUESTIONS_FILE, USER_PROGRESS_FILE, Interaction
+    GITHUB_PAGES_URL, GREETING_QUESTIONS_FILE, 
+    TELOS_QUESTIONS_FILE
 )
 from Bot_tg.agents import agent_01, agent_04, agent_06, agent_07_questions, generate_webapp_url
-from Bot_tg.utils import read_file_sync, load_json_sync, create_initial_profile
-from Bot_tg.state_manager import user_states, user_progress, register_user_activity, update_last_activity, save_user_progress
+from Bot_tg.profile_store import profile_store
+from Bot_tg.profile_sections import TASKS_HEADER
+from Bot_tg.sender import send_message
+from Bot_tg.llm_scheduler import LLMBusyError, BUSY_MESSAGE
+from Bot_tg.state_manager import register_user_activity
+from Bot_tg.session import SessionMode, load_question_set
+from Bot_tg.question_packs import pack_webapp_url
+from Bot_tg.session_store import session_store, new_session
 from Bot_tg.flow import COMPLETION_HANDLERS
+from Bot_tg.tracing import tracer, KIND_SERVER, KIND_INTERNAL
+
+class TracingMiddleware(BaseMiddleware):
+    """Спан обработчика на каждое сообщение; без внешней трассы (webhook) — новая трасса."""
+
+    def __init__(self):
+        super().__init__()
+        self.update_types = ['message']
+
+    async def pre_process(self, message, data):
+        text = message.text or ""
+        handler = text.split()[0].split("@")[0] if text.startswith("/") else message.content_type
+        new_trace = tracer.current() is None
+        data["trace_span"] = tracer.start_span(
+            f"handler {handler}", KIND_SERVER if new_trace else KIND_INTERNAL, new_trace=new_trace,
+            chat_id=message.chat.id, content_type=message.content_type
+        )
+
+    async def post_process(self, message, data, exception):
+        tracer.end_span(data.get("trace_span"), exception)
 
 def register_handlers(bot):
+    bot.setup_middleware(TracingMiddleware())
 
     @bot.message_handler(commands=['start'])
     async def start_message(message):
         chat_id = message.chat.id
-        if chat_id in user_states: user_states.pop(chat_id)
-        register_user_activity(chat_id, USER_PROGRESS_FILE)
-        profile_content = await asyncio.to_thread(read_file_sync, PROFILE_FILE)
+        await session_store.delete(chat_id)
+        register_user_activity(chat_id)
+        profile_content = await profile_store.get(chat_id)
         if not profile_content.strip():
             await handle_new_user_flow(bot, chat_id, message.from_user.first_name)
             return
-        await bot.send_message(chat_id, 'Привет! /greeting для знакомства, /profile для работы с профилем.')
+        await send_message(bot, chat_id, 'Привет! /greeting для знакомства, /profile для работы с профилем.')
 
     async def handle_new_user_flow(bot, chat_id, user_first_name):
         user_name = user_first_name or "Друг"
-        await bot.send_message(chat_id, f"Привет, {user_name}! Вижу, что мы еще не знакомы. Генерирую для тебя персональную анкету для настройки...")
-        questions = await asyncio.to_thread(load_json_sync, GREETING_QUESTIONS_FILE)
+        await send_message(bot, chat_id, f"Привет, {user_name}! Вижу, что мы еще не знакомы. Генерирую для тебя персональную анкету для настройки...")
+        questions = await asyncio.to_thread(load_question_set, GREETING_QUESTIONS_FILE)
         if questions:
-            url = generate_webapp_url(GITHUB_PAGES_URL, questions)
+            url = pack_webapp_url(GITHUB_PAGES_URL, questions.questions, pack_id=questions.id)
             markup = ReplyKeyboardMarkup(resize_keyboard=True)
             markup.add(KeyboardButton("ОТКРЫТЬ АНКЕТУ", web_app=WebAppInfo(url=url)))
-            await bot.send_message(chat_id, "Анкета готова! Нажми кнопку ниже, чтобы пройти быстрый тест личности (10 вопросов).", reply_markup=markup)
-            user_states[chat_id] = {
-                "mode": "onboarding", 
-                "questions": questions, 
-                "step": 0, 
-                "interactions": [],
-                "last_activity": datetime.now()
-            }
+            await send_message(bot, chat_id, "Анкета готова! Нажми кнопку ниже, чтобы пройти быстрый тест личности (10 вопросов).", reply_markup=markup)
+            await session_store.set(chat_id, new_session(SessionMode.ONBOARDING, questions))
         else:
-            await bot.send_message(chat_id, "Хм, возникла небольшая заминка при подготовке анкеты. Попробуй нажать /start еще раз.")
+            await send_message(bot, chat_id, "Хм, возникла небольшая заминка при подготовке анкеты. Попробуй нажать /start еще раз.")
 
     @bot.message_handler(commands=['greeting', 'greetings'])
     async def greeting_command(message):
         chat_id = message.chat.id
-        await bot.send_message(chat_id, "Моментально открываю анкету...")
-        questions = await asyncio.to_thread(load_json_sync, GREETING_QUESTIONS_FILE)
+        await send_message(bot, chat_id, "Моментально открываю анкету...")
+        questions = await asyncio.to_thread(load_question_set, GREETING_QUESTIONS_FILE)
         if not questions:
-            await bot.send_message(chat_id, "Ошибка загрузки вопросов.")
+            await send_message(bot, chat_id, "Ошибка загрузки вопросов.")
             return
-        url = generate_webapp_url(GITHUB_PAGES_URL, questions)
+        url = pack_webapp_url(GITHUB_PAGES_URL, questions.questions, pack_id=questions.id)
         markup = ReplyKeyboardMarkup(resize_keyboard=True)
         markup.add(KeyboardButton("📝 ОТКРЫТЬ АНКЕТУ", web_app=WebAppInfo(url=url)))
-        await bot.send_message(chat_id, "Вопросы готовы! Жми кнопку ниже 👇", reply_markup=markup)
-        user_states[chat_id] = {
-            "mode": "onboarding", 
-            "questions": questions, 
-            "step": 0, 
-            "interactions": [],
-            "last_activity": datetime.now()
-        }
-        register_user_activity(chat_id, USER_PROGRESS_FILE)
+        await send_message(bot, chat_id, "Вопросы готовы! Жми кнопку ниже 👇", reply_markup=markup)
+        await session_store.set(chat_id, new_session(SessionMode.ONBOARDING, questions))
+        register_user_activity(chat_id)
 
     @bot.message_handler(commands=['tasks'])
     async def tasks_command(message):
         chat_id = message.chat.id
-        await bot.send_message(chat_id, "Загружаю ваш актуальный план задач...")
+        await send_message(bot, chat_id, "Загружаю ваш актуальный план задач...")
         tasks_text = "Ваш список задач пока пуст. Сформулируйте цель в чате, чтобы я помог составить план!"
-        content = await asyncio.to_thread(read_file_sync, PROFILE_FILE)
-        if content:
-            match = re.search(r"### 9\. ЗАДАЧИ\n(.*?)(?=\n###|$)", content, re.DOTALL)
-            if match and match.group(1).strip():
-                tasks_text = f"**Ваш текущий план:**\n{match.group(1).strip()}"
-        await bot.send_message(chat_id, tasks_text, parse_mode='Markdown')
+        document = await profile_store.get_document(chat_id)
+        tasks = document.get(TASKS_HEADER).strip()
+        if tasks:
+            tasks_text = f"**Ваш текущий план:**\n{tasks}"
+        await send_message(bot, chat_id, tasks_text, parse_mode='Markdown')
 
     @bot.message_handler(commands=['profile'])
     async def profile_command(message):
         chat_id = message.chat.id
-        await bot.send_message(chat_id, "Анализирую твой профиль... Пожалуйста, подожди около 10-15 секунд.")
+        await send_message(bot, chat_id, "Анализирую твой профиль... Пожалуйста, подожди около 10-15 секунд.")
         try:
-            questions_data = await agent_04()
+            questions_data = await agent_04(chat_id)
             if not questions_data or len(questions_data) < 1:
-                await bot.send_message(chat_id, "Твой профиль уже достаточно подробный!")
+                await send_message(bot, chat_id, "Твой профиль уже достаточно подробный!")
                 return
             url = generate_webapp_url(GITHUB_PAGES_URL, questions_data)
             markup = ReplyKeyboardMarkup(resize_keyboard=True)
             markup.add(KeyboardButton("ЗАПОЛНИТЬ ПРОФИЛЬ", web_app=WebAppInfo(url=url)))
-            await bot.send_message(chat_id, "Я нашел интересные темы для обсуждения. Нажми кнопку ниже.", reply_markup=markup)
-            user_states[chat_id] = {
-                "mode": "profiling", 
-                "questions": questions_data, 
-                "step": 0, 
-                "interactions": [],
-                "last_activity": datetime.now()
-            }
+            await send_message(bot, chat_id, "Я нашел интересные темы для обсуждения. Нажми кнопку ниже.", reply_markup=markup)
+            await session_store.set(chat_id, new_session(SessionMode.PROFILING, questions_data))
+        except LLMBusyError:
+            await send_message(bot, chat_id, BUSY_MESSAGE)
         except Exception as e:
             print(f"[HANDLERS] Ошибка в /profile: {e}")
-            await bot.send_message(chat_id, "Ошибка при анализе профиля.")
+            await send_message(bot, chat_id, "Ошибка при анализе профиля.")
 
     @bot.message_handler(commands=['analysis'])
     async def analysis_command(message):
         chat_id = message.chat.id
-        await bot.send_message(chat_id, "🔍 Приступаю к глубокому анализу вашего профиля...")
+        await send_message(bot, chat_id, "🔍 Приступаю к глубокому анализу вашего профиля...")
         try:
-            questions_data = await agent_06()
+            questions_data = await agent_06(chat_id)
             if not questions_data or len(questions_data) < 1:
-                await bot.send_message(chat_id, "Ваш профиль пока не требует глубокого анализа.")
+                await send_message(bot, chat_id, "Ваш профиль пока не требует глубокого анализа.")
                 return
             questions_data = questions_data[:5]
             url = generate_webapp_url(GITHUB_PAGES_URL, questions_data)
             markup = ReplyKeyboardMarkup(resize_keyboard=True)
             markup.add(KeyboardButton("🧠 НАЧАТЬ ИССЛЕДОВАНИЕ", web_app=WebAppInfo(url=url)))
-            await bot.send_message(chat_id, f"Анализ завершен. Я подготовил {len(questions_data)} вопросов.", reply_markup=markup)
-            user_states[chat_id] = {
-                "mode": "analysis", 
-                "questions": questions_data, 
-                "step": 0, 
-                "interactions": [],
-                "last_activity": datetime.now()
-            }
+            await send_message(bot, chat_id, f"Анализ завершен. Я подготовил {len(questions_data)} вопросов.", reply_markup=markup)
+            await session_store.set(chat_id, new_session(SessionMode.ANALYSIS, questions_data))
+        except LLMBusyError:
+            await send_message(bot, chat_id, BUSY_MESSAGE)
         except Exception as e:
             print(f"[HANDLERS] Ошибка в /analysis: {e}")
-            await bot.send_message(chat_id, "Ошибка анализа.")
+            await send_message(bot, chat_id, "Ошибка анализа.")
 
     @bot.message_handler(commands=['ikigai', 'икигай'])
     async def ikigai_command(message):
         chat_id = message.chat.id
-        await bot.send_message(chat_id, "🌊 Начинаем погружение в поиск вашего Икигай...")
+        await send_message(bot, chat_id, "🌊 Начинаем погружение в поиск вашего Икигай...")
         try:
-            questions_data = await agent_07_questions()
+            questions_data = await agent_07_questions(chat_id)
             if not questions_data or len(questions_data) < 1:
-                await bot.send_message(chat_id, "Не удалось начать сессию Икигай.")
+                await send_message(bot, chat_id, "Не удалось начать сессию Икигай.")
                 return
             url = generate_webapp_url(GITHUB_PAGES_URL, questions_data)
             markup = ReplyKeyboardMarkup(resize_keyboard=True)
             markup.add(KeyboardButton("⛩️ ПУТЬ ИКИГАЙ", web_app=WebAppInfo(url=url)))
-            await bot.send_message(chat_id, "Вопросы готовы. Отключите логику, включите чувства.", reply_markup=markup)
-            user_states[chat_id] = {
-                "mode": "ikigai", 
-                "questions": questions_data, 
-                "step": 0, 
-                "interactions": [],
-                "last_activity": datetime.now()
-            }
+            await send_message(bot, chat_id, "Вопросы готовы. Отключите логику, включите чувства.", reply_markup=markup)
+            await session_store.set(chat_id, new_session(SessionMode.IKIGAI, questions_data))
+        except LLMBusyError:
+            await send_message(bot, chat_id, BUSY_MESSAGE)
         except Exception as e:
             print(f"[HANDLERS] Ошибка в /ikigai: {e}")
-            await bot.send_message(chat_id, "Ошибка инициализации Икигай.")
+            await send_message(bot, chat_id, "Ошибка инициализации Икигай.")
 
     @bot.message_handler(commands=['continue', 'продолжить'])
     async def continue_profile_command(message):
         from Bot_tg.app_logic import trigger_daily_questions
         await trigger_daily_questions(bot, message.chat.id, manual=True)
 
+    @bot.message_handler(commands=['schedule', 'расписание'])
+    async def schedule_command(message):
+        from Bot_tg.scheduler import daily_schedule
+        chat_id = message.chat.id
+        args = (message.text or "").split()[1:]
+        if not args:
+            prefs = daily_schedule.preferences(chat_id)
+            if prefs:
+                tz_name, hour, next_fire = prefs
+                when = datetime.fromtimestamp(next_fire).strftime("%d.%m %H:%M")
+                await send_message(bot, chat_id, f"Вопросы приходят каждый день в {hour}:00 ({tz_name or 'время сервера'}). Следующая порция: {when} (время сервера).\nИзменить: /schedule <час> [часовой пояс], например /schedule 20 Europe/Moscow")
+            else:
+                await send_message(bot, chat_id, "Расписание не настроено. Пример: /schedule 20 Europe/Moscow")
+            return
+        try:
+            hour = int(args[0])
+            tz_name = args[1] if len(args) > 1 else None
+            daily_schedule.set_preferences(chat_id, hour, tz_name)
+        except (ValueError, ZoneInfoNotFoundError):
+            await send_message(bot, chat_id, "Не понял расписание. Пример: /schedule 20 Europe/Moscow (час от 0 до 23).")
+            return
+        await send_message(bot, chat_id, f"Готово! Буду присылать вопросы в {hour}:00 ({tz_name or 'время сервера'}).")
+
     @bot.message_handler(content_types=['web_app_data'])
     async def handle_webapp_data(message):
         chat_id = message.chat.id
-        state = user_states.get(chat_id)
+        state = await session_store.get(chat_id)
         if not state:
-            await bot.send_message(chat_id, "Сессия не найдена.")
+            await send_message(bot, chat_id, "Сессия не найдена.")
             return
-        update_last_activity(chat_id)
+        # Завершение может долго ждать LLM: продлеваем сессию, пока она не истекла посреди обработки
+        await session_store.touch(chat_id)
         try:
             data = json.loads(message.web_app_data.data)
-            interactions = [Interaction(question=item['question'], answer=item['answer']) for item in data]
-            state["interactions"] = interactions
-            await COMPLETION_HANDLERS[state["mode"]](bot, chat_id, state)
+            state.set_answers((item['question'], item['answer']) for item in data)
+            # Повторная отправка той же анкеты, пока первая обрабатывается, завершение не повторяет
+            if not await session_store.compare_and_set(chat_id, state):
+                return
+            with tracer.span(f"completion {state.mode.value}"):
+                await COMPLETION_HANDLERS[state.mode](bot, chat_id, state)
+        except LLMBusyError:
+            # Сессия остается: ответы можно отправить повторно из той же анкеты
+            await send_message(bot, chat_id, BUSY_MESSAGE)
         except Exception as e:
             print(f"[HANDLERS] Ошибка WebApp: {e}")
-            await bot.send_message(chat_id, "Ошибка обработки данных.")
+            await send_message(bot, chat_id, "Ошибка обработки данных.")
 
     @bot.message_handler(func=lambda message: True)
     async def handle_message(message):
         chat_id = message.chat.id
-        state = user_states.get(chat_id)
+        state = await session_store.get(chat_id)
         if state:
-            update_last_activity(chat_id)
+            # Не каждый шаг пишет сессию (отклоненный вариант), а активность — любой
+            await session_store.touch(chat_id)
+            if state.finished:
+                return  # ответы уже обрабатываются (завершение заняло сессию)
             await process_step(bot, chat_id, message.text, state)
         else:
             await handle_default_dialog(bot, chat_id, message.text)
 
 async def handle_default_dialog(bot, chat_id, user_input):
-    await bot.send_message(chat_id, "Анализирую ваше желание...")
-    questions_data = await agent_01(user_input)
+    await send_message(bot, chat_id, "Анализирую ваше желание...")
+    try:
+        questions_data = await agent_01(chat_id, user_input)
+    except LLMBusyError:
+        await send_message(bot, chat_id, BUSY_MESSAGE)
+        return
     if not questions_data or len(questions_data) < 3:
-        await bot.send_message(chat_id, "Не удалось проанализировать запрос.")
+        await send_message(bot, chat_id, "Не удалось проанализировать запрос.")
         return
-    user_states[chat_id] = {
-        "mode": "default", 
-        "original_text": user_input, 
-        "questions": questions_data, 
-        "step": 0, 
-        "interactions": [],
-        "last_activity": datetime.now()
-    }
-    await ask_next_question(bot, chat_id)
+    state = new_session(SessionMode.DEFAULT, questions_data, original_text=user_input)
+    await session_store.set(chat_id, state)
+    await ask_next_question(bot, chat_id, state)
 
 async def process_step(bot, chat_id, user_input, state):
-    current_question = state["questions"][state["step"]]
+    current_question = state.current_question
     if current_question.get("type") == "multiple_choice" and user_input not in current_question.get("variants", []) and user_input != "Следующий вопрос":
-        await bot.send_message(chat_id, "Пожалуйста, выберите один из вариантов.")
-        await ask_next_question(bot, chat_id)
+        await send_message(bot, chat_id, "Пожалуйста, выберите один из вариантов.")
+        await ask_next_question(bot, chat_id, state)
         return
     
-    if user_input != "Следующий вопрос":
-        state["interactions"].append(Interaction(question=current_question["question_text"], answer=user_input))
-    state["step"] += 1
+    answered = user_input != "Следующий вопрос"
+    if answered:
+        state.add_answer(state.step, user_input)
+    state.step += 1
 
-    if state["step"] < len(state["questions"]):
-        await ask_next_question(bot, chat_id)
+    if not state.finished:
+        if not await session_store.compare_and_set(chat_id, state):
+            # Сессию успели изменить параллельно (двойное нажатие, другой воркер): продолжаем со свежей
+            state = await session_store.get(chat_id)
+            if not state:
+                return
+        await ask_next_question(bot, chat_id, state)
     else:
-        await COMPLETION_HANDLERS[state["mode"]](bot, chat_id, state)
+        # Завершение запускает только тот, чей CAS прошел: второй финальный ответ
+        # (двойное нажатие, другой воркер) видит уже записанную версию и выходит
+        if not await session_store.compare_and_set(chat_id, state):
+            return
+        try:
+            with tracer.span(f"completion {state.mode.value}"):
+                await COMPLETION_HANDLERS[state.mode](bot, chat_id, state)
+        except LLMBusyError:
+            # Возвращаем последний вопрос, чтобы на него можно было ответить еще раз
+            if answered:
+                state.question_ids.pop()
+                state.answers.pop()
+            state.step -= 1
+            await session_store.compare_and_set(chat_id, state)
+            await send_message(bot, chat_id, BUSY_MESSAGE)
 
-async def ask_next_question(bot, chat_id):
-    state = user_states[chat_id]
-    question = state["questions"][state["step"]]
+async def ask_next_question(bot, chat_id, state):
+    question = state.current_question
     markup = ReplyKeyboardMarkup(one_time_keyboard=True, resize_keyboard=True)
     if question.get("type") == "multiple_choice":
         for var in question.get("variants", []):
             markup.add(KeyboardButton(var))
-    await bot.send_message(chat_id, f"Вопрос {state['step'] + 1}/{len(state['questions'])}: {question['question_text']}", reply_markup=markup)
+    await send_message(bot, chat_id, f"Вопрос {state.step + 1}/{len(state.questions)}: {question['question_text']}", reply_markup=markup)
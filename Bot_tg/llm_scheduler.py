@@ -0,0 +1,161 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Deque, Dict
+
+from Bot_tg.config import (
+    LLM_MAX_CONCURRENCY, LLM_BACKGROUND_MAX_CONCURRENCY,
+    LLM_MAX_INTERACTIVE_QUEUE, LLM_MAX_BACKGROUND_QUEUE, LLM_QUEUE_TIMEOUT
+)
+from Bot_tg.metrics import registry
+from Bot_tg.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+BUSY_MESSAGE = "Сейчас я перегружен запросами 🙏 Попробуйте, пожалуйста, через минуту."
+
+
+class Lane(IntEnum):
+    INTERACTIVE = 0  # пользователь ждет ответа
+    BACKGROUND = 1   # фоновые переписывания профиля, префетч
+
+
+class LLMBusyError(Exception):
+    """Планировщик перегружен: запрос отклонен, а не поставлен в бесконечное ожидание."""
+
+
+class LLMScheduler:
+    """
+    Единая точка входа для всех вызовов LLM-цепочек.
+    Общий лимит параллельных вызовов, интерактивная полоса всегда обслуживается первой,
+    фоновой оставляется не больше background_limit слотов. Внутри полосы — round-robin
+    по chat_id, чтобы один активный пользователь не занимал все слоты.
+    При перегрузке интерактивный запрос быстро получает LLMBusyError, фоновый — отбрасывается.
+    """
+
+    def __init__(self, max_concurrency: int = 8, background_limit: int = 4,
+                 max_interactive_queue: int = 50, max_background_queue: int = 200,
+                 queue_timeout: float = 20.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.background_limit = max(1, min(background_limit, self.max_concurrency))
+        self.max_queue = {Lane.INTERACTIVE: max_interactive_queue, Lane.BACKGROUND: max_background_queue}
+        self.queue_timeout = queue_timeout
+        self._running = {Lane.INTERACTIVE: 0, Lane.BACKGROUND: 0}
+        # lane -> chat_id -> очередь ожидающих (future); порядок чатов = порядок round-robin
+        self._waiting: Dict[Lane, "OrderedDict[Any, Deque[asyncio.Future]]"] = {
+            lane: OrderedDict() for lane in Lane
+        }
+        self._queued = {Lane.INTERACTIVE: 0, Lane.BACKGROUND: 0}
+        self.shed = {Lane.INTERACTIVE: 0, Lane.BACKGROUND: 0}
+
+    # --- Статистика ---
+    def running(self) -> int:
+        return sum(self._running.values())
+
+    def queued(self, lane: Lane = None) -> int:
+        if lane is None:
+            return sum(self._queued.values())
+        return self._queued[lane]
+
+    # --- Выдача слотов ---
+    def _can_start(self, lane: Lane) -> bool:
+        if self.running() >= self.max_concurrency:
+            return False
+        if lane == Lane.BACKGROUND:
+            return self._running[Lane.BACKGROUND] < self.background_limit and not self._queued[Lane.INTERACTIVE]
+        return True
+
+    def _dispatch(self):
+        for lane in Lane:
+            waiting = self._waiting[lane]
+            while waiting and self._can_start(lane):
+                chat_id, waiters = next(iter(waiting.items()))
+                future = waiters.popleft()
+                self._queued[lane] -= 1
+                if waiters:
+                    waiting.move_to_end(chat_id)  # round-robin: чат уходит в конец очереди
+                else:
+                    del waiting[chat_id]
+                if future.done():
+                    continue  # ожидающий уже ушел по таймауту
+                self._running[lane] += 1
+                future.set_result(True)
+
+    def _remove_waiter(self, lane: Lane, chat_id, future: asyncio.Future):
+        waiters = self._waiting[lane].get(chat_id)
+        if waiters and future in waiters:
+            waiters.remove(future)
+            self._queued[lane] -= 1
+            if not waiters:
+                del self._waiting[lane][chat_id]
+
+    async def _acquire(self, chat_id, lane: Lane):
+        if self._can_start(lane) and not self._queued[lane]:
+            self._running[lane] += 1
+            return
+        if self._queued[lane] >= self.max_queue[lane]:
+            self.shed[lane] += 1
+            logger.warning(f"[LLM] Очередь {lane.name} переполнена ({self._queued[lane]}), запрос {chat_id} отклонен.")
+            raise LLMBusyError(lane.name)
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[lane].setdefault(chat_id, deque()).append(future)
+        self._queued[lane] += 1
+        timeout = self.queue_timeout if lane == Lane.INTERACTIVE else None
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            self._remove_waiter(lane, chat_id, future)
+            if future.done() and not future.cancelled():
+                return  # слот выдали в последний момент
+            future.cancel()
+            self.shed[lane] += 1
+            logger.warning(f"[LLM] Запрос {chat_id} не дождался слота за {timeout} с.")
+            raise LLMBusyError(lane.name)
+        except asyncio.CancelledError:
+            self._remove_waiter(lane, chat_id, future)
+            if future.done() and not future.cancelled():
+                self._release(lane)
+            else:
+                future.cancel()
+            raise
+
+    def _release(self, lane: Lane):
+        self._running[lane] -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, chat_id, lane: Lane = Lane.INTERACTIVE):
+        """Занимает слот LLM на время блока (удобно для стриминга)."""
+        started = time.perf_counter()
+        with tracer.span("llm.slot_wait", lane=lane.name.lower()):
+            await self._acquire(chat_id, lane)
+        queue_wait.observe(time.perf_counter() - started, lane=lane.name.lower())
+        try:
+            yield
+        finally:
+            self._release(lane)
+
+    async def run(self, chat_id, lane: Lane, call: Callable[[], Awaitable]):
+        """Выполняет вызов цепочки в слоте планировщика."""
+        async with self.slot(chat_id, lane):
+            return await call()
+
+
+llm_scheduler = LLMScheduler(
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    background_limit=LLM_BACKGROUND_MAX_CONCURRENCY,
+    max_interactive_queue=LLM_MAX_INTERACTIVE_QUEUE,
+    max_background_queue=LLM_MAX_BACKGROUND_QUEUE,
+    queue_timeout=LLM_QUEUE_TIMEOUT
+)
+
+queue_wait = registry.histogram("askme_llm_queue_wait_seconds", "Ожидание слота LLM", ["lane"])
+registry.gauge("askme_llm_running", "Вызовы LLM в работе", ["lane"],
+               collect=lambda: {(lane.name.lower(),): n for lane, n in llm_scheduler._running.items()})
+registry.gauge("askme_llm_queued", "Вызовы LLM в очереди за слотом", ["lane"],
+               collect=lambda: {(lane.name.lower(),): n for lane, n in llm_scheduler._queued.items()})
+registry.counter("askme_llm_shed_total", "Вызовы LLM, отклоненные из-за перегрузки", ["lane"],
+                 collect=lambda: {(lane.name.lower(),): n for lane, n in llm_scheduler.shed.items()})
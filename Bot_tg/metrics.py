@@ -0,0 +1,268 @@
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from Bot_tg.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Границы бакетов гистограмм
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+IO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 collect: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        # Значения, которые метрика читает из чужого состояния при каждом снятии (счетчики модулей)
+        self.collect = collect
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def _collected(self) -> Dict[LabelValues, float]:
+        try:
+            values = self.collect()
+        except Exception as e:
+            logger.error(f"[METRICS] Ошибка сбора {self.name}: {e}")
+            return {}
+        if not isinstance(values, dict):
+            return {(): values}
+        return {k if isinstance(k, tuple) else (k,): v for k, v in values.items()}
+
+
+class Counter(_Metric):
+    """Монотонный счетчик: inc() или чтение готовых счетчиков через collect."""
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self) -> Dict[LabelValues, float]:
+        if self.collect is not None:
+            return self._collected()
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        for key, value in sorted(self.values().items()):
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+    def snapshot(self):
+        return {",".join(k) if k else "": v for k, v in self.values().items()}
+
+
+class Gauge(Counter):
+    """Текущее значение: set() или collect (глубины очередей, размеры кэшей)."""
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [счетчики по бакетам (+Inf последним), сумма, количество]
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _copy(self) -> Dict[LabelValues, list]:
+        with self._lock:
+            return {k: [list(v[0]), v[1], v[2]] for k, v in self._series.items()}
+
+    def render(self):
+        for key, (counts, total, count) in sorted(self._copy().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                yield f"{self.name}_bucket{_format_labels(self.labels, key, ('le', le))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(round(total, 6))}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {count}"
+
+    def _quantile(self, counts, count: int, q: float) -> float:
+        """Оценка квантиля по бакетам (линейно внутри бакета, как histogram_quantile)."""
+        rank = q * count
+        cumulative = 0
+        lower = 0.0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                if bound == float("inf"):
+                    return lower
+                return lower + (bound - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+            lower = bound if bound != float("inf") else lower
+        return lower
+
+    def snapshot(self):
+        result = {}
+        for key, (counts, total, count) in self._copy().items():
+            result[",".join(key) if key else ""] = {
+                "count": count,
+                "sum": round(total, 6),
+                "avg": round(total / count, 6) if count else 0.0,
+                "p50": round(self._quantile(counts, count, 0.5), 6),
+                "p95": round(self._quantile(counts, count, 0.95), 6),
+                "p99": round(self._quantile(counts, count, 0.99), 6),
+            }
+        return result
+
+
+class Registry:
+    """
+    Реестр метрик процесса. Модули регистрируют свои метрики при импорте (повторная
+    регистрация того же имени заменяет collect — удобно для пересоздаваемых объектов).
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None and type(existing) is type(metric) and metric.collect is None:
+                return existing
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = (), collect=None) -> Counter:
+        return self._register(Counter(name, help_text, labels, collect))
+
+    def gauge(self, name: str, help_text: str, labels: Sequence[str] = (), collect=None) -> Gauge:
+        return self._register(Gauge(name, help_text, labels, collect))
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Все метрики словарем: {имя: {"метки,через,запятую": значение или сводка гистограммы}}."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: m.snapshot() for m in sorted(metrics, key=lambda m: m.name)}
+
+
+registry = Registry()
+
+# --- Общие метрики (наблюдаются в нескольких модулях) ---
+agent_latency = registry.histogram(
+    "askme_agent_latency_seconds", "Время вызова цепочки агента (модель + парсинг)", ["agent", "mode"])
+agent_first_chunk = registry.histogram(
+    "askme_agent_first_chunk_seconds", "Время до первого куска ответа при стриминге", ["agent"])
+agent_errors = registry.counter(
+    "askme_agent_errors_total", "Исключения в цепочках агентов", ["agent"])
+agent_tokens = registry.histogram(
+    "askme_agent_tokens", "Токены запроса и ответа модели за вызов", ["agent", "direction"], TOKEN_BUCKETS)
+json_parse_failures = registry.counter(
+    "askme_json_parse_failures_total", "Ответы модели, которые JsonParser не смог разобрать", ["agent"])
+file_io = registry.histogram(
+    "askme_file_io_seconds", "Время синхронных файловых операций (в to_thread)", ["op"], IO_BUCKETS)
+
+
+def timed_io(op: str):
+    """Декоратор синхронной файловой операции: время попадает в askme_file_io_seconds{op} и в спан io.<op>."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with file_io.time(op=op), tracer.span(f"io.{op}"):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def snapshot() -> Dict[str, dict]:
+    return registry.snapshot()
+
+
+# --- HTTP ---
+
+async def start_metrics_server(host: str, port: int):
+    """Отдает /metrics (Prometheus) и /metrics.json (снимок) на отдельном порту. Возвращает AppRunner."""
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    async def handle_snapshot(request):
+        return web.json_response(registry.snapshot())
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/metrics.json", handle_snapshot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"[METRICS] Метрики доступны на http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from typing import Dict
+
+from Bot_tg.config import (
+    PREFETCH_ENABLED, PREFETCH_AGENTS, PREFETCH_DELAY, PREFETCH_CONCURRENCY
+)
+from Bot_tg.agents import agent_04, agent_06
+from Bot_tg.profile_store import profile_store
+from Bot_tg.llm_scheduler import Lane
+from Bot_tg.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+PREFETCHABLE_AGENTS = {
+    "agent_04": agent_04,
+    "agent_06": agent_06,
+}
+
+
+class Prefetcher:
+    """
+    Спекулятивная фоновая генерация следующих наборов вопросов после записи профиля.
+    Результаты попадают в agent_cache, поэтому следующий /profile или /analysis отвечает сразу.
+    Если профиль снова изменился, незавершенный префетч отменяется и начинается заново.
+    """
+
+    def __init__(self, agents, delay: float = 2.0, concurrency: int = 2, enabled: bool = False):
+        self.agents = agents
+        self.delay = delay
+        self.enabled = enabled
+        self._semaphore = None
+        self._concurrency = concurrency
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.completed = 0
+        self.discarded = 0
+
+    def on_profile_changed(self, chat_id: str, version: int):
+        if not self.enabled:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        previous = self._tasks.pop(chat_id, None)
+        if previous and not previous.done():
+            previous.cancel()
+            self.discarded += 1
+        self._tasks[chat_id] = loop.create_task(self._run(chat_id, version))
+
+    async def _run(self, chat_id: str, version: int):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+        try:
+            # Небольшая задержка: схлопываем серию записей и не мешаем интерактивным вызовам
+            await asyncio.sleep(self.delay)
+            async with self._semaphore:
+                for name in self.agents:
+                    if profile_store.version(chat_id) != version:
+                        self.discarded += 1
+                        return
+                    await PREFETCHABLE_AGENTS[name](int(chat_id), lane=Lane.BACKGROUND)
+            self.completed += 1
+            logger.info(f"[PREFETCH] Вопросы для {chat_id} подготовлены заранее ({', '.join(self.agents)}).")
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"[PREFETCH] Ошибка префетча для {chat_id}: {e}")
+        finally:
+            if self._tasks.get(chat_id) is asyncio.current_task():
+                self._tasks.pop(chat_id, None)
+
+
+prefetcher = Prefetcher(
+    [name for name in PREFETCH_AGENTS if name in PREFETCHABLE_AGENTS],
+    delay=PREFETCH_DELAY,
+    concurrency=PREFETCH_CONCURRENCY,
+    enabled=PREFETCH_ENABLED
+)
+profile_store.add_listener(prefetcher.on_profile_changed)
+registry.gauge("askme_prefetch_pending", "Незавершенные задачи префетча", collect=lambda: len(prefetcher._tasks))
+registry.counter("askme_prefetch_total", "Завершенные и отброшенные задачи префетча", ["result"],
+                 collect=lambda: {("completed",): prefetcher.completed, ("discarded",): prefetcher.discarded})
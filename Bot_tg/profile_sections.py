@@ -0,0 +1,270 @@
+import re
+import json
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+# Заголовки разделов TELOS: "**5. ЦЕЛИ И МОТИВАЦИЯ**" (1-15) и "### 16. IKIGAI BLUEPRINT" (16+)
+SECTION_HEADER_RE = re.compile(r"^(?:\*\*\s*(\d{1,2})\.\s*(.+?)\s*\*\*|#{2,3}\s*(\d{1,2})\.\s*(.+?))[ \t]*$", re.MULTILINE)
+
+# Разделы TELOS: 1-15 базовые, 16 — Икигай, 17 — Тень
+BASE_SECTION_COUNT = 15
+MAX_SECTION_NUMBER = 17
+
+# Разделы, которые бот пишет сам (не через Агента 3)
+TASKS_HEADER = "### 9. ЗАДАЧИ"
+IKIGAI_HEADER = "### 16. IKIGAI BLUEPRINT"
+SHADOW_HEADER = "### 17. SHADOW ARCHETYPE"
+# Задачи исторически пронумерованы 9, как и "ОГРАНИЧЕНИЯ И ТАБУ": ищутся только по заголовку
+TASKS_TITLE = "9. ЗАДАЧИ"
+
+# Патч не должен "съедать" раздел: новая версия не короче этой доли старой
+MIN_KEEP_RATIO = 0.6
+
+SectionKey = Union[int, str]
+
+
+class PatchError(ValueError):
+    """Патч нельзя применить — нужна полная перезапись профиля."""
+
+
+class Section(NamedTuple):
+    number: int
+    title: str    # нормализованный заголовок без разметки: "5. ЦЕЛИ И МОТИВАЦИЯ"
+    header: str   # строка заголовка как в тексте
+    raw: str      # все от конца строки заголовка до следующего заголовка (с переводами строк)
+
+    @property
+    def body(self) -> str:
+        return self.raw.strip("\n")
+
+
+def normalize_title(header: str) -> str:
+    return re.sub(r"\s+", " ", header.strip().strip("*#").strip()).upper()
+
+
+def parse_header(key: str) -> Optional[Tuple[int, str]]:
+    """'### 16. IKIGAI BLUEPRINT', '**5. ЦЕЛИ**' или просто '5. ЦЕЛИ' -> (номер, нормализованный заголовок)."""
+    line = key.strip()
+    match = SECTION_HEADER_RE.match(line) or SECTION_HEADER_RE.match(f"**{line.strip('*#').strip()}**")
+    if not match:
+        return None
+    return int(match.group(1) or match.group(3)), normalize_title(line)
+
+
+def strip_section_header(text: str, header: str) -> str:
+    """Убирает заголовок раздела, если ответ агента начинается с него."""
+    text = text.strip("\n")
+    first, _, rest = text.partition("\n")
+    if parse_header(first) == parse_header(header) and SECTION_HEADER_RE.match(first.strip()):
+        return rest.strip("\n")
+    return text
+
+
+class ProfileDocument:
+    """
+    TELOS-профиль, разобранный один раз на преамбулу и упорядоченные разделы.
+    Доступ к разделу по номеру или заголовку — через индекс, без повторного поиска по тексту.
+    Сериализация обратно без потерь: неизмененные разделы возвращаются байт в байт.
+    """
+
+    __slots__ = ("preamble", "_sections", "_by_title", "_by_number", "_text")
+
+    def __init__(self, preamble: str = "", sections: Optional[List[Section]] = None, text: Optional[str] = None):
+        self.preamble = preamble
+        self._sections = list(sections or [])
+        self._text = text
+        self._reindex()
+
+    @staticmethod
+    def _section_headers(text: str) -> list:
+        """
+        Строки, которые действительно начинают раздел. "**N. ...**" — только базовые 1-15 и не
+        внутри Икигай/Тени (там модель может пронумеровать жирные пункты: "**1. Скрытый огонь**").
+        "### N. ..." — только разделы 16-17 и задачи.
+        """
+        headers, inside_analysis = [], False
+        for match in SECTION_HEADER_RE.finditer(text):
+            if match.group(1):
+                if inside_analysis or not 1 <= int(match.group(1)) <= BASE_SECTION_COUNT:
+                    continue
+            else:
+                number = int(match.group(3))
+                if not (BASE_SECTION_COUNT < number <= MAX_SECTION_NUMBER
+                        or normalize_title(match.group(0)) == TASKS_TITLE):
+                    continue
+                inside_analysis = number > BASE_SECTION_COUNT
+            headers.append(match)
+        return headers
+
+    @classmethod
+    def parse(cls, text: str) -> "ProfileDocument":
+        matches = cls._section_headers(text)
+        if not matches:
+            return cls(text, [], text)
+        sections = []
+        for i, match in enumerate(matches):
+            end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+            header = match.group(0)
+            sections.append(Section(int(match.group(1) or match.group(3)), normalize_title(header),
+                                    header, text[match.end():end]))
+        return cls(text[:matches[0].start()], sections, text)
+
+    def _reindex(self):
+        self._by_title: Dict[str, int] = {}
+        self._by_number: Dict[int, List[int]] = {}
+        for i, section in enumerate(self._sections):
+            self._by_title.setdefault(section.title, i)
+            if section.title != TASKS_TITLE:
+                self._by_number.setdefault(section.number, []).append(i)
+
+    # --- Чтение ---
+    @property
+    def sections(self) -> Tuple[Section, ...]:
+        return tuple(self._sections)
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = self.preamble + "".join(s.header + s.raw for s in self._sections)
+        return self._text
+
+    def __str__(self) -> str:
+        return self.text
+
+    def _index(self, key: SectionKey, loose: bool = False) -> Optional[int]:
+        if isinstance(key, int):
+            candidates = self._by_number.get(key, [])
+            return candidates[0] if len(candidates) == 1 else None
+        parsed = parse_header(key)
+        if parsed is None:
+            return None
+        number, title = parsed
+        if title in self._by_title:
+            return self._by_title[title]
+        if not loose:
+            return None
+        # Для правок от модели: номер без точного заголовка принимаем, только если он однозначен
+        candidates = self._by_number.get(number, [])
+        return candidates[0] if len(candidates) == 1 else None
+
+    def section(self, key: SectionKey, loose: bool = False) -> Optional[Section]:
+        index = self._index(key, loose)
+        return None if index is None else self._sections[index]
+
+    def get(self, key: SectionKey, default: str = "") -> str:
+        """Текст раздела без заголовка."""
+        section = self.section(key)
+        return section.body if section is not None else default
+
+    def __contains__(self, key: SectionKey) -> bool:
+        return self._index(key) is not None
+
+    # --- Изменение ---
+    def copy(self) -> "ProfileDocument":
+        return ProfileDocument(self.preamble, self._sections, self._text)
+
+    def _set(self, index: int, section: Section):
+        self._sections[index] = section
+        self._text = None
+
+    def replace(self, key: SectionKey, body: str, loose: bool = False) -> "ProfileDocument":
+        """Заменяет текст раздела; отсутствующий раздел вставляется по порядку номеров."""
+        index = self._index(key, loose)
+        if index is None:
+            return self.insert(key, body)
+        section = self._sections[index]
+        tail = "\n\n" if index + 1 < len(self._sections) else "\n"
+        self._set(index, section._replace(raw="\n" + body.strip("\n") + tail))
+        return self
+
+    def prepend(self, key: SectionKey, text: str) -> "ProfileDocument":
+        """Вставляет текст сразу после строки заголовка раздела."""
+        index = self._index(key)
+        if index is None:
+            raise KeyError(key)
+        section = self._sections[index]
+        self._set(index, section._replace(raw=text + section.raw))
+        return self
+
+    def insert(self, key: SectionKey, body: str) -> "ProfileDocument":
+        if isinstance(key, int):
+            raise KeyError(f"для нового раздела нужен заголовок, а не номер {key}")
+        parsed = parse_header(key)
+        if parsed is None:
+            raise KeyError(key)
+        number, title = parsed
+        header = key.strip()
+        if not SECTION_HEADER_RE.fullmatch(header):
+            header = f"**{title}**" if number <= 15 else f"### {title}"
+        position = next((i for i, s in enumerate(self._sections) if s.number > number), len(self._sections))
+        if position > 0:
+            # Предыдущий раздел должен отделяться пустой строкой
+            before = self._sections[position - 1]
+            self._sections[position - 1] = before._replace(raw=before.raw.rstrip("\n") + "\n\n")
+        elif self.preamble and not self.preamble.endswith("\n\n"):
+            self.preamble = self.preamble.rstrip("\n") + "\n\n"
+        tail = "\n\n" if position < len(self._sections) else "\n"
+        self._sections.insert(position, Section(number, title, header, "\n" + body.strip("\n") + tail))
+        self._text = None
+        self._reindex()
+        return self
+
+
+def parse_patches(raw: str) -> List[dict]:
+    """Достает список патчей из ответа модели (JSON, возможно обернутый в ```json)."""
+    json_match = re.search(r"```(?:json)?\s*\n(.*)\n```", raw, re.DOTALL)
+    if json_match:
+        raw = json_match.group(1)
+    try:
+        data = json.loads(raw)
+    except json.JSONDecodeError as e:
+        raise PatchError(f"ответ не JSON: {e}")
+    if isinstance(data, dict):
+        data = data.get("patches")
+    if not isinstance(data, list) or not data:
+        raise PatchError("пустой или некорректный список патчей")
+    for patch in data:
+        if not isinstance(patch, dict) or not isinstance(patch.get("section"), str) \
+                or not isinstance(patch.get("content"), str):
+            raise PatchError(f"патч без полей section/content: {str(patch)[:80]}")
+    return data
+
+
+def apply_patches(document: ProfileDocument, patches: List[dict]) -> ProfileDocument:
+    """
+    Применяет правки базовых разделов (1-15) к копии документа; отсутствующие вставляет по номеру.
+    Любое сомнение (неизвестный или чужой раздел, дубли, потеря текста) — PatchError.
+    """
+    if not document.sections:
+        raise PatchError("в профиле нет разделов TELOS")
+    document = document.copy()
+    touched = set()
+    for patch in patches:
+        parsed = parse_header(patch["section"])
+        if parsed is None:
+            raise PatchError(f"не распознан раздел: {patch['section'][:60]}")
+        number, title = parsed
+        # Икигай, Тень и задачи пишет сам бот: правка Агента 3 затерла бы их
+        if number > BASE_SECTION_COUNT or title == TASKS_TITLE:
+            raise PatchError(f"раздел {title} не правится патчем")
+
+        content = patch["content"].strip("\n")
+        lines = content.splitlines()
+        if lines and parse_header(lines[0]) and SECTION_HEADER_RE.match(lines[0].strip()):
+            content = "\n".join(lines[1:]).strip("\n")  # модель повторила заголовок
+        if not content.strip():
+            raise PatchError(f"пустой раздел {title}")
+        if SECTION_HEADER_RE.search(content):
+            raise PatchError(f"в разделе {title} оказались чужие заголовки")
+
+        old = document.section(patch["section"], loose=True)
+        if old is None:
+            if number < 1:
+                raise PatchError(f"неизвестный раздел {title}")
+        else:
+            if old.title in touched:
+                raise PatchError(f"раздел {title} прислан дважды")
+            if len(old.body.strip()) > 40 and len(content) < MIN_KEEP_RATIO * len(old.body):
+                raise PatchError(f"раздел {title} сократился с {len(old.body)} до {len(content)} символов")
+        document.replace(patch["section"], content, loose=True)
+        touched.add(old.title if old is not None else title)
+    return document
@@ -0,0 +1,216 @@
+import os
+import shutil
+import asyncio
+import logging
+import weakref
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from Bot_tg.config import (
+    PROFILES_DIR, PROFILE_SHARDS, PROFILE_CACHE_SIZE,
+    PROFILE_FILE, LEGACY_PROFILE_CHAT_ID
+)
+from Bot_tg.utils import read_file_sync, write_file_sync
+from Bot_tg.profile_sections import ProfileDocument
+from Bot_tg.metrics import timed_io
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("text", "version", "dirty", "backup", "document")
+
+    def __init__(self, text: str, version: int, dirty: bool = False, backup: bool = False,
+                 document: Optional[ProfileDocument] = None):
+        self.text = text
+        self.version = version
+        self.dirty = dirty
+        self.backup = backup
+        # Разобранный профиль: строится лениво, один раз на версию
+        self.document = document
+
+
+class ProfileStore:
+    """
+    Хранилище TELOS-профилей по chat_id.
+    Файлы лежат в шардированных папках, горячие профили держатся в LRU-кэше,
+    а запись на диск выполняется отложенно (write-behind) фоновым флашером.
+    """
+
+    def __init__(self, root_dir: str, shards: int = 64, cache_size: int = 512,
+                 legacy_file: Optional[str] = None, legacy_chat_id: Optional[str] = None):
+        self.root_dir = root_dir
+        self.legacy_file = legacy_file
+        self.legacy_chat_id = legacy_chat_id
+        self.shards = max(1, shards)
+        self.cache_size = max(1, cache_size)
+        self._cache: "OrderedDict[str, _Entry]" = OrderedDict()
+        # Грязные записи, вытесненные из кэша до флаша, живут здесь до записи на диск
+        self._pending: Dict[str, _Entry] = {}
+        self._versions: Dict[str, int] = {}
+        # Блокировка чата живет, пока ее кто-то держит или ждет: словарь не растет с числом чатов
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        # Подписчики на изменение профиля: callback(chat_id, version)
+        self._listeners: List[Callable[[str, int], None]] = []
+
+    # --- Пути ---
+    def path_for(self, chat_id) -> str:
+        cid = str(chat_id)
+        shard = f"{hash_chat_id(cid) % self.shards:02x}"
+        return os.path.join(self.root_dir, shard, f"{cid}.md")
+
+    def _lock(self, cid: str) -> asyncio.Lock:
+        lock = self._locks.get(cid)
+        if lock is None:
+            lock = self._locks[cid] = asyncio.Lock()
+        return lock
+
+    @timed_io("profile_read")
+    def _read(self, cid: str) -> str:
+        path = self.path_for(cid)
+        if not os.path.exists(path) and self.legacy_file and cid == self.legacy_chat_id:
+            # Старый единый profile.md принадлежит владельцу бота
+            return read_file_sync(self.legacy_file)
+        return read_file_sync(path)
+
+    # --- Кэш ---
+    def _remember(self, cid: str, entry: _Entry):
+        self._cache[cid] = entry
+        self._cache.move_to_end(cid)
+        while len(self._cache) > self.cache_size:
+            old_cid, old_entry = self._cache.popitem(last=False)
+            if old_entry.dirty:
+                self._pending[old_cid] = old_entry
+
+    def _lookup(self, cid: str) -> Optional[_Entry]:
+        entry = self._cache.get(cid)
+        if entry is not None:
+            self._cache.move_to_end(cid)
+            return entry
+        entry = self._pending.get(cid)
+        if entry is not None:
+            self._remember(cid, entry)
+        return entry
+
+    # --- Публичный API ---
+    def add_listener(self, callback: Callable[[str, int], None]):
+        """Подписка на запись профиля (инвалидация кэшей, префетч и т.п.)."""
+        self._listeners.append(callback)
+
+    def version(self, chat_id) -> int:
+        """Текущая версия профиля (растет при каждой записи)."""
+        return self._versions.get(str(chat_id), 0)
+
+    async def get(self, chat_id) -> str:
+        """Возвращает текст профиля, читая диск только при промахе кэша."""
+        cid = str(chat_id)
+        entry = self._lookup(cid)
+        if entry is not None:
+            return entry.text
+        async with self._lock(cid):
+            entry = self._lookup(cid)
+            if entry is None:
+                text = await asyncio.to_thread(self._read, cid)
+                entry = _Entry(text, self._versions.get(cid, 0))
+                self._remember(cid, entry)
+            return entry.text
+
+    async def get_document(self, chat_id) -> ProfileDocument:
+        """Возвращает разобранный профиль (копию закэшированного документа — ее можно менять)."""
+        cid = str(chat_id)
+        text = await self.get(cid)
+        entry = self._lookup(cid)
+        if entry is None or entry.text is not text:
+            return ProfileDocument.parse(text)
+        if entry.document is None:
+            entry.document = ProfileDocument.parse(text)
+        return entry.document.copy()
+
+    async def put_document(self, chat_id, document: ProfileDocument, backup: bool = False) -> int:
+        """Записывает профиль из документа, сохраняя разбор в кэше."""
+        return await self.put(chat_id, document.text, backup=backup, document=document.copy())
+
+    async def put(self, chat_id, text: str, backup: bool = False,
+                  document: Optional[ProfileDocument] = None) -> int:
+        """Записывает профиль в кэш и помечает его для отложенного флаша. Возвращает новую версию."""
+        cid = str(chat_id)
+        async with self._lock(cid):
+            version = self._versions.get(cid, 0) + 1
+            self._versions[cid] = version
+            previous = self._lookup(cid)
+            keep_backup = backup or bool(previous and previous.dirty and previous.backup)
+            self._pending.pop(cid, None)
+            self._remember(cid, _Entry(text, version, dirty=True, backup=keep_backup, document=document))
+        for listener in self._listeners:
+            try:
+                listener(cid, version)
+            except Exception as e:
+                logger.error(f"[PROFILES] Ошибка подписчика профиля: {e}")
+        return version
+
+    @timed_io("profile_write")
+    def _write_entry(self, cid: str, entry: _Entry):
+        path = self.path_for(cid)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if entry.backup and os.path.exists(path):
+            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+            backup_path = f"{path[:-3]}_{timestamp}_backup.md"
+            shutil.copy2(path, backup_path)
+            print(f"[PROFILES] Existing profile backed up to {backup_path}")
+        tmp_path = f"{path}.tmp"
+        write_file_sync(tmp_path, entry.text)
+        os.replace(tmp_path, path)
+
+    async def flush(self) -> int:
+        """Сбрасывает все грязные профили на диск. Возвращает число записанных файлов."""
+        dirty = [(cid, e) for cid, e in self._cache.items() if e.dirty]
+        dirty.extend(self._pending.items())
+        written = 0
+        for cid, entry in dirty:
+            async with self._lock(cid):
+                if not entry.dirty:
+                    continue
+                # Устаревшая версия: более свежая запись уже лежит в кэше и будет записана ею
+                if entry.version == self._versions.get(cid):
+                    try:
+                        await asyncio.to_thread(self._write_entry, cid, entry)
+                    except OSError as e:
+                        logger.error(f"[PROFILES] Ошибка записи профиля {cid}: {e}")
+                        continue
+                    written += 1
+                entry.dirty = False
+                entry.backup = False
+                if self._pending.get(cid) is entry:
+                    self._pending.pop(cid, None)
+        return written
+
+    async def run_flusher(self, interval_seconds: float = 2.0):
+        """Фоновая задача write-behind флаша."""
+        print("[PROFILES] Запущен фоновый флашер профилей.")
+        while True:
+            try:
+                await asyncio.sleep(interval_seconds)
+                await self.flush()
+            except asyncio.CancelledError:
+                await self.flush()
+                raise
+            except Exception as e:
+                print(f"[PROFILES] Ошибка флаша: {e}")
+
+
+def hash_chat_id(cid: str) -> int:
+    """Стабильный (не зависящий от PYTHONHASHSEED) хэш для выбора шарда."""
+    h = 0
+    for ch in cid:
+        h = (h * 31 + ord(ch)) & 0xFFFFFFFF
+    return h
+
+
+profile_store = ProfileStore(
+    PROFILES_DIR,
+    shards=PROFILE_SHARDS,
+    cache_size=PROFILE_CACHE_SIZE,
+    legacy_file=PROFILE_FILE,
+    legacy_chat_id=LEGACY_PROFILE_CHAT_ID
+)
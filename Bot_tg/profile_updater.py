@@ -0,0 +1,93 @@
+import json
+import asyncio
+import logging
+from typing import Dict, List, NamedTuple, Optional
+
+from Bot_tg.agents import agent_03
+from Bot_tg.llm_scheduler import Lane
+from Bot_tg.metrics import registry
+from Bot_tg.tracing import tracer, Span, create_detached_task
+
+logger = logging.getLogger(__name__)
+
+
+class _Batch(NamedTuple):
+    answers: list
+    future: asyncio.Future
+    lane: Lane
+    span: Optional[Span]      # спан отправителя: обновление пишется в его трассу
+    waiting: Optional[Span]   # ожидание, пока актор чата занят предыдущим вызовом
+
+
+class ProfileUpdater:
+    """
+    Последовательные обновления профиля через Агента 3: по одному актору на чат.
+    Пока идет переписывание, новые пачки ответов копятся и затем уходят одним
+    вызовом agent_03 на уже обновленный профиль — без гонок и потерянных обновлений.
+    """
+
+    def __init__(self):
+        # chat_id -> пачки, ожидающие следующего вызова
+        self._pending: Dict[str, List[_Batch]] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self.rewrites = 0   # сколько раз реально вызывался agent_03
+        self.batches = 0    # сколько пачек ответов поступило
+        self.coalesced = 0  # сколько пачек ушли в чужой вызов вместо собственного
+
+    def submit(self, chat_id, interactions: List[dict], lane: Lane = Lane.BACKGROUND) -> asyncio.Future:
+        """
+        Ставит пачку ответов в очередь обновления профиля.
+        Возвращает future с результатом agent_03 (True/False); ждать его не обязательно.
+        """
+        cid = str(chat_id)
+        future = asyncio.get_running_loop().create_future()
+        waiting = tracer.start_span("profile_update.queued", activate=False)
+        self._pending.setdefault(cid, []).append(_Batch(interactions, future, lane, tracer.current(), waiting))
+        self.batches += 1
+        worker = self._workers.get(cid)
+        if worker is None or worker.done():
+            self._workers[cid] = create_detached_task(self._run(cid, chat_id))
+        return future
+
+    async def _run(self, cid: str, chat_id):
+        try:
+            while self._pending.get(cid):
+                batch = self._pending.pop(cid)
+                for item in batch:
+                    tracer.end_span(item.waiting)
+                interactions = [answer for item in batch for answer in item.answers]
+                # Если хоть кто-то из ожидающих — пользователь, весь вызов идет интерактивной полосой
+                lane = min(item.lane for item in batch)
+                if len(batch) > 1:
+                    self.coalesced += len(batch) - 1
+                    logger.info(f"[PROFILE_UPDATER] {chat_id}: объединено {len(batch)} пачек ответов в один вызов.")
+                self.rewrites += 1
+                # Спан в трассе апдейта, который прислал первую пачку; остальные — ссылками
+                try:
+                    with tracer.span("profile_update", parent=batch[0].span, links=[i.span for i in batch[1:]],
+                                     lane=lane.name.lower(), batches=len(batch)):
+                        ok = await agent_03(chat_id, json.dumps(interactions, ensure_ascii=False, indent=2), lane=lane)
+                except Exception as e:
+                    logger.error(f"[PROFILE_UPDATER] Ошибка обновления профиля {chat_id}: {e}")
+                    ok = False
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_result(ok)
+        finally:
+            if self._workers.get(cid) is asyncio.current_task():
+                self._workers.pop(cid, None)
+
+    async def drain(self, timeout: float = 30.0):
+        """Дожидается незавершенных обновлений (при остановке бота)."""
+        workers = [w for w in self._workers.values() if not w.done()]
+        if workers:
+            print(f"[PROFILE_UPDATER] Ожидаю завершения {len(workers)} обновлений профиля...")
+            await asyncio.wait(workers, timeout=timeout)
+
+
+profile_updater = ProfileUpdater()
+registry.gauge("askme_profile_updates_pending", "Чаты с незавершенным фоновым обновлением профиля",
+               collect=lambda: sum(1 for w in profile_updater._workers.values() if not w.done()))
+registry.counter("askme_profile_updates_total", "Пачки ответов и вызовы agent_03 в обновлении профиля", ["kind"],
+                 collect=lambda: {("batches",): profile_updater.batches, ("rewrites",): profile_updater.rewrites,
+                                  ("coalesced",): profile_updater.coalesced})
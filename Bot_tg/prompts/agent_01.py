@@ -56,10 +56,10 @@ PROMPT_AGENT_01_PSYCHOLOGY_INSTRUCTION = """<role>
 
 Пример:
 [
-  {
+  {{
     "question_text": "Какое внутреннее изменение для вас важнее всего?",
     "variants": ["Вариант 1", "Вариант 2", "Вариант 3", "Вариант 4"]
-  }
+  }}
 ]
 </output_format>
 
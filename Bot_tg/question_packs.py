@@ -0,0 +1,59 @@
+import os
+import json
+from typing import Dict, List, Optional, Sequence
+
+from Bot_tg.config import (
+    GREETING_QUESTIONS_FILE, TELOS_QUESTIONS_FILE,
+    WEBAPP_PACKS_ENABLED, WEBAPP_PACKS_DIR
+)
+from Bot_tg.session import question_set_id
+from Bot_tg.utils import generate_pack_url, generate_webapp_url
+
+# Анкеты, которые собираются в статические паки для WebApp
+PACK_SOURCES = [GREETING_QUESTIONS_FILE, TELOS_QUESTIONS_FILE]
+
+# pack_id -> опубликован ли пак (файл есть в экспортированном сайте)
+_published: Dict[str, bool] = {}
+
+
+def pack_bytes(questions: Sequence[Dict]) -> bytes:
+    """Содержимое пака: тот же минифицированный JSON, что раньше уходил в URL."""
+    return json.dumps(list(questions), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def write_pack(questions: Sequence[Dict], out_dir: str) -> str:
+    """
+    Записывает пак <id>.json, где id — хэш содержимого (как у QuestionSet).
+    Существующий файл не трогаем: паки неизменяемы, а старые ссылки в чатах должны работать.
+    """
+    pack_id = question_set_id(questions)
+    path = os.path.join(out_dir, f"{pack_id}.json")
+    if not os.path.exists(path):
+        os.makedirs(out_dir, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(pack_bytes(questions))
+        os.replace(tmp_path, path)
+    return pack_id
+
+
+def is_published(pack_id: str) -> bool:
+    """Есть ли пак в docs/ (результат проверки кэшируется на время жизни процесса)."""
+    published = _published.get(pack_id)
+    if published is None:
+        published = os.path.exists(os.path.join(WEBAPP_PACKS_DIR, f"{pack_id}.json"))
+        _published[pack_id] = published
+        if not published:
+            print(f"[PACKS] Пак {pack_id} не собран, вопросы пойдут в URL. Запустите scripts/build_question_packs.py")
+    return published
+
+
+def pack_webapp_url(base_url: str, questions: Sequence[Dict], pack_id: Optional[str] = None,
+                    indices: Optional[List[int]] = None) -> str:
+    """
+    Ссылка на WebApp для статической анкеты: #p=<id>&i=<номера>, если пак опубликован,
+    иначе вопросы целиком в URL. questions — ровно те вопросы, что увидит пользователь.
+    """
+    if WEBAPP_PACKS_ENABLED and pack_id and is_published(pack_id):
+        return generate_pack_url(base_url, pack_id, indices)
+    return generate_webapp_url(base_url, questions)
@@ -0,0 +1,80 @@
+import json
+import hashlib
+from typing import Dict, Iterable, List, Optional
+
+from Bot_tg.config import TELOS_QUESTIONS_FILE
+from Bot_tg.session import question_set_id
+
+
+def question_id(question_text: str) -> str:
+    """Стабильный ID вопроса: не меняется при перестановке вопросов в файле."""
+    normalized = " ".join(question_text.split()).lower()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:12]
+
+
+class QuestionPool:
+    """
+    Скомпилированный пул вопросов: порядок из файла, стабильные ID и индексы.
+    Отвеченные вопросы пользователя хранятся как битовая маска (int) по позициям пула.
+    """
+
+    def __init__(self, questions: List[Dict]):
+        self.questions = questions
+        self.ids = [question_id(q["question_text"]) for q in questions]
+        self.index_by_id = {qid: i for i, qid in enumerate(self.ids)}
+        self.id_by_text = {q["question_text"]: qid for q, qid in zip(questions, self.ids)}
+        self.full_mask = (1 << len(questions)) - 1
+        # ID статического пака для WebApp (см. question_packs): номера вопросов пака = позиции пула
+        self.pack_id = question_set_id(questions)
+
+    @classmethod
+    def from_file(cls, path: str) -> "QuestionPool":
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                questions = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"[POOL] Не удалось загрузить вопросы из {path}: {e}")
+            questions = []
+        pool = cls(questions)
+        print(f"[POOL] Скомпилирован пул из {len(pool)} вопросов ({path}).")
+        return pool
+
+    def __len__(self):
+        return len(self.questions)
+
+    def id_for_text(self, question_text: str) -> Optional[str]:
+        return self.id_by_text.get(question_text)
+
+    def mask(self, question_ids: Iterable[str]) -> int:
+        """Битовая маска для набора ID (неизвестные ID игнорируются)."""
+        bits = 0
+        for qid in question_ids:
+            i = self.index_by_id.get(qid)
+            if i is not None:
+                bits |= 1 << i
+        return bits
+
+    def next_unanswered_positions(self, answered_bits: int, limit: int) -> List[int]:
+        """Позиции первых `limit` неотвеченных вопросов: перебираем только нулевые биты маски."""
+        free = self.full_mask & ~answered_bits
+        positions = []
+        while free and len(positions) < limit:
+            lowest = free & -free
+            positions.append(lowest.bit_length() - 1)
+            free ^= lowest
+        return positions
+
+    def next_unanswered(self, answered_bits: int, limit: int) -> List[Dict]:
+        """Первые `limit` неотвеченных вопросов."""
+        return [self.questions[i] for i in self.next_unanswered_positions(answered_bits, limit)]
+
+
+_telos_pool: Optional[QuestionPool] = None
+
+
+def get_telos_pool() -> QuestionPool:
+    """Пул TELOS-вопросов; компилируется один раз (при старте приложения)."""
+    global _telos_pool
+    if _telos_pool is None:
+        _telos_pool = QuestionPool.from_file(TELOS_QUESTIONS_FILE)
+    return _telos_pool
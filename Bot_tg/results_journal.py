@@ -0,0 +1,310 @@
+import os
+import json
+import asyncio
+import logging
+from typing import Dict, List, NamedTuple, Optional
+
+from Bot_tg.config import (
+    RESULTS_FILE, RESULTS_JOURNAL_DIR, RESULTS_SEGMENT_MAX_BYTES, RESULTS_COMMIT_WINDOW,
+    FinalResult
+)
+from Bot_tg.metrics import timed_io
+from Bot_tg.tracing import tracer, create_detached_task
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = "segment-"
+
+
+class IndexEntry(NamedTuple):
+    timestamp: str
+    segment: int
+    offset: int
+    length: int
+
+
+class ResultsJournal:
+    """
+    Append-only журнал результатов сессий.
+    Каждая запись — одна JSON-строка в текущем сегменте; сегмент ротируется по размеру.
+    Записи, пришедшие в одном окне, коммитятся одной пачкой (group commit).
+    Рядом с сегментом лежит .idx с оффсетами, по которому строится индекс chat_id -> записи.
+    """
+
+    def __init__(self, root_dir: str, segment_max_bytes: int = 8 * 1024 * 1024, commit_window: float = 0.05):
+        self.root_dir = root_dir
+        self.segment_max_bytes = segment_max_bytes
+        self.commit_window = commit_window
+        self._index: Dict[str, List[IndexEntry]] = {}
+        self._segment = 1
+        self._segment_size = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._opened = False
+
+    # --- Пути ---
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.root_dir, f"{SEGMENT_PREFIX}{segment:06d}.jsonl")
+
+    def _index_path(self, segment: int) -> str:
+        return os.path.join(self.root_dir, f"{SEGMENT_PREFIX}{segment:06d}.idx")
+
+    def _segments(self) -> List[int]:
+        numbers = []
+        for name in os.listdir(self.root_dir):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(".jsonl"):
+                try:
+                    numbers.append(int(name[len(SEGMENT_PREFIX):-len(".jsonl")]))
+                except ValueError:
+                    pass
+        return sorted(numbers)
+
+    # --- Открытие и восстановление индекса ---
+    def open(self, read_only: bool = False):
+        """
+        Загружает индексы всех сегментов, дочитывая хвост сегмента, если .idx отстал (падение между записями).
+        read_only — ничего не менять на диске (чтение журнала, в который пишет работающий бот).
+        """
+        if read_only and not os.path.isdir(self.root_dir):
+            self._opened = True
+            return
+        os.makedirs(self.root_dir, exist_ok=True)
+        self._index.clear()
+        segments = self._segments()
+        size = 0
+        for segment in segments:
+            if not read_only and os.path.exists(self._index_path(segment)):
+                self._truncate_torn_tail(self._index_path(segment))
+            indexed_end = self._load_segment_index(segment)
+            if segment == segments[-1] and not read_only:
+                size = self._truncate_torn_tail(self._segment_path(segment))
+            else:
+                size = os.path.getsize(self._segment_path(segment))
+            if indexed_end < size:
+                self._reindex_tail(segment, indexed_end, persist=not read_only)
+        if segments:
+            self._segment = segments[-1]
+            self._segment_size = size
+        self._opened = True
+
+    @staticmethod
+    def _truncate_torn_tail(path: str) -> int:
+        """
+        Обрезает файл до последнего перевода строки и возвращает новый размер. Иначе следующая
+        пачка допишется к оборванной строке: в сегменте ее первая запись станет нечитаемой,
+        в .idx — сольется с оборванной строкой индекса.
+        """
+        size = end = os.path.getsize(path)
+        with open(path, "r+b") as f:
+            while end > 0:
+                start = max(0, end - 65536)
+                f.seek(start)
+                chunk = f.read(end - start)
+                newline = chunk.rfind(b"\n")
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end < size:
+                f.truncate(end)
+                f.flush()
+                os.fsync(f.fileno())
+                logger.warning(f"[JOURNAL] {os.path.basename(path)}: отброшена недописанная строка ({size - end} байт).")
+        return end
+
+    def _add_to_index(self, chat_id: str, entry: IndexEntry):
+        self._index.setdefault(chat_id, []).append(entry)
+
+    def _load_segment_index(self, segment: int) -> int:
+        end = 0
+        path = self._index_path(segment)
+        if not os.path.exists(path):
+            return end
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # недописанная строка (при чтении без обрезки)
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) != 4:
+                    continue
+                chat_id, timestamp, offset, length = parts[0], parts[1], int(parts[2]), int(parts[3])
+                self._add_to_index(chat_id, IndexEntry(timestamp, segment, offset, length))
+                end = max(end, offset + length)
+        return end
+
+    def _reindex_tail(self, segment: int, start: int, persist: bool = True):
+        lines = []
+        with open(self._segment_path(segment), "rb") as f:
+            f.seek(start)
+            offset = start
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break  # недописанная строка
+                try:
+                    record = json.loads(raw)
+                    chat_id = str(record.get("chat_id", ""))
+                    timestamp = record.get("timestamp", "")
+                except json.JSONDecodeError:
+                    offset += len(raw)
+                    continue
+                entry = IndexEntry(timestamp, segment, offset, len(raw))
+                self._add_to_index(chat_id, entry)
+                lines.append(f"{chat_id}\t{timestamp}\t{offset}\t{len(raw)}\n")
+                offset += len(raw)
+        if lines and persist:
+            with open(self._index_path(segment), "a", encoding="utf-8") as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            logger.warning(f"[JOURNAL] Индекс сегмента {segment} восстановлен ({len(lines)} записей).")
+
+    # --- Запись ---
+    @timed_io("journal_write")
+    def _write_batch(self, batch: List[tuple]):
+        """Пишет пачку записей одним write + fsync. Выполняется в потоке."""
+        if self._segment_size >= self.segment_max_bytes:
+            self._segment += 1
+            self._segment_size = 0
+        data = bytearray()
+        index_lines = []
+        entries = []
+        offset = self._segment_size
+        for chat_id, timestamp, line in batch:
+            data += line
+            index_lines.append(f"{chat_id}\t{timestamp}\t{offset}\t{len(line)}\n")
+            entries.append((chat_id, IndexEntry(timestamp, self._segment, offset, len(line))))
+            offset += len(line)
+        with open(self._segment_path(self._segment), "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # .idx — после сегмента: индекс не может ссылаться на незаписанные данные
+        with open(self._index_path(self._segment), "a", encoding="utf-8") as f:
+            f.writelines(index_lines)
+            f.flush()
+            os.fsync(f.fileno())
+        self._segment_size = offset
+        return entries
+
+    async def _run_writer(self):
+        while True:
+            first = await self._queue.get()
+            batch = [first]
+            # Окно group commit: собираем всё, что успело прийти
+            await asyncio.sleep(self.commit_window)
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            records = [item[:3] for item in batch]
+            try:
+                entries = await asyncio.to_thread(self._write_batch, records)
+                for chat_id, entry in entries:
+                    self._add_to_index(chat_id, entry)
+                for item in batch:
+                    if not item[3].done():
+                        item[3].set_result(True)
+            except Exception as e:
+                logger.error(f"[JOURNAL] Ошибка записи пачки из {len(batch)} записей: {e}")
+                for item in batch:
+                    if not item[3].done():
+                        item[3].set_exception(e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _ensure_writer(self):
+        if not self._opened:
+            self.open()
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._writer is None or self._writer.done():
+            self._writer = create_detached_task(self._run_writer())
+
+    async def append(self, chat_id, result: FinalResult):
+        """Добавляет результат в журнал. Возвращается после того, как пачка с записью закоммичена."""
+        self._ensure_writer()
+        record = {"chat_id": str(chat_id), **result.model_dump()}
+        line = (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        future = asyncio.get_running_loop().create_future()
+        with tracer.span("journal.append", bytes=len(line)):
+            await self._queue.put((str(chat_id), result.timestamp, line, future))
+            await future
+
+    async def close(self):
+        """Дожидается записи очереди и останавливает писателя."""
+        if self._queue is not None:
+            await self._queue.join()
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+
+    # --- Чтение ---
+    @timed_io("journal_read")
+    def _read_entries(self, entries: List[IndexEntry]) -> List[dict]:
+        records = []
+        handles = {}
+        try:
+            for entry in entries:
+                f = handles.get(entry.segment)
+                if f is None:
+                    f = handles[entry.segment] = open(self._segment_path(entry.segment), "rb")
+                f.seek(entry.offset)
+                records.append(json.loads(f.read(entry.length)))
+        finally:
+            for f in handles.values():
+                f.close()
+        return records
+
+    async def history(self, chat_id, since: Optional[str] = None, until: Optional[str] = None,
+                      limit: Optional[int] = None) -> List[dict]:
+        """
+        Результаты чата в интервале [since, until] (ISO-таймстемпы), читаются точечно по оффсетам.
+        Дата без времени в until включает весь этот день.
+        """
+        if not self._opened:
+            await asyncio.to_thread(self.open)
+        if until is not None and len(until) == 10:
+            until = f"{until}T23:59:59.999999"
+        entries = [
+            e for e in self._index.get(str(chat_id), [])
+            if (since is None or e.timestamp >= since) and (until is None or e.timestamp <= until)
+        ]
+        if limit is not None:
+            entries = entries[-limit:]
+        return await asyncio.to_thread(self._read_entries, entries)
+
+    # --- Миграция ---
+    def import_legacy(self, legacy_file: str) -> int:
+        """Однократно переносит старый results.json в журнал (только если журнал пуст)."""
+        if not os.path.exists(legacy_file) or self._index:
+            return 0
+        try:
+            with open(legacy_file, "r", encoding="utf-8") as f:
+                legacy = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"[JOURNAL] Не удалось прочитать {legacy_file}: {e}")
+            return 0
+        batch = []
+        for item in legacy:
+            chat_id = str(item.get("session_id", "")).split("_", 1)[0]
+            record = {"chat_id": chat_id, **item}
+            line = (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+            batch.append((chat_id, item.get("timestamp", ""), line))
+        if batch:
+            for chat_id, entry in self._write_batch(batch):
+                self._add_to_index(chat_id, entry)
+        os.replace(legacy_file, f"{legacy_file}.migrated")
+        print(f"[JOURNAL] Перенесено {len(batch)} результатов из {legacy_file}.")
+        return len(batch)
+
+
+results_journal = ResultsJournal(
+    RESULTS_JOURNAL_DIR,
+    segment_max_bytes=RESULTS_SEGMENT_MAX_BYTES,
+    commit_window=RESULTS_COMMIT_WINDOW
+)
+
+
+def open_results_journal():
+    """Открывает журнал при старте и переносит старый results.json, если он есть."""
+    results_journal.open()
+    results_journal.import_legacy(RESULTS_FILE)
@@ -0,0 +1,182 @@
+import time
+import heapq
+import random
+import asyncio
+from datetime import datetime, timedelta, tzinfo
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from Bot_tg.config import (
+    DAILY_DEFAULT_HOUR, DAILY_DEFAULT_TZ, DAILY_JITTER_SECONDS, DAILY_MISSED_GRACE_HOURS
+)
+from Bot_tg import state_manager
+from Bot_tg.sharding import owns_chat
+from Bot_tg.tracing import create_detached_task
+
+
+def resolve_timezone(name: Optional[str]) -> tzinfo:
+    """ZoneInfo по имени; без имени — локальная зона сервера."""
+    if name:
+        return ZoneInfo(name)
+    return datetime.now().astimezone().tzinfo
+
+
+class DailyScheduler:
+    """
+    Персистентный планировщик ежедневных рассылок.
+    Min-heap из (next_fire, chat_id): спим ровно до ближайшей задачи, а не опрашиваем часы.
+    У каждого пользователя свой час и часовой пояс, jitter размазывает волну по времени.
+    Расписание хранится в базе прогресса и переживает перезапуск; изменения пишутся
+    пачками в фоновом потоке, а не синхронно в цикле событий.
+    """
+
+    def __init__(self, default_hour: int = 18, default_tz: Optional[str] = None,
+                 jitter_seconds: float = 900, missed_grace_hours: float = 6):
+        self.default_hour = default_hour
+        self.default_tz = default_tz
+        self.jitter_seconds = jitter_seconds
+        self.missed_grace = missed_grace_hours * 3600
+        self._heap = []
+        # chat_id -> (timezone, hour, next_fire); запись в куче актуальна, только если совпадает next_fire
+        self._entries: Dict[str, Tuple[Optional[str], int, float]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        # Несохраненные изменения: chat_id -> строка schedules; пишет один _flusher, по порядку
+        self._pending: Dict[str, Tuple[str, Optional[str], int, float]] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        # Запущенные рассылки: ссылка держит задачу до конца, ошибки пишет _job_done
+        self._jobs: Set[asyncio.Task] = set()
+
+    # --- Расчет времени ---
+    def next_fire_time(self, tz_name: Optional[str], hour: int, after: float) -> float:
+        """Ближайшее hour:00 в зоне пользователя после `after` плюс случайный jitter."""
+        tz = resolve_timezone(tz_name)
+        local_now = datetime.fromtimestamp(after, tz)
+        target = local_now.replace(hour=hour, minute=0, second=0, microsecond=0)
+        if target.timestamp() <= after:
+            target = target + timedelta(days=1)
+        return target.timestamp() + random.uniform(0, self.jitter_seconds)
+
+    # --- Управление расписанием ---
+    def _push(self, cid: str, tz_name: Optional[str], hour: int, next_fire: float, persist: bool = True):
+        self._entries[cid] = (tz_name, hour, next_fire)
+        heapq.heappush(self._heap, (next_fire, cid))
+        if persist:
+            self._pending[cid] = (cid, tz_name, hour, next_fire)
+            self._schedule_flush()
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    # --- Сохранение ---
+    def _schedule_flush(self):
+        if self._flusher is not None and not self._flusher.done():
+            return  # уже идущая запись подхватит и эти изменения
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне цикла событий (скрипты): пишем сразу
+            rows, self._pending = list(self._pending.values()), {}
+            state_manager.save_schedules(rows)
+            return
+        self._flusher = create_detached_task(self.flush())
+
+    async def flush(self):
+        """Сохраняет накопленные изменения одной транзакцией в потоке; повторяет, пока они приходят."""
+        while self._pending:
+            rows, self._pending = list(self._pending.values()), {}
+            await asyncio.to_thread(state_manager.save_schedules, rows)
+
+    def ensure(self, chat_id):
+        """Ставит пользователя в расписание с настройками по умолчанию, если его там еще нет."""
+        cid = str(chat_id)
+        if cid not in self._entries and owns_chat(cid):
+            fire = self.next_fire_time(self.default_tz, self.default_hour, time.time())
+            self._push(cid, self.default_tz, self.default_hour, fire)
+
+    def set_preferences(self, chat_id, hour: int, tz_name: Optional[str] = None) -> float:
+        """Меняет час/часовой пояс пользователя. Возвращает время следующей рассылки (timestamp)."""
+        if not 0 <= hour <= 23:
+            raise ValueError("hour must be in 0..23")
+        if tz_name:
+            resolve_timezone(tz_name)  # ZoneInfoNotFoundError для неизвестной зоны
+        cid = str(chat_id)
+        fire = self.next_fire_time(tz_name, hour, time.time())
+        self._push(cid, tz_name, hour, fire)
+        return fire
+
+    def preferences(self, chat_id) -> Optional[Tuple[Optional[str], int, float]]:
+        return self._entries.get(str(chat_id))
+
+    def load(self, rows):
+        """
+        Восстанавливает расписание из строк базы; пропущенные за время простоя рассылки отправляются
+        сразу (в пределах grace). Новые записи для известных пользователей попадают в одну пачку записи.
+        """
+        now = time.time()
+        self._heap.clear()
+        self._entries.clear()
+        for cid, tz_name, hour, next_fire in rows:
+            if not owns_chat(cid):
+                continue  # расписанием этого чата занимается другой воркер
+            try:
+                resolve_timezone(tz_name)
+            except (ZoneInfoNotFoundError, ValueError):
+                tz_name = self.default_tz
+            if next_fire < now - self.missed_grace:
+                next_fire = self.next_fire_time(tz_name, hour, now)
+            self._push(cid, tz_name, hour, next_fire, persist=False)
+        for cid in state_manager.known_users():
+            self.ensure(cid)
+        print(f"[SCHEDULER] Загружено расписание для {len(self._entries)} пользователей.")
+
+    # --- Основной цикл ---
+    def _job_done(self, task: asyncio.Task):
+        self._jobs.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[SCHEDULER] Error in {task.get_name()}: {task.exception()!r}")
+
+    async def run(self, job: Callable[[int], Awaitable[None]]):
+        self._wakeup = asyncio.Event()
+        # Записи для пользователей без расписания уходят одной пачкой в фоновом _flusher
+        self.load(await asyncio.to_thread(state_manager.load_schedules))
+        state_manager.new_user_listeners.append(self.ensure)
+        print("[SCHEDULER] Daily scheduler started.")
+        while True:
+            try:
+                if not self._heap:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                fire, cid = self._heap[0]
+                delay = fire - time.time()
+                if delay > 0:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                heapq.heappop(self._heap)
+                entry = self._entries.get(cid)
+                if entry is None or entry[2] != fire:
+                    continue  # устаревшая запись (настройки менялись)
+                tz_name, hour, _ = entry
+                self._push(cid, tz_name, hour, self.next_fire_time(tz_name, hour, max(fire, time.time()) + 60))
+                try:
+                    chat_id = int(cid)
+                except ValueError:
+                    continue
+                task = create_detached_task(job(chat_id))
+                task.set_name(f"daily:{cid}")
+                self._jobs.add(task)
+                task.add_done_callback(self._job_done)
+            except Exception as e:
+                print(f"[SCHEDULER] Error: {e}")
+                await asyncio.sleep(1)
+
+
+daily_schedule = DailyScheduler(
+    default_hour=DAILY_DEFAULT_HOUR,
+    default_tz=DAILY_DEFAULT_TZ,
+    jitter_seconds=DAILY_JITTER_SECONDS,
+    missed_grace_hours=DAILY_MISSED_GRACE_HOURS
+)
@@ -0,0 +1,244 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from enum import IntEnum
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+from Bot_tg.config import (
+    SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_MAX_RETRIES, SEND_QUEUE_WARN_DEPTH
+)
+from Bot_tg.metrics import registry
+from Bot_tg.tracing import tracer, KIND_CLIENT, create_detached_task
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Классы приоритета исходящих сообщений: меньше — важнее."""
+    INTERACTIVE = 0  # ответы пользователю, который ждет
+    SCHEDULED = 1    # плановые напоминания (18:00 и т.п.)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Сколько ждать до появления токена (0 — токен есть)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Job:
+    __slots__ = ("chat_id", "request", "priority", "future", "attempts", "enqueued", "started")
+
+    def __init__(self, chat_id, request, priority, future):
+        self.chat_id = chat_id
+        self.request = request  # фабрика корутины вызова Bot API
+        self.priority = priority
+        self.future = future
+        self.attempts = 0
+        self.enqueued = time.monotonic()
+        self.started: Optional[float] = None  # первая попытка вызова (для ожидания в очереди в трассе)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Достает retry_after из ответа Telegram 429 (ApiTelegramException)."""
+    if getattr(error, "error_code", None) != 429:
+        return None
+    result_json = getattr(error, "result_json", None) or {}
+    return float((result_json.get("parameters") or {}).get("retry_after", 1))
+
+
+class OutboundQueue:
+    """
+    Единый конвейер исходящих вызовов Telegram API.
+    Глобальный token bucket держит общий лимит (~30 msg/s), per-chat бакеты — лимит на чат,
+    интерактивные ответы обгоняют плановые рассылки, на 429 очередь сама ждет retry_after.
+    Сообщения в один чат уходят строго по порядку.
+    """
+
+    SCAN_LIMIT = 200  # сколько заданий просматриваем в поисках готового к отправке
+    MAX_BUCKETS = 4096
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 max_retries: int = 3, warn_depth: int = 500):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.warn_depth = warn_depth
+        self._lanes: Dict[Priority, Deque[_Job]] = {p: deque() for p in Priority}
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._blocked_until: Dict[int, float] = {}
+        self._in_flight = set()
+        self._tasks = set()  # отправки в полете: держим ссылки, пока задачи не завершатся
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._warned = False
+
+    # --- Публичный API ---
+    def depth(self) -> int:
+        """Текущая глубина очереди (все приоритеты)."""
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def depth_by_priority(self) -> Dict[str, int]:
+        return {p.name.lower(): len(lane) for p, lane in self._lanes.items()}
+
+    async def submit(self, chat_id, request: Callable[[], Awaitable], priority: Priority = Priority.INTERACTIVE,
+                     method: str = "request"):
+        """Ставит вызов Bot API, адресованный чату chat_id, в очередь и ждет его результата."""
+        self._ensure_dispatcher()
+        with tracer.span(f"telegram.{method}", KIND_CLIENT, chat_id=chat_id, priority=priority.name.lower()) as span:
+            future = asyncio.get_running_loop().create_future()
+            job = _Job(chat_id, request, priority, future)
+            self._lanes[priority].append(job)
+            self._check_depth()
+            self._wakeup.set()
+            try:
+                return await future
+            finally:
+                if span:
+                    span.set(queue_wait_s=round((job.started or time.monotonic()) - job.enqueued, 6),
+                             attempts=job.attempts + 1)
+
+    async def send_message(self, bot, chat_id, text, priority: Priority = Priority.INTERACTIVE, **kwargs):
+        return await self.submit(chat_id, lambda: bot.send_message(chat_id, text, **kwargs), priority,
+                                 method="send_message")
+
+    async def edit_message_text(self, bot, chat_id, message_id, text, priority: Priority = Priority.INTERACTIVE, **kwargs):
+        return await self.submit(
+            chat_id, lambda: bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, **kwargs), priority,
+            method="edit_message_text"
+        )
+
+    # --- Диспетчер ---
+    def _ensure_dispatcher(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = create_detached_task(self._run())
+
+    def _check_depth(self):
+        depth = self.depth()
+        if depth >= self.warn_depth and not self._warned:
+            self._warned = True
+            logger.warning(f"[SENDER] Очередь отправки выросла до {depth} ({self.depth_by_priority()})")
+        elif depth < self.warn_depth // 2:
+            self._warned = False
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _prune_buckets(self, now: float):
+        """Выбрасывает полностью восстановившиеся бакеты неактивных чатов."""
+        for chat_id, bucket in list(self._chat_buckets.items()):
+            if chat_id not in self._in_flight and bucket.wait_time(now) == 0 and bucket.tokens >= bucket.burst:
+                del self._chat_buckets[chat_id]
+
+    def _pick(self, now: float):
+        """Возвращает (job, 0) для готового задания или (None, сколько ждать)."""
+        wait = self.global_bucket.wait_time(now)
+        if wait > 0:
+            return None, wait
+        best_wait = None
+        for priority in Priority:
+            lane = self._lanes[priority]
+            seen = set()
+            for i, job in enumerate(lane):
+                if i >= self.SCAN_LIMIT:
+                    break
+                # Порядок внутри чата: смотрим только первое задание каждого чата
+                if job.chat_id in seen:
+                    continue
+                seen.add(job.chat_id)
+                if job.chat_id in self._in_flight:
+                    continue
+                blocked = self._blocked_until.get(job.chat_id)
+                if blocked is not None and blocked <= now:
+                    del self._blocked_until[job.chat_id]
+                    blocked = None
+                job_wait = max((blocked or now) - now, self._chat_bucket(job.chat_id).wait_time(now))
+                if job_wait <= 0:
+                    del lane[i]
+                    return job, 0.0
+                best_wait = job_wait if best_wait is None else min(best_wait, job_wait)
+        return None, best_wait
+
+    async def _run(self):
+        while True:
+            if not self.depth():
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = time.monotonic()
+            job, wait = self._pick(now)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    # wait=None: всё заблокировано отправками в полете, ждем их завершения
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if len(self._chat_buckets) > self.MAX_BUCKETS:
+                self._prune_buckets(now)
+            self.global_bucket.take(now)
+            self._chat_bucket(job.chat_id).take(now)
+            self._in_flight.add(job.chat_id)
+            task = create_detached_task(self._execute(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, job: _Job):
+        if job.started is None:
+            job.started = time.monotonic()
+        try:
+            result = await job.request()
+            if not job.future.done():
+                job.future.set_result(result)
+        except Exception as e:
+            retry_after = retry_after_seconds(e)
+            job.attempts += 1
+            if retry_after is not None and job.attempts <= self.max_retries:
+                logger.warning(f"[SENDER] 429 для чата {job.chat_id}, повтор через {retry_after} с.")
+                self._blocked_until[job.chat_id] = time.monotonic() + retry_after
+                self._lanes[job.priority].appendleft(job)
+            elif not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            self._in_flight.discard(job.chat_id)
+            self._wakeup.set()
+
+
+outbound = OutboundQueue(
+    global_rate=SEND_GLOBAL_RATE,
+    chat_rate=SEND_CHAT_RATE,
+    chat_burst=SEND_CHAT_BURST,
+    max_retries=SEND_MAX_RETRIES,
+    warn_depth=SEND_QUEUE_WARN_DEPTH
+)
+registry.gauge("askme_outbound_queue_depth", "Сообщения в очереди отправки Telegram", ["priority"],
+               collect=lambda: {(p,): n for p, n in outbound.depth_by_priority().items()})
+
+
+async def send_message(bot, chat_id, text, priority: Priority = Priority.INTERACTIVE, **kwargs):
+    """Отправка сообщения через общую очередь с лимитами Telegram."""
+    return await outbound.send_message(bot, chat_id, text, priority=priority, **kwargs)
@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import weakref
+from array import array
+from enum import Enum
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from Bot_tg.config import Interaction
+from Bot_tg.metrics import timed_io
+
+
+class SessionMode(str, Enum):
+    """Режим опроса; значения совпадают с ключами COMPLETION_HANDLERS."""
+    DEFAULT = "default"
+    ONBOARDING = "onboarding"
+    PROFILING = "profiling"
+    ANALYSIS = "analysis"
+    IKIGAI = "ikigai"
+    SHADOW = "shadow"
+    CONTINUING_PROFILE = "continuing_profile"
+
+
+def question_set_id(questions: Sequence[Dict]) -> str:
+    """ID набора вопросов по содержимому: одинаковые анкеты получают один ID в любом процессе."""
+    data = json.dumps(questions, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]
+
+
+class QuestionSet:
+    """
+    Неизменяемый набор вопросов, общий для всех сессий с той же анкетой.
+    Сессия хранит только ссылку на него, а ответы — как номера вопросов в наборе.
+    """
+
+    __slots__ = ("id", "questions", "_index", "__weakref__")
+
+    def __init__(self, set_id: str, questions: Sequence[Dict]):
+        self.id = set_id
+        self.questions: Tuple[Dict, ...] = tuple(questions)
+        self._index: Optional[Dict[str, int]] = None
+
+    def __len__(self):
+        return len(self.questions)
+
+    def __getitem__(self, i: int) -> Dict:
+        return self.questions[i]
+
+    def index_of(self, question_text: str) -> int:
+        """Номер вопроса по тексту (для ответов из WebApp); -1, если такого нет."""
+        if self._index is None:
+            self._index = {}
+            for i, q in enumerate(self.questions):
+                self._index.setdefault(q.get("question_text", ""), i)
+        return self._index.get(question_text, -1)
+
+
+# Интернированные наборы: живут, пока на них ссылается хоть одна сессия
+_question_sets: "weakref.WeakValueDictionary[str, QuestionSet]" = weakref.WeakValueDictionary()
+# Статические анкеты из файлов держим всегда: path -> (mtime, набор)
+_static_sets: Dict[str, Tuple[float, QuestionSet]] = {}
+_sets_lock = threading.Lock()
+
+
+def intern_questions(questions: Union[QuestionSet, Sequence[Dict]], set_id: Optional[str] = None) -> QuestionSet:
+    """Возвращает общий QuestionSet для списка вопросов (создает при первом обращении)."""
+    if isinstance(questions, QuestionSet):
+        return questions
+    set_id = set_id or question_set_id(questions)
+    with _sets_lock:
+        existing = _question_sets.get(set_id)
+        if existing is None:
+            existing = QuestionSet(set_id, questions)
+            _question_sets[set_id] = existing
+        return existing
+
+
+@timed_io("question_set_load")
+def load_question_set(path: str) -> QuestionSet:
+    """Анкета из JSON-файла (приветственная и т.п.): читается заново только при изменении файла."""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return intern_questions([])
+    cached = _static_sets.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            questions = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"[SESSION] Не удалось загрузить вопросы из {path}: {e}")
+        return intern_questions([])
+    question_set = intern_questions(questions)
+    _static_sets[path] = (mtime, question_set)
+    return question_set
+
+
+class Session:
+    """
+    Состояние опроса одного чата.
+    Вопросы — ссылка на общий QuestionSet; ответы — параллельные массивы
+    (номер вопроса, текст ответа). Вопросы, которых нет в наборе (пришли из WebApp
+    в другом виде), хранятся отдельно и кодируются отрицательными номерами.
+    """
+
+    __slots__ = ("mode", "questions", "step", "question_ids", "answers", "extra_questions",
+                 "original_text", "last_activity", "version")
+
+    def __init__(self, mode: Union[SessionMode, str], questions: Union[QuestionSet, Sequence[Dict]],
+                 original_text: Optional[str] = None):
+        self.mode = SessionMode(mode)
+        self.questions = intern_questions(questions)
+        self.step = 0
+        self.question_ids = array("h")
+        self.answers: List[str] = []
+        self.extra_questions: Optional[List[str]] = None
+        self.original_text = original_text
+        self.last_activity = time.time()
+        self.version = 0
+
+    # --- Ответы ---
+    def _question_id(self, question_text: str) -> int:
+        i = self.questions.index_of(question_text)
+        if i >= 0:
+            return i
+        if self.extra_questions is None:
+            self.extra_questions = []
+        self.extra_questions.append(question_text)
+        return -len(self.extra_questions)
+
+    def add_answer(self, question: Union[int, str], answer: str):
+        """Ответ на вопрос по номеру в наборе или по тексту."""
+        self.question_ids.append(question if isinstance(question, int) else self._question_id(question))
+        self.answers.append(answer)
+
+    def set_answers(self, pairs: Iterable[Tuple[str, str]]):
+        """Заменяет все ответы парами (текст вопроса, ответ) — так их присылает WebApp."""
+        self.question_ids = array("h")
+        self.answers = []
+        self.extra_questions = None
+        for question, answer in pairs:
+            self.add_answer(question, answer)
+
+    def question_text(self, question_id: int) -> str:
+        if question_id < 0:
+            return self.extra_questions[-question_id - 1]
+        return self.questions[question_id]["question_text"]
+
+    @property
+    def interactions(self) -> List[Interaction]:
+        return [Interaction(question=self.question_text(q), answer=a)
+                for q, a in zip(self.question_ids, self.answers)]
+
+    @property
+    def current_question(self) -> Dict:
+        return self.questions[self.step]
+
+    @property
+    def finished(self) -> bool:
+        return self.step >= len(self.questions)
+
+    # --- Копирование и сериализация ---
+    def copy(self) -> "Session":
+        clone = Session.__new__(Session)
+        clone.mode = self.mode
+        clone.questions = self.questions
+        clone.step = self.step
+        clone.question_ids = array("h", self.question_ids)
+        clone.answers = list(self.answers)
+        clone.extra_questions = list(self.extra_questions) if self.extra_questions is not None else None
+        clone.original_text = self.original_text
+        clone.last_activity = self.last_activity
+        clone.version = self.version
+        return clone
+
+    def to_dict(self) -> Dict:
+        data = {
+            "mode": self.mode.value,
+            "qs": self.questions.id,
+            "questions": list(self.questions.questions),
+            "step": self.step,
+            "q": list(self.question_ids),
+            "a": self.answers,
+            "t": self.last_activity
+        }
+        if self.extra_questions:
+            data["xq"] = self.extra_questions
+        if self.original_text is not None:
+            data["original_text"] = self.original_text
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict, version: int = 0) -> "Session":
+        session = cls(data["mode"], intern_questions(data["questions"], data.get("qs")),
+                      original_text=data.get("original_text"))
+        session.step = data.get("step", 0)
+        if "q" in data:
+            session.question_ids = array("h", data["q"])
+            session.answers = list(data["a"])
+            session.extra_questions = data.get("xq")
+        else:
+            # Формат до Session: список interactions со словарями {question, answer}
+            session.set_answers((i["question"], i["answer"]) for i in data.get("interactions", []))
+        session.last_activity = data.get("t") or time.time()
+        session.version = version
+        return session
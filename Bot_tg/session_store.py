@@ -0,0 +1,517 @@
+import json
+import time
+import heapq
+import asyncio
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+from Bot_tg.config import (
+    SESSION_BACKEND, SESSION_DB_FILE, SESSION_REDIS_URL, SESSION_TTL
+)
+from Bot_tg.session import QuestionSet, Session, SessionMode
+from Bot_tg.sharding import shard_of
+from Bot_tg.metrics import registry, timed_io
+
+logger = logging.getLogger(__name__)
+
+
+def new_session(mode: Union[SessionMode, str], questions: Union[QuestionSet, list], **extra) -> Session:
+    """Свежая сессия опроса; список вопросов интернируется (одинаковые анкеты — один объект)."""
+    return Session(mode, questions, **extra)
+
+
+def encode_session(session: Session) -> str:
+    return json.dumps(session.to_dict(), ensure_ascii=False, separators=(",", ":"))
+
+
+def decode_session(raw: str, version: int) -> Session:
+    return Session.from_dict(json.loads(raw), version)
+
+
+class SessionStore(ABC):
+    """
+    Хранилище сессий опросов по chat_id.
+    Каждая запись версионируется: get() запоминает версию в сессии, compare_and_set()
+    записывает, только если ее никто не изменил с момента чтения. Неактивные сессии
+    истекают через ttl секунд после последней записи; об истечении сообщается подписчикам.
+    """
+
+    def __init__(self, ttl: float = 3600):
+        self.ttl = ttl
+        self.expired_total = 0
+        self._expire_listeners: List[Callable[[str], None]] = []
+
+    @abstractmethod
+    async def get(self, chat_id) -> Optional[Session]:
+        ...
+
+    @abstractmethod
+    async def set(self, chat_id, session: Session) -> int:
+        """Безусловная запись. Возвращает новую версию."""
+
+    @abstractmethod
+    async def compare_and_set(self, chat_id, session: Session) -> bool:
+        """Запись, если версия в хранилище совпадает с session.version (0 — сессии не было)."""
+
+    @abstractmethod
+    async def delete(self, chat_id):
+        ...
+
+    @abstractmethod
+    async def touch(self, chat_id):
+        """Продлевает жизнь сессии без изменения содержимого."""
+
+    def add_expire_listener(self, callback: Callable[[str], None]):
+        """Подписка на истечение сессии (chat_id); вызывается после удаления."""
+        self._expire_listeners.append(callback)
+
+    def _expired(self, chat_ids: List[str]):
+        self.expired_total += len(chat_ids)
+        for cid in chat_ids:
+            for listener in self._expire_listeners:
+                try:
+                    listener(cid)
+                except Exception as e:
+                    logger.error(f"[SESSIONS] Ошибка подписчика истечения сессии: {e}")
+
+    async def _expire(self) -> List[str]:
+        return []
+
+    async def expire(self) -> List[str]:
+        """Удаляет истекшие сессии и возвращает их chat_id (бэкенды с собственным TTL возвращают [])."""
+        expired = await self._expire()
+        self._expired(expired)
+        return expired
+
+    async def next_expiry(self) -> Optional[float]:
+        """Ближайший момент истечения (time.time()) или None, если он неизвестен или сессий нет."""
+        return None
+
+    def size(self) -> Optional[int]:
+        """Число сессий без обращения к сети и диску; None — бэкенд так посчитать не может."""
+        return None
+
+    async def update(self, chat_id, mutate: Callable[[Session], Optional[Session]],
+                     retries: int = 5) -> Optional[Session]:
+        """Читает, изменяет и записывает сессию через compare-and-set, повторяя при конфликте."""
+        for _ in range(retries):
+            session = await self.get(chat_id)
+            if session is None:
+                return None
+            session = mutate(session) or session
+            if await self.compare_and_set(chat_id, session):
+                return session
+        raise RuntimeError(f"session {chat_id}: too many concurrent updates")
+
+    async def close(self):
+        pass
+
+    def _stamp(self, session: Session):
+        session.last_activity = time.time()
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Сессии в памяти процесса (один воркер). get() отдает копию, чтобы правки шли только через set.
+    Сроки истечения лежат в куче с ленивым удалением: продление добавляет новую запись,
+    а устаревшие отбрасываются при извлечении. Очистка стоит O(число истекших · log N).
+    """
+
+    def __init__(self, ttl: float = 3600):
+        super().__init__(ttl)
+        # chat_id -> (истекает_в, сессия); версия хранится в самой сессии
+        self._items: Dict[str, Tuple[float, Session]] = {}
+        # (истекает_в, chat_id); запись актуальна, только если совпадает со сроком в _items
+        self._heap: List[Tuple[float, str]] = []
+        # Версии сквозные для всех чатов: после истечения сессии нумерация не начинается с 1
+        self._last_version = 0
+
+    def size(self) -> int:
+        return len(self._items)
+
+    def _live(self, cid: str):
+        item = self._items.get(cid)
+        if item is not None and item[0] < time.time():
+            del self._items[cid]
+            self._expired([cid])
+            return None
+        return item
+
+    def _put(self, cid: str, expires_at: float, session: Session):
+        self._items[cid] = (expires_at, session)
+        heapq.heappush(self._heap, (expires_at, cid))
+        if len(self._heap) > 2 * len(self._items) + 1024:
+            # Слишком много устаревших записей (частые продления) — пересобираем кучу
+            self._heap = [(item[0], key) for key, item in self._items.items()]
+            heapq.heapify(self._heap)
+
+    async def get(self, chat_id):
+        item = self._live(str(chat_id))
+        return None if item is None else item[1].copy()
+
+    async def set(self, chat_id, session):
+        cid = str(chat_id)
+        self._last_version += 1
+        session.version = self._last_version
+        self._stamp(session)
+        self._put(cid, time.time() + self.ttl, session.copy())
+        return session.version
+
+    async def compare_and_set(self, chat_id, session):
+        item = self._live(str(chat_id))
+        if (item[1].version if item else 0) != session.version:
+            return False
+        await self.set(chat_id, session)
+        return True
+
+    async def delete(self, chat_id):
+        self._items.pop(str(chat_id), None)
+
+    async def touch(self, chat_id):
+        cid = str(chat_id)
+        item = self._live(cid)
+        if item is not None:
+            self._put(cid, time.time() + self.ttl, item[1])
+
+    async def _expire(self):
+        now = time.time()
+        expired = []
+        while self._heap and self._heap[0][0] < now:
+            expires_at, cid = heapq.heappop(self._heap)
+            item = self._items.get(cid)
+            if item is not None and item[0] == expires_at:
+                del self._items[cid]
+                expired.append(cid)
+        return expired
+
+    async def next_expiry(self):
+        # Верхушка кучи может быть устаревшей — тогда проснемся чуть раньше, это безопасно
+        return self._heap[0][0] if self._heap else None
+
+
+class SQLiteSessionStore(SessionStore):
+    """Сессии в SQLite (WAL): общий файл для нескольких процессов на одной машине."""
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sessions (
+        chat_id TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires_at);
+    -- Сквозной счетчик версий: переживает удаление и истечение строк сессий
+    CREATE TABLE IF NOT EXISTS session_versions (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        last INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO session_versions (id, last) SELECT 0, COALESCE(MAX(version), 0) FROM sessions;
+    """
+
+    def __init__(self, db_path: str, ttl: float = 3600):
+        super().__init__(ttl)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self._SCHEMA)
+        self._lock = threading.Lock()
+
+    @timed_io("session_read")
+    def _get_sync(self, cid: str):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT version, data FROM sessions WHERE chat_id = ? AND expires_at >= ?", (cid, time.time())
+            ).fetchone()
+
+    @timed_io("session_write")
+    def _write_sync(self, cid: str, data: str, expected: Optional[int]) -> Optional[int]:
+        """Записывает данные; expected=None — без проверки версии. Возвращает новую версию или None."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT version, expires_at FROM sessions WHERE chat_id = ?", (cid,)
+                ).fetchone()
+                current = row[0] if row and row[1] >= now else 0
+                if expected is not None and current != expected:
+                    self._conn.execute("ROLLBACK")
+                    return None
+                # Версия растет и после истечения/удаления, чтобы старый читатель не перезаписал новую сессию
+                self._conn.execute("UPDATE session_versions SET last = last + 1 WHERE id = 0")
+                version = self._conn.execute("SELECT last FROM session_versions WHERE id = 0").fetchone()[0]
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sessions (chat_id, version, data, expires_at) VALUES (?, ?, ?, ?)",
+                    (cid, version, data, now + self.ttl)
+                )
+                self._conn.execute("COMMIT")
+                return version
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _exec_sync(self, sql: str, params: tuple):
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    async def get(self, chat_id):
+        row = await asyncio.to_thread(self._get_sync, str(chat_id))
+        return None if row is None else decode_session(row[1], row[0])
+
+    async def set(self, chat_id, session):
+        self._stamp(session)
+        version = await asyncio.to_thread(self._write_sync, str(chat_id), encode_session(session), None)
+        session.version = version
+        return version
+
+    async def compare_and_set(self, chat_id, session):
+        expected = session.version
+        self._stamp(session)
+        version = await asyncio.to_thread(self._write_sync, str(chat_id), encode_session(session), expected)
+        if version is None:
+            return False
+        session.version = version
+        return True
+
+    async def delete(self, chat_id):
+        await asyncio.to_thread(self._exec_sync, "DELETE FROM sessions WHERE chat_id = ?", (str(chat_id),))
+
+    async def touch(self, chat_id):
+        await asyncio.to_thread(
+            self._exec_sync, "UPDATE sessions SET expires_at = ? WHERE chat_id = ? AND expires_at >= ?",
+            (time.time() + self.ttl, str(chat_id), time.time())
+        )
+
+    def _expire_sync(self) -> List[str]:
+        """Истекшие сессии находятся по индексу sessions_expires, без просмотра всей таблицы."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute("SELECT chat_id FROM sessions WHERE expires_at < ?", (now,)).fetchall()
+                self._conn.execute("DELETE FROM sessions WHERE expires_at < ?", (now,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [row[0] for row in rows]
+
+    async def _expire(self):
+        return await asyncio.to_thread(self._expire_sync)
+
+    def _next_expiry_sync(self) -> Optional[float]:
+        with self._lock:
+            return self._conn.execute("SELECT MIN(expires_at) FROM sessions").fetchone()[0]
+
+    async def next_expiry(self):
+        return await asyncio.to_thread(self._next_expiry_sync)
+
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RespError(Exception):
+    """Ошибка, которую вернул Redis-совместимый сервер."""
+
+
+class RespClient:
+    """Минимальный асинхронный клиент протокола Redis (RESP2): одно соединение, команды по очереди."""
+
+    def __init__(self, url: str):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        out = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            out.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        return b"".join(out)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("connection closed")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RespError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            count = int(payload)
+            return None if count < 0 else [await self._read_reply() for _ in range(count)]
+        raise RespError(f"unexpected reply: {line!r}")
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._roundtrip(("AUTH", self.password))
+        if self.db:
+            await self._roundtrip(("SELECT", self.db))
+
+    async def _roundtrip(self, args):
+        self._writer.write(self._encode(args))
+        await self._writer.drain()
+        return await self._read_reply()
+
+    async def command(self, *args):
+        async with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._writer is None:
+                        await self._connect()
+                    return await self._roundtrip(args)
+                except (ConnectionError, OSError, asyncio.IncompleteReadError):
+                    await self._drop()
+                    if attempt:
+                        raise
+
+    async def _drop(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def close(self):
+        async with self._lock:
+            await self._drop()
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Сессии в Redis-совместимом хранилище (Redis, Valkey, KeyDB...): общие для нескольких машин.
+    Сессия — hash {v: версия, s: JSON}; TTL через EXPIRE, CAS атомарно в Lua-скрипте.
+    Версии выдает счетчик {prefix}version без TTL: после истечения сессии нумерация
+    не начинается заново с 1, и старый писатель не перезапишет новую сессию.
+    Истечение выполняет сам сервер, поэтому подписчики истечения здесь не вызываются.
+    """
+
+    # Новая версия — следующее значение счетчика, но не меньше текущей версии + 1 (если счетчик потерян)
+    _NEXT = ("local v = redis.call('INCR', KEYS[2]) "
+             "if v <= cur then v = cur + 1 redis.call('SET', KEYS[2], v) end "
+             "redis.call('HSET', KEYS[1], 'v', v, 's', ARGV[1]) "
+             "redis.call('EXPIRE', KEYS[1], ARGV[2]) return v")
+    _SET = "local cur = tonumber(redis.call('HGET', KEYS[1], 'v') or '0') " + _NEXT
+    _CAS = ("local cur = tonumber(redis.call('HGET', KEYS[1], 'v') or '0') "
+            "if cur ~= tonumber(ARGV[3]) then return 0 end " + _NEXT)
+
+    def __init__(self, url: str, ttl: float = 3600, prefix: str = "askme:session:"):
+        super().__init__(ttl)
+        self.client = RespClient(url)
+        self.prefix = prefix
+        self._counter = f"{prefix}version"
+
+    def _key(self, chat_id) -> str:
+        return f"{self.prefix}{chat_id}"
+
+    async def get(self, chat_id):
+        version, raw = await self.client.command("HMGET", self._key(chat_id), "v", "s")
+        return None if raw is None else decode_session(raw, int(version))
+
+    async def set(self, chat_id, session):
+        self._stamp(session)
+        version = await self.client.command("EVAL", self._SET, 2, self._key(chat_id), self._counter,
+                                            encode_session(session), int(self.ttl))
+        session.version = version
+        return version
+
+    async def compare_and_set(self, chat_id, session):
+        self._stamp(session)
+        version = await self.client.command("EVAL", self._CAS, 2, self._key(chat_id), self._counter,
+                                            encode_session(session), int(self.ttl), session.version)
+        if not version:
+            return False
+        session.version = version
+        return True
+
+    async def delete(self, chat_id):
+        await self.client.command("DEL", self._key(chat_id))
+
+    async def touch(self, chat_id):
+        await self.client.command("EXPIRE", self._key(chat_id), int(self.ttl))
+
+    async def close(self):
+        await self.client.close()
+
+
+class ShardedSessionStore(SessionStore):
+    """Раскладывает сессии по нескольким хранилищам по chat_id (например, несколько узлов Redis)."""
+
+    def __init__(self, stores: List[SessionStore]):
+        super().__init__(stores[0].ttl)
+        self.stores = stores
+
+    def _store(self, chat_id) -> SessionStore:
+        return self.stores[shard_of(chat_id, len(self.stores))]
+
+    async def get(self, chat_id):
+        return await self._store(chat_id).get(chat_id)
+
+    async def set(self, chat_id, session):
+        return await self._store(chat_id).set(chat_id, session)
+
+    async def compare_and_set(self, chat_id, session):
+        return await self._store(chat_id).compare_and_set(chat_id, session)
+
+    async def delete(self, chat_id):
+        await self._store(chat_id).delete(chat_id)
+
+    async def touch(self, chat_id):
+        await self._store(chat_id).touch(chat_id)
+
+    async def _expire(self):
+        expired = []
+        for store in self.stores:
+            expired.extend(await store.expire())
+        return expired
+
+    async def next_expiry(self):
+        moments = [m for m in [await store.next_expiry() for store in self.stores] if m is not None]
+        return min(moments) if moments else None
+
+    def size(self):
+        sizes = [store.size() for store in self.stores]
+        return None if None in sizes else sum(sizes)
+
+    async def close(self):
+        for store in self.stores:
+            await store.close()
+
+
+def create_session_store(backend: str = SESSION_BACKEND, ttl: float = SESSION_TTL) -> SessionStore:
+    """Хранилище сессий по настройкам: memory (по умолчанию), sqlite или redis (несколько URL через запятую — шарды)."""
+    if backend == "sqlite":
+        return SQLiteSessionStore(SESSION_DB_FILE, ttl=ttl)
+    if backend == "redis":
+        urls = [u.strip() for u in SESSION_REDIS_URL.split(",") if u.strip()]
+        stores = [RedisSessionStore(url, ttl=ttl) for url in urls]
+        return stores[0] if len(stores) == 1 else ShardedSessionStore(stores)
+    if backend != "memory":
+        logger.warning(f"[SESSIONS] Неизвестный SESSION_BACKEND={backend}, использую memory.")
+    return MemorySessionStore(ttl=ttl)
+
+
+session_store = create_session_store()
+registry.gauge("askme_sessions", "Активные сессии опросов (только memory-бэкенд)",
+               collect=lambda: {(): n} if (n := session_store.size()) is not None else {})
+registry.counter("askme_sessions_expired_total", "Сессии, удаленные по истечении",
+                 collect=lambda: session_store.expired_total)
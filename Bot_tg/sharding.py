@@ -0,0 +1,26 @@
+from typing import List, Optional
+
+from Bot_tg.config import WORKER_INDEX, WORKER_COUNT, WORKER_PEERS
+from Bot_tg.profile_store import hash_chat_id
+
+
+def shard_of(chat_id, shards: int) -> int:
+    """Стабильный номер шарда для chat_id (одинаковый во всех процессах)."""
+    return hash_chat_id(str(chat_id)) % max(1, shards)
+
+
+def owns_chat(chat_id) -> bool:
+    """
+    Обслуживает ли этот воркер чат. Каждый чат закреплен за одним воркером:
+    его кэши профиля, очередь исходящих и расписание живут только там.
+    Работает только в режиме webhook (апдейты чужих чатов пересылаются владельцу):
+    в polling каждый воркер получил бы все апдейты, поэтому app отказывается так запускаться.
+    """
+    return WORKER_COUNT <= 1 or shard_of(chat_id, WORKER_COUNT) == WORKER_INDEX
+
+
+def owner_url(chat_id, peers: List[str] = WORKER_PEERS) -> Optional[str]:
+    """Базовый адрес воркера-владельца чата (для пересылки апдейтов) или None, если он локальный."""
+    if owns_chat(chat_id) or len(peers) < WORKER_COUNT:
+        return None
+    return peers[shard_of(chat_id, WORKER_COUNT)]
@@ -1,35 +1,206 @@
 import os
 import json
+import sqlite3
+import threading
 from datetime import datetime
+from typing import Iterable, List
 
-# Global states
-user_states = {}
+from Bot_tg.metrics import timed_io
+
+# Read-through кэш прогресса: chat_id (str) -> битовая маска отвеченных вопросов пула
 user_progress = {}
 
-def load_user_progress(file_path):
-    global user_progress
-    if os.path.exists(file_path):
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                user_progress = json.load(f)
-        except Exception as e:
-            print(f"[STATE] Error loading user progress: {e}")
-            user_progress = {}
+_db = None
+_pool = None
+_db_lock = threading.Lock()
+_known_users = set()
+# Колбэки, вызываемые при регистрации нового пользователя (например, планировщик)
+new_user_listeners = []
+
+# PRAGMA user_version: 1 — в answers.question_id только ID пула (тексты вопросов перенесены)
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    chat_id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS answers (
+    chat_id TEXT NOT NULL,
+    question_id TEXT NOT NULL,
+    answered_at TEXT NOT NULL,
+    PRIMARY KEY (chat_id, question_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS schedules (
+    chat_id TEXT PRIMARY KEY,
+    timezone TEXT,
+    hour INTEGER NOT NULL,
+    next_fire REAL NOT NULL
+);
+"""
+
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
 
-def save_user_progress(file_path):
+def _migrate_json(legacy_file):
+    """Однократный перенос старого user_progress.json в SQLite."""
     try:
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(user_progress, f, indent=4, ensure_ascii=False)
+        with open(legacy_file, "r", encoding="utf-8") as f:
+            legacy = json.load(f)
     except Exception as e:
-        print(f"[STATE] Error saving user progress: {e}")
+        print(f"[STATE] Error loading legacy user progress: {e}")
+        return
+    now = datetime.now().isoformat()
+    with _db_lock:
+        _db.execute("BEGIN")
+        try:
+            _db.executemany(
+                "INSERT OR IGNORE INTO users (chat_id, created_at) VALUES (?, ?)",
+                [(cid, now) for cid in legacy]
+            )
+            _db.executemany(
+                "INSERT OR IGNORE INTO answers (chat_id, question_id, answered_at) VALUES (?, ?, ?)",
+                [(cid, q, now) for cid, questions in legacy.items() for q in questions]
+            )
+            _db.execute("COMMIT")
+        except Exception:
+            _db.execute("ROLLBACK")
+            raise
+    os.replace(legacy_file, f"{legacy_file}.migrated")
+    print(f"[STATE] Migrated progress of {len(legacy)} users from {legacy_file}")
+
+def _migrate_texts_to_ids(force: bool = False):
+    """
+    Заменяет записи, где вместо ID хранится текст вопроса, на стабильные ID пула.
+    Выполняется один раз (user_version поднимается в той же транзакции); force — после
+    переноса старого JSON, где снова могли появиться тексты.
+    """
+    with _db_lock:
+        if not force and _db.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        _db.execute("BEGIN")
+        try:
+            migrated = 0
+            # Один проход по таблице: обновляем только тексты, которые в ней действительно есть
+            stored = [row[0] for row in _db.execute("SELECT DISTINCT question_id FROM answers")]
+            for text in stored:
+                qid = _pool.id_by_text.get(text)
+                if qid is None or qid == text:
+                    continue
+                cur = _db.execute(
+                    "UPDATE OR IGNORE answers SET question_id = ? WHERE question_id = ?", (qid, text)
+                )
+                migrated += cur.rowcount
+                # Дубликаты (ID уже был записан) UPDATE OR IGNORE оставляет — удаляем их
+                _db.execute("DELETE FROM answers WHERE question_id = ?", (text,))
+            _db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            _db.execute("COMMIT")
+        except Exception:
+            _db.execute("ROLLBACK")
+            raise
+    if migrated:
+        print(f"[STATE] Mapped {migrated} text-based progress entries to question IDs")
+
+def load_user_progress(db_path, legacy_file=None, pool=None):
+    """Открывает базу прогресса (WAL), переносит старый JSON и приводит тексты вопросов к ID пула."""
+    global _db, _pool
+    _db = _connect(db_path)
+    _pool = pool
+    migrated_json = bool(legacy_file and os.path.exists(legacy_file))
+    if migrated_json:
+        _migrate_json(legacy_file)
+    if _pool is not None:
+        _migrate_texts_to_ids(force=migrated_json)
+    with _db_lock:
+        rows = _db.execute("SELECT chat_id FROM users").fetchall()
+    _known_users.clear()
+    _known_users.update(row[0] for row in rows)
+    user_progress.clear()
+
+def known_users() -> List[str]:
+    return list(_known_users)
 
-def register_user_activity(chat_id, file_path=None):
+def get_answered_bits(chat_id) -> int:
+    """Битовая маска отвеченных вопросов пула (читается из базы при первом обращении)."""
     cid = str(chat_id)
-    if cid not in user_progress:
-        user_progress[cid] = []
-        if file_path:
-            save_user_progress(file_path)
-
-def update_last_activity(chat_id):
-    if chat_id in user_states:
-        user_states[chat_id]["last_activity"] = datetime.now()
+    cached = user_progress.get(cid)
+    if cached is not None:
+        return cached
+    bits = 0
+    if _db is not None and _pool is not None:
+        with _db_lock:
+            rows = _db.execute("SELECT question_id FROM answers WHERE chat_id = ?", (cid,)).fetchall()
+        bits = _pool.mask(row[0] for row in rows)
+    user_progress[cid] = bits
+    return bits
+
+@timed_io("progress_write")
+def add_answered(chat_id, question_ids: Iterable[str]):
+    """Добавляет пачку отвеченных вопросов (ID пула) одной транзакцией."""
+    cid = str(chat_id)
+    new_ids = list(dict.fromkeys(question_ids))
+    if not new_ids:
+        return
+    now = datetime.now().isoformat()
+    if _db is not None:
+        try:
+            with _db_lock:
+                _db.executemany(
+                    "INSERT OR IGNORE INTO answers (chat_id, question_id, answered_at) VALUES (?, ?, ?)",
+                    [(cid, q, now) for q in new_ids]
+                )
+        except sqlite3.Error as e:
+            print(f"[STATE] Error saving user progress: {e}")
+            return
+    if _pool is not None:
+        user_progress[cid] = get_answered_bits(cid) | _pool.mask(new_ids)
+
+def register_user_activity(chat_id):
+    cid = str(chat_id)
+    if cid in _known_users:
+        return
+    _known_users.add(cid)
+    if _db is not None:
+        try:
+            with _db_lock:
+                _db.execute(
+                    "INSERT OR IGNORE INTO users (chat_id, created_at) VALUES (?, ?)",
+                    (cid, datetime.now().isoformat())
+                )
+        except sqlite3.Error as e:
+            print(f"[STATE] Error registering user: {e}")
+    for listener in new_user_listeners:
+        listener(cid)
+
+def load_schedules():
+    """Все сохраненные расписания: (chat_id, timezone, hour, next_fire)."""
+    if _db is None:
+        return []
+    with _db_lock:
+        return _db.execute("SELECT chat_id, timezone, hour, next_fire FROM schedules").fetchall()
+
+@timed_io("schedule_write")
+def save_schedules(rows: Iterable[tuple]):
+    """Сохраняет пачку расписаний (chat_id, timezone, hour, next_fire) одной транзакцией."""
+    rows = [(str(cid), timezone, hour, next_fire) for cid, timezone, hour, next_fire in rows]
+    if _db is None or not rows:
+        return
+    try:
+        with _db_lock:
+            _db.execute("BEGIN")
+            try:
+                _db.executemany(
+                    "INSERT OR REPLACE INTO schedules (chat_id, timezone, hour, next_fire) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                _db.execute("COMMIT")
+            except Exception:
+                _db.execute("ROLLBACK")
+                raise
+    except sqlite3.Error as e:
+        print(f"[STATE] Error saving schedules: {e}")
+
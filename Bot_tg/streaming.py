@@ -0,0 +1,112 @@
+import time
+import logging
+from typing import AsyncIterator, List, Optional
+
+from Bot_tg.config import STREAM_EDIT_INTERVAL
+from Bot_tg.sender import outbound
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """
+    Режет текст на куски не длиннее limit, по возможности по переводу строки.
+    Граница куска зависит только от первых limit символов, поэтому по мере роста
+    текста уже отправленные куски не меняются.
+    """
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut < limit // 2:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    parts.append(text)
+    return parts
+
+
+class MessageStreamer:
+    """
+    Показывает длинный ответ LLM по мере генерации: плейсхолдер + редактирование сообщения
+    не чаще раза в `interval` секунд, переход на новое сообщение при достижении 4096 символов.
+    Промежуточные правки идут без разметки, финальная — с parse_mode (с откатом на обычный текст).
+    """
+
+    def __init__(self, bot, chat_id, header: str = "", parse_mode: Optional[str] = "Markdown",
+                 interval: float = 1.5):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.header = header
+        self.parse_mode = parse_mode
+        self.interval = interval
+        self.body = ""
+        self._message_ids: List[int] = []
+        self._sent: List[str] = []
+        self._last_flush = 0.0
+
+    async def start(self, placeholder: str):
+        message = await outbound.send_message(self.bot, self.chat_id, placeholder)
+        self._message_ids.append(message.message_id)
+        self._sent.append(placeholder)
+        self._last_flush = time.monotonic()
+
+    async def feed(self, chunk: str):
+        self.body += chunk
+        if time.monotonic() - self._last_flush >= self.interval:
+            await self._flush()
+
+    async def finish(self) -> str:
+        await self._flush(final=True)
+        return self.body
+
+    async def _flush(self, final: bool = False):
+        self._last_flush = time.monotonic()
+        text = self.header + self.body
+        if not text.strip():
+            return
+        for i, part in enumerate(split_message(text)):
+            if i < len(self._message_ids):
+                if part == self._sent[i] and not final:
+                    continue
+                await self._edit(i, part, final)
+            else:
+                message = await self._send(part, final)
+                self._message_ids.append(message.message_id)
+                self._sent.append(part)
+
+    async def _edit(self, i: int, part: str, final: bool):
+        try:
+            if final and self.parse_mode:
+                try:
+                    await outbound.edit_message_text(self.bot, self.chat_id, self._message_ids[i], part,
+                                                     parse_mode=self.parse_mode)
+                    self._sent[i] = part
+                    return
+                except Exception as e:
+                    logger.warning(f"[STREAM] Разметка не применилась, отправляю обычным текстом: {e}")
+            if part != self._sent[i]:
+                await outbound.edit_message_text(self.bot, self.chat_id, self._message_ids[i], part)
+                self._sent[i] = part
+        except Exception as e:
+            # "message is not modified" и прочие ошибки правки не должны ронять весь поток
+            logger.warning(f"[STREAM] Ошибка правки сообщения: {e}")
+
+    async def _send(self, part: str, final: bool):
+        if final and self.parse_mode:
+            try:
+                return await outbound.send_message(self.bot, self.chat_id, part, parse_mode=self.parse_mode)
+            except Exception as e:
+                logger.warning(f"[STREAM] Разметка не применилась, отправляю обычным текстом: {e}")
+        return await outbound.send_message(self.bot, self.chat_id, part)
+
+
+async def stream_to_chat(bot, chat_id, chunks: AsyncIterator[str], header: str = "",
+                         placeholder: str = "⏳ ...", parse_mode: Optional[str] = "Markdown") -> str:
+    """Стримит ответ агента в чат и возвращает полный текст (без заголовка)."""
+    streamer = MessageStreamer(bot, chat_id, header=header, parse_mode=parse_mode, interval=STREAM_EDIT_INTERVAL)
+    await streamer.start(placeholder)
+    async for chunk in chunks:
+        await streamer.feed(chunk)
+    return await streamer.finish()
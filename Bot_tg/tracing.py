@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from Bot_tg.config import TRACE_FILE, TRACE_SAMPLE_RATE, TRACE_SLOW_SECONDS, TRACE_MAX_BYTES, WORKER_INDEX
+
+logger = logging.getLogger(__name__)
+
+# SpanKind и коды статуса OTLP
+KIND_INTERNAL, KIND_SERVER, KIND_CLIENT = 1, 2, 3
+STATUS_OK, STATUS_ERROR = 1, 2
+
+MAX_SPANS_PER_TRACE = 500
+MAX_OPEN_TRACES = 10000
+MAX_PENDING_LINES = 10000
+
+# Текущий спан задачи/потока: create_task и to_thread копируют контекст, поэтому дочерние
+# спаны в фоновых задачах и потоках цепляются к трассе апдейта сами
+_current: contextvars.ContextVar = contextvars.ContextVar("askme_span", default=None)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "attributes", "links",
+                 "start_ns", "end_ns", "error", "_t0", "_token")
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], name: str, kind: int,
+                 attributes: dict, links: Optional[List["Span"]] = None):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.links = [(s.trace_id, s.span_id) for s in links or ()]
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.error: Optional[str] = None
+        self._t0 = time.perf_counter_ns()
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self, error: Optional[BaseException] = None):
+        # Длительность по монотонным часам: time_ns() может прыгнуть при синхронизации времени
+        self.end_ns = self.start_ns + time.perf_counter_ns() - self._t0
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}" if str(error) else type(error).__name__
+
+    @property
+    def duration(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e9 if self.end_ns else 0.0
+
+    def to_otlp(self) -> dict:
+        data = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "status": {"code": STATUS_ERROR, "message": self.error} if self.error else {"code": STATUS_OK},
+        }
+        if self.parent_id:
+            data["parentSpanId"] = self.parent_id
+        if self.links:
+            data["links"] = [{"traceId": t, "spanId": s} for t, s in self.links]
+        return data
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict) -> List[dict]:
+    return [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items() if v is not None]
+
+
+def create_detached_task(coro) -> asyncio.Task:
+    """create_task вне текущей трассы: общий долгоживущий воркер не должен писать спаны в апдейт, который его запустил."""
+    context = contextvars.copy_context()
+    context.run(_current.set, None)
+    return context.run(asyncio.create_task, coro)
+
+
+class Tracer:
+    """
+    Легкая трассировка апдейтов. Спаны копятся в памяти по трассам; когда корневой спан
+    закрывается, трасса целиком (если попала в выборку) становится одной строкой JSONL в
+    формате OTLP/JSON (как у file exporter коллектора OpenTelemetry). Строки пишет run_flusher.
+    Вне трассы span() ничего не делает, выключенный трейсер — тоже.
+    """
+
+    def __init__(self, path: Optional[str], sample_rate: float = 1.0, slow_seconds: float = 5.0,
+                 max_bytes: int = 64 * 1024 * 1024, service: str = "askme-bot"):
+        self.path = path
+        self.enabled = bool(path)
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.max_bytes = max_bytes
+        self.resource = {"resource": {"attributes": _otlp_attributes(
+            {"service.name": service, "service.instance.id": str(WORKER_INDEX)})}}
+        self._open: "OrderedDict[str, list]" = OrderedDict()  # trace_id -> закрытые спаны
+        self._kept: "OrderedDict[str, None]" = OrderedDict()  # записанные трассы (для поздних спанов)
+        self._lines: List[str] = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.exported = 0
+        self.dropped = 0
+
+    # --- Спаны ---
+    def current(self) -> Optional[Span]:
+        return _current.get()
+
+    def start_span(self, name: str, kind: int = KIND_INTERNAL, new_trace: bool = False,
+                   activate: bool = True, parent: Optional[Span] = None,
+                   links: Optional[List[Span]] = None, **attributes) -> Optional[Span]:
+        """
+        Открывает спан под текущим (или под parent — для работы, которую запросил другой апдейт).
+        new_trace — начать новую трассу (текущий спан, если есть, попадает в links).
+        activate=False — не делать спан текущим (асинхронные генераторы).
+        """
+        if not self.enabled:
+            return None
+        parent = parent or _current.get()
+        links = [s for s in links or () if s is not None]
+        if new_trace:
+            span = Span(os.urandom(16).hex(), None, name, kind, attributes, ([parent] if parent else []) + links)
+            with self._lock:
+                self._open[span.trace_id] = []
+                if len(self._open) > MAX_OPEN_TRACES:
+                    self._open.popitem(last=False)  # корень так и не закрылся (отмененная задача)
+        elif parent is None:
+            return None
+        else:
+            span = Span(parent.trace_id, parent.span_id, name, kind, attributes, links)
+        if activate:
+            span._token = _current.set(span)
+        return span
+
+    def end_span(self, span: Optional[Span], error: Optional[BaseException] = None):
+        if span is None:
+            return
+        span.finish(error)
+        if span._token is not None:
+            try:
+                _current.reset(span._token)
+            except ValueError:
+                pass  # закрыт в другом контексте
+            span._token = None
+        self._finish(span)
+
+    @contextmanager
+    def span(self, name: str, kind: int = KIND_INTERNAL, parent: Optional[Span] = None,
+             links: Optional[List[Span]] = None, **attributes):
+        """Спан на время блока; yield отдает Span (или None вне трассы) для set()."""
+        span = self.start_span(name, kind, parent=parent, links=links, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            self.end_span(span, e)
+            raise
+        else:
+            self.end_span(span)
+
+    @contextmanager
+    def trace(self, name: str, kind: int = KIND_SERVER, **attributes):
+        """Новая трасса на время блока (апдейт, фоновая работа со ссылкой на породившую трассу)."""
+        span = self.start_span(name, kind, new_trace=True, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            self.end_span(span, e)
+            raise
+        else:
+            self.end_span(span)
+
+    def _finish(self, span: Span):
+        with self._lock:
+            if span.parent_id is None:
+                spans = self._open.pop(span.trace_id, [])
+                spans.append(span)
+                if not self._sampled(span, spans):
+                    return
+                self._kept[span.trace_id] = None
+                if len(self._kept) > MAX_OPEN_TRACES:
+                    self._kept.popitem(last=False)
+                self._export(spans)
+                return
+            spans = self._open.get(span.trace_id)
+            if spans is not None:
+                if len(spans) < MAX_SPANS_PER_TRACE:
+                    spans.append(span)
+            elif span.trace_id in self._kept:
+                # Фоновая работа, пережившая апдейт: дописываем отдельной строкой с тем же traceId
+                self._export([span])
+
+    def _sampled(self, root: Span, spans: List[Span]) -> bool:
+        if root.duration >= self.slow_seconds or any(s.error for s in spans):
+            return True
+        return random.random() < self.sample_rate
+
+    def _export(self, spans: List[Span]):
+        if len(self._lines) >= MAX_PENDING_LINES:
+            self.dropped += 1
+            return
+        record = {"resourceSpans": [dict(self.resource, scopeSpans=[
+            {"scope": {"name": "Bot_tg"}, "spans": [s.to_otlp() for s in spans]}])]}
+        self._lines.append(json.dumps(record, ensure_ascii=False))
+        self.exported += 1
+
+    # --- Запись ---
+    def flush(self):
+        """Дописывает накопленные трассы в файл (синхронно, вызывать из to_thread)."""
+        with self._lock:
+            lines, self._lines = self._lines, []
+        if not lines or not self.path:
+            return
+        with self._write_lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                os.replace(self.path, self.path + ".1")
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+
+    async def run_flusher(self, interval_seconds: float = 1.0):
+        """Фоновая запись трасс."""
+        while True:
+            try:
+                await asyncio.sleep(interval_seconds)
+                await asyncio.to_thread(self.flush)
+            except asyncio.CancelledError:
+                self.flush()
+                raise
+            except Exception as e:
+                logger.error(f"[TRACING] Ошибка записи трасс: {e}")
+
+
+tracer = Tracer(TRACE_FILE, sample_rate=TRACE_SAMPLE_RATE, slow_seconds=TRACE_SLOW_SECONDS,
+                max_bytes=TRACE_MAX_BYTES)
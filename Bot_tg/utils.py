@@ -1,39 +1,100 @@
 import os
 import json
+import zlib
 import base64
-from typing import List, Dict
-from Bot_tg.config import TELOS_DEFAULT_FILE, PROFILE_FILE, Interaction
+from typing import List, Dict, Optional, Sequence
+from Bot_tg.config import TELOS_DEFAULT_FILE, WEBAPP_PAYLOAD_VERSION, Interaction
+from Bot_tg.profile_sections import ProfileDocument
+from Bot_tg.metrics import timed_io
+from Bot_tg.tracing import tracer
 
 def read_file_sync(filepath: str) -> str:
     """Synchronously reads a file and returns its content."""
-    if os.path.exists(filepath):
-        with open(filepath, "r", encoding="utf-8") as f:
-            return f.read()
-    return ""
+    with tracer.span("file.read", path=os.path.basename(filepath)) as span:
+        if os.path.exists(filepath):
+            with open(filepath, "r", encoding="utf-8") as f:
+                content = f.read()
+            if span:
+                span.set(chars=len(content))
+            return content
+        return ""
 
 def write_file_sync(filepath: str, content: str):
     """Synchronously writes content to a file."""
+    with tracer.span("file.write", path=os.path.basename(filepath), chars=len(content)):
+        with open(filepath, "w", encoding="utf-8") as f:
+            f.write(content)
+
+def load_json_sync(filepath: str):
+    """Synchronously loads JSON from a file. Returns an empty list if the file is missing or broken."""
+    if not os.path.exists(filepath):
+        return []
+    try:
+        with open(filepath, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except json.JSONDecodeError as e:
+        print(f"[UTILS] Invalid JSON in {filepath}: {e}")
+        return []
+
+def write_json_sync(filepath: str, data):
+    """Synchronously writes data to a file as JSON."""
     with open(filepath, "w", encoding="utf-8") as f:
-        f.write(content)
+        json.dump(data, f, indent=4, ensure_ascii=False)
 
-def generate_webapp_url(base_url: str, questions: List[Dict]) -> str:
+def _b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+def encode_webapp_payload(questions: Sequence[Dict], version: int = WEBAPP_PAYLOAD_VERSION) -> str:
     """
-    Generate a URL by adding questions to the URL hash (base64 encoded).
-    This allows using a static page on GitHub Pages.
+    Fragment part of the WebApp URL with the questions.
+    v2: zlib-deflated JSON (decoded by DecompressionStream("deflate") on the page);
+    v1: plain JSON, kept for rollback. Both are URL-safe base64 without padding.
     """
     # Minify JSON to save space
-    json_data = json.dumps(questions, ensure_ascii=False, separators=(',', ':'))
-    # Encode to Base64 (URL-safe)
-    b64_data = base64.urlsafe_b64encode(json_data.encode('utf-8')).decode('utf-8')
-    full_url = f"{base_url}#d={b64_data}"
-    
-    return full_url
+    json_data = json.dumps(list(questions), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    if version >= 2:
+        return f"v=2&z={_b64url(zlib.compress(json_data, 9))}"
+    return f"d={_b64url(json_data)}"
+
+def generate_webapp_url(base_url: str, questions: Sequence[Dict], version: int = WEBAPP_PAYLOAD_VERSION) -> str:
+    """
+    Generate a URL by adding questions to the URL hash (see encode_webapp_payload).
+    This allows using a static page on GitHub Pages.
+    """
+    return f"{base_url}#{encode_webapp_payload(questions, version)}"
+
+def _format_indices(indices: Sequence[int]) -> str:
+    """[0, 1, 2, 5, 7, 8] -> '0-2,5,7-8'."""
+    parts = []
+    start = prev = None
+    for i in indices:
+        if prev is not None and i == prev + 1:
+            prev = i
+            continue
+        if start is not None:
+            parts.append(str(start) if start == prev else f"{start}-{prev}")
+        start = prev = i
+    if start is not None:
+        parts.append(str(start) if start == prev else f"{start}-{prev}")
+    return ",".join(parts)
+
+def generate_pack_url(base_url: str, pack_id: str, indices: Optional[Sequence[int]] = None) -> str:
+    """
+    URL of a pre-built question pack on GitHub Pages: the page fetches packs/<pack_id>.json
+    and shows only the given question indices (all of them if omitted).
+    """
+    fragment = f"p={pack_id}"
+    if indices is not None:
+        fragment += f"&i={_format_indices(indices)}"
+    return f"{base_url}#{fragment}"
 
+@timed_io("initial_profile")
 def create_initial_profile(interactions: List[Interaction]) -> str:
     """
-    Creates a profile based on answers and the TELOS template (bypassing LLM).
+    Creates a profile text based on answers and the TELOS template (bypassing LLM).
+    Saving is up to the caller (see ProfileStore.put with backup=True).
     """
-    # Read the template
+    # Read and parse the template
     template = read_file_sync(TELOS_DEFAULT_FILE)
     if not template:
         print("[UTILS] Template file not found!")
@@ -53,6 +114,8 @@ def create_initial_profile(interactions: List[Interaction]) -> str:
         "Какую роль ты бы отвел мне": "**10. ДОПОЛНИТЕЛЬНЫЙ КОНТЕКСТ**"
     }
 
+    document = ProfileDocument.parse(template)
+
     # Process interactions
     for interaction in interactions:
         q_text = interaction.question
@@ -79,20 +142,8 @@ def create_initial_profile(interactions: List[Interaction]) -> str:
 
             formatted_answer = f"\n* **{label}**: {a_text}"
             
-            if target_section in template:
-                parts = template.split(target_section)
-                if len(parts) > 1:
-                    # Insert after the header
-                    template = parts[0] + target_section + formatted_answer + parts[1]
-
-    # Если файл профиля уже существует, делаем бэкап
-    if os.path.exists(PROFILE_FILE):
-        import shutil
-        from datetime import datetime
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        backup_path = f"{PROFILE_FILE.replace('.md', '')}_{timestamp}_backup.md"
-        shutil.copy2(PROFILE_FILE, backup_path)
-        print(f"[UTILS] Existing profile backed up to {backup_path}")
+            if target_section in document:
+                # Insert after the header
+                document.prepend(target_section, formatted_answer)
 
-    write_file_sync(PROFILE_FILE, template)
-    return template
+    return document.text
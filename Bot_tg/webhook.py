@@ -0,0 +1,214 @@
+import json
+import hmac
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Dict, Optional, Set, Tuple
+
+from aiohttp import web, ClientSession, ClientError, ClientTimeout
+from telebot.types import Update
+
+from Bot_tg.config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET,
+    WEBHOOK_QUEUE_SIZE, WEBHOOK_CONCURRENCY, WEBHOOK_DRAIN_TIMEOUT, WEBHOOK_RECORD_FILE
+)
+from Bot_tg.sharding import owner_url
+from Bot_tg.metrics import registry
+from Bot_tg.tracing import tracer, create_detached_task
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# Апдейт, уже пересланный другим воркером: обрабатываем на месте, без повторной пересылки
+FORWARDED_HEADER = "X-Askme-Forwarded"
+
+
+def update_chat_id(update: Update):
+    """chat_id апдейта (для маршрутизации по воркерам); None, если чата нет."""
+    for item in (update.message, update.edited_message, update.callback_query and update.callback_query.message):
+        if item is not None and getattr(item, "chat", None) is not None:
+            return item.chat.id
+    return None
+
+
+class WebhookServer:
+    """
+    Прием апдейтов Telegram через вебхук вместо long polling.
+    Запрос проверяется по секретному токену, кладется в очередь своего чата и сразу
+    подтверждается (200). У каждого чата с апдейтами своя задача: внутри чата порядок
+    сохраняется, а долгий вызов LLM в одном чате не задерживает другие. Одновременно
+    обрабатывается не больше concurrency апдейтов. Если ожидающих апдейтов больше
+    queue_size, отвечаем 503 — Telegram повторит доставку позже.
+    Если воркеров несколько, апдейт чужого чата пересылается воркеру-владельцу (см. sharding).
+    С record_file принятые апдейты дописываются в JSONL ({"t": время, "update": ...}) для replay.
+    """
+
+    def __init__(self, bot, path: str = "/telegram/webhook", secret: Optional[str] = None,
+                 queue_size: int = 1000, concurrency: int = 64, record_file: Optional[str] = None):
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.queue_size = max(1, queue_size)
+        self.concurrency = max(1, concurrency)
+        self._slots = asyncio.Semaphore(self.concurrency)
+        # ключ чата -> ожидающие (апдейт, время приема); задача чата живет, пока очередь не опустеет
+        self._chats: Dict[object, Deque[Tuple[Update, float]]] = {}
+        self._chat_tasks: Dict[object, asyncio.Task] = {}
+        self._queued = 0
+        self._active = 0
+        self._runner: Optional[web.AppRunner] = None
+        self._accepting = False
+        self._http: Optional[ClientSession] = None
+        self.record_file = record_file
+        self._record = None
+        self.forwarded = 0
+        self.received = 0
+        self.rejected = 0
+        registry.counter("askme_webhook_updates_total", "Апдейты вебхука: принятые, отклоненные (503), пересланные",
+                         ["result"], collect=lambda: {("received",): self.received, ("rejected",): self.rejected,
+                                                      ("forwarded",): self.forwarded})
+        registry.gauge("askme_webhook_queue_depth", "Апдейты вебхука, ждущие обработки", collect=self.depth)
+        registry.gauge("askme_webhook_active", "Апдейты вебхука в обработке", collect=lambda: self._active)
+
+    # --- HTTP ---
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/healthz", self.handle_health)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            logger.warning(f"[WEBHOOK] Запрос с неверным секретом от {request.remote}")
+            return web.Response(status=403)
+        if not self._accepting:
+            return web.Response(status=503, text="shutting down")
+        try:
+            payload = await request.json()
+            update = Update.de_json(payload)
+        except (json.JSONDecodeError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"[WEBHOOK] Некорректный апдейт: {e}")
+            return web.Response(status=400)
+        chat_id = update_chat_id(update)
+        peer = owner_url(chat_id) if chat_id is not None and FORWARDED_HEADER not in request.headers else None
+        if peer:
+            return await self._forward(peer, payload)
+        if self._queued >= self.queue_size:
+            self.rejected += 1
+            logger.warning(f"[WEBHOOK] Очередь переполнена, апдейт {update.update_id} отклонен.")
+            return web.Response(status=503, text="busy")
+        self._enqueue(chat_id if chat_id is not None else ("update", update.update_id), update)
+        self.received += 1
+        if self._record is not None:
+            self._record.write(json.dumps({"t": round(time.time(), 3), "update": payload}, ensure_ascii=False) + "\n")
+        return web.Response(text="ok")
+
+    async def _forward(self, peer: str, payload) -> web.Response:
+        """Передает апдейт воркеру-владельцу чата; его ответ (в т.ч. 503) уходит в Telegram."""
+        headers = {FORWARDED_HEADER: "1"}
+        if self.secret:
+            headers[SECRET_HEADER] = self.secret
+        try:
+            async with self._http.post(peer + self.path, json=payload, headers=headers) as response:
+                self.forwarded += 1
+                return web.Response(status=response.status, text=await response.text())
+        except (ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"[WEBHOOK] Воркер {peer} недоступен: {e}")
+            return web.Response(status=502)
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({"accepting": self._accepting, "queued": self.depth(), "active": self._active,
+                                  "chats": len(self._chat_tasks), "received": self.received,
+                                  "rejected": self.rejected, "forwarded": self.forwarded})
+
+    def depth(self) -> int:
+        """Принятые апдейты, обработка которых еще не началась."""
+        return self._queued
+
+    # --- Обработка ---
+    def _enqueue(self, key, update: Update):
+        self._chats.setdefault(key, deque()).append((update, time.monotonic()))
+        self._queued += 1
+        if key not in self._chat_tasks:
+            self._chat_tasks[key] = create_detached_task(self._run_chat(key))
+
+    async def _run_chat(self, key):
+        """Обрабатывает апдейты одного чата по порядку; завершается, когда очередь чата пуста."""
+        queue = self._chats[key]
+        try:
+            while queue:
+                update, received = queue.popleft()
+                self._queued -= 1
+                async with self._slots:
+                    self._active += 1
+                    try:
+                        # Трасса начинается здесь, чтобы ожидание своей очереди и слота было видно
+                        with tracer.trace("webhook.update", update_id=update.update_id,
+                                          queue_wait_s=round(time.monotonic() - received, 6)):
+                            await self.bot.process_new_updates([update])
+                    except Exception as e:
+                        logger.error(f"[WEBHOOK] Ошибка обработки апдейта {update.update_id}: {e}")
+                    finally:
+                        self._active -= 1
+        finally:
+            # Между проверкой пустой очереди и удалением нет await: новый апдейт не потеряется
+            self._queued -= len(queue)
+            self._chats.pop(key, None)
+            self._chat_tasks.pop(key, None)
+
+    # --- Жизненный цикл ---
+    async def start(self, host: str = "0.0.0.0", port: int = 8080, public_url: Optional[str] = None):
+        self._http = ClientSession(timeout=ClientTimeout(total=10))
+        if self.record_file:
+            self._record = open(self.record_file, "a", encoding="utf-8", buffering=1)
+            print(f"[WEBHOOK] Апдейты записываются в {self.record_file}")
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self._accepting = True
+        if public_url:
+            await self.bot.set_webhook(url=public_url.rstrip("/") + self.path, secret_token=self.secret)
+            print(f"[WEBHOOK] Вебхук зарегистрирован: {public_url.rstrip('/')}{self.path}")
+        print(f"[WEBHOOK] Сервер слушает {host}:{port}{self.path} (одновременно до {self.concurrency} апдейтов).")
+
+    async def stop(self, drain_timeout: float = 20.0):
+        """Перестает принимать апдейты, дорабатывает очереди чатов и останавливает сервер."""
+        self._accepting = False
+        pending = self.depth() + self._active
+        if pending:
+            print(f"[WEBHOOK] Дорабатываю {pending} апдейтов...")
+        tasks: Set[asyncio.Task] = set(self._chat_tasks.values())
+        if tasks:
+            _, unfinished = await asyncio.wait(tasks, timeout=drain_timeout)
+            if unfinished:
+                logger.warning(f"[WEBHOOK] Не успели обработать {self.depth() + self._active} апдейтов "
+                               f"за {drain_timeout} с.")
+                for task in unfinished:
+                    task.cancel()
+                await asyncio.gather(*unfinished, return_exceptions=True)
+        if self._runner is not None:
+            await self._runner.cleanup()
+        if self._http is not None:
+            await self._http.close()
+        if self._record is not None:
+            self._record.close()
+            self._record = None
+        print("[WEBHOOK] Сервер остановлен.")
+
+
+async def run_webhook(bot, stop_event: asyncio.Event):
+    """Запускает сервер вебхука с настройками из config и работает до stop_event."""
+    server = WebhookServer(
+        bot,
+        path=WEBHOOK_PATH,
+        secret=WEBHOOK_SECRET,
+        queue_size=WEBHOOK_QUEUE_SIZE,
+        concurrency=WEBHOOK_CONCURRENCY,
+        record_file=WEBHOOK_RECORD_FILE
+    )
+    await server.start(WEBHOOK_HOST, WEBHOOK_PORT, public_url=WEBHOOK_URL)
+    try:
+        await stop_event.wait()
+    finally:
+        await server.stop(WEBHOOK_DRAIN_TIMEOUT)
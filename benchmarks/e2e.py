@@ -0,0 +1,368 @@
+"""
+Сквозной бенчмарк бота: настоящие обработчики, хранилища, очередь отправки и планировщик LLM,
+но поддельные Gemini (задержки из заданного распределения) и Telegram Bot API.
+Каждый чат проходит полный путь пользователя: /start и анкета знакомства, свободный диалог
+с вопросами agent_01 и анализом agent_06, /profile, /analysis, /continue, /ikigai, /shadow,
+/tasks, /schedule, /greeting. Для каждого шага считаются p50/p95/p99, для прогона —
+завершенные сессии в секунду. Отчет — JSON (--out), его можно сравнить с прошлым (--baseline).
+
+    python benchmarks/e2e.py --chats 20
+    python benchmarks/e2e.py --chats 100 --time-scale 0.1 --out results-new.json --baseline results-old.json
+    python benchmarks/e2e.py --pro-latency fixed:2000 --flash-latency uniform:300,900 --no-rate-limits
+
+Данные бота пишутся во временный каталог (RESULTS_DIR) и удаляются после прогона (--keep-data — оставить).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import asyncio
+import platform
+import tempfile
+import shutil
+import subprocess
+import contextlib
+from collections import defaultdict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, PROJECT_ROOT)
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль по ближайшему рангу (значения не интерполируются)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(-(-q * len(ordered) // 100)))  # ceil(q/100 * n)
+    return ordered[rank - 1]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 1),
+        "p95_ms": round(percentile(values, 95) * 1000, 1),
+        "p99_ms": round(percentile(values, 99) * 1000, 1),
+        "mean_ms": round(sum(values) / len(values) * 1000, 1) if values else 0.0,
+        "max_ms": round(max(values) * 1000, 1) if values else 0.0,
+    }
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.busy: Dict[str, int] = defaultdict(int)
+        self.completed = 0
+
+
+class UserJourney:
+    """Один пользователь: шлет апдейты в бота и ждет, пока обработчик их отработает."""
+
+    def __init__(self, bot, chat_id: int, stats: Stats, think_time: float):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.stats = stats
+        self.think_time = think_time
+
+    async def _dispatch(self, step: str, update) -> List:
+        from Bot_tg.llm_scheduler import BUSY_MESSAGE
+        sent = self.bot.sent.setdefault(self.chat_id, [])
+        before = len(sent)
+        started = time.perf_counter()
+        await self.bot.process_new_updates([update])
+        self.stats.latencies[step].append(time.perf_counter() - started)
+        replies = sent[before:]
+        if any(m.text == BUSY_MESSAGE for m in replies):
+            self.stats.busy[step] += 1
+        if self.think_time:
+            await asyncio.sleep(self.think_time)
+        return replies
+
+    async def text(self, step: str, text: str) -> List:
+        from benchmarks.fakes import make_update
+        return await self._dispatch(step, make_update(self.chat_id, text=text))
+
+    async def submit(self, step: str) -> bool:
+        """Отвечает на все вопросы текущей анкеты WebApp; True — сессия завершилась."""
+        from benchmarks.fakes import make_update
+        from Bot_tg.session_store import session_store
+        session = await session_store.get(self.chat_id)
+        if session is None:
+            self.stats.errors[step] += 1
+            return False
+        answers = [
+            {"question": q["question_text"], "answer": (q.get("variants") or [f"Ответ {i + 1} из чата {self.chat_id}"])[0]}
+            for i, q in enumerate(session.questions)
+        ]
+        await self._dispatch(step, make_update(self.chat_id, web_app_data=json.dumps(answers, ensure_ascii=False)))
+        return await self._completed(step, session.mode)
+
+    async def _completed(self, step: str, mode) -> bool:
+        from Bot_tg.session_store import session_store
+        after = await session_store.get(self.chat_id)
+        if after is not None and after.mode == mode:
+            self.stats.errors[step] += 1
+            return False
+        self.stats.completed += 1
+        return True
+
+    async def dialog(self):
+        """Свободный текст -> вопросы agent_01 по одному -> обновление профиля и вопросы agent_06."""
+        from benchmarks.fakes import reply_buttons
+        from Bot_tg.session import SessionMode
+        from Bot_tg.session_store import session_store
+        replies = await self.text("dialog_start", f"Хочу сменить профессию и переехать (чат {self.chat_id})")
+        session = await session_store.get(self.chat_id)
+        if session is None or session.mode != SessionMode.DEFAULT:
+            self.stats.errors["dialog_start"] += 1
+            return
+        while session is not None and session.mode == SessionMode.DEFAULT:
+            buttons = reply_buttons(replies[-1]) if replies else []
+            answer = buttons[0] if buttons else f"Развернутый ответ на вопрос {session.step + 1}"
+            last = session.step + 1 >= len(session.questions)
+            replies = await self.text("dialog_complete" if last else "dialog_answer", answer)
+            if last:
+                await self._completed("dialog_complete", SessionMode.DEFAULT)
+                return
+            session = await session_store.get(self.chat_id)
+
+    async def run(self):
+        await self.text("start", "/start")
+        await self.submit("onboarding_submit")
+        await self.dialog()
+        await self.submit("dialog_analysis_submit")
+        for command in ("profile", "analysis", "continue", "ikigai", "shadow"):
+            await self.text(command, f"/{command}")
+            await self.submit(f"{command}_submit")
+        await self.text("tasks", "/tasks")
+        await self.text("schedule", "/schedule 20 Europe/Moscow")
+        await self.text("schedule", "/schedule")
+        await self.text("start_returning", "/start")
+        await self.text("greeting", "/greeting")
+        await self.submit("greeting_submit")
+
+
+def configure_env(args, data_dir: str):
+    """Окружение до импорта Bot_tg: данные во временном каталоге, без сети и реальных ключей."""
+    os.environ["RESULTS_DIR"] = data_dir
+    os.environ.setdefault("GOOGLE_API_KEY", "bench")
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:FAKE")
+    os.environ["SESSION_BACKEND"] = args.session_backend
+    os.environ["WORKER_COUNT"] = "1"
+    if args.no_rate_limits:
+        os.environ["SEND_GLOBAL_RATE"] = "100000"
+        os.environ["SEND_CHAT_RATE"] = "100000"
+        os.environ["SEND_CHAT_BURST"] = "100000"
+    if args.traces:
+        os.environ["TRACE_FILE"] = os.path.abspath(args.traces)
+        os.environ["TRACE_SAMPLE_RATE"] = "1"
+
+
+def git_revision() -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+                                capture_output=True, text=True, timeout=5)
+        return result.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def add_fake_arguments(parser: argparse.ArgumentParser):
+    """Параметры поддельных Gemini и Telegram (общие для e2e.py и load.py)."""
+    parser.add_argument("--pro-latency", default="lognormal:2500,0.4", help="задержка llm_pro, мс")
+    parser.add_argument("--flash-latency", default="lognormal:900,0.4", help="задержка llm_flash, мс")
+    parser.add_argument("--telegram-latency", default="lognormal:60,0.3", help="задержка Bot API, мс")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="множитель всех задержек (0.1 — в 10 раз быстрее)")
+    parser.add_argument("--no-rate-limits", action="store_true", help="снять лимиты отправки Telegram")
+    parser.add_argument("--session-backend", default="memory", choices=["memory", "sqlite"])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep-data", action="store_true", help="не удалять каталог с данными бота")
+    parser.add_argument("--traces", help="писать все трассы в этот JSONL (разбор: scripts/slow_traces.py)")
+    parser.add_argument("--verbose", action="store_true", help="не прятать вывод бота")
+
+
+def start_fake_bot(args):
+    """Та же инициализация, что в app.py, но с поддельными Gemini и ботом. Возвращает (bot, responder)."""
+    from benchmarks.fakes import FakeBot, LatencyModel, install_fake_llm
+    from Bot_tg.config import PROGRESS_DB_FILE
+    responder = install_fake_llm(
+        LatencyModel(args.pro_latency, seed=args.seed, scale=args.time_scale),
+        LatencyModel(args.flash_latency, seed=args.seed + 1, scale=args.time_scale),
+    )
+    from Bot_tg.state_manager import load_user_progress
+    from Bot_tg.question_pool import get_telos_pool
+    from Bot_tg.handlers import register_handlers
+    from Bot_tg.handlers_shadow import register_shadow_handlers
+    from Bot_tg.agent_cache import agent_cache
+    from Bot_tg.prefetch import prefetcher  # noqa: F401 — как в app.py
+    from Bot_tg.results_journal import open_results_journal
+
+    load_user_progress(PROGRESS_DB_FILE, pool=get_telos_pool())
+    open_results_journal()
+    agent_cache.load()
+    bot = FakeBot(LatencyModel(args.telegram_latency, seed=args.seed + 2, scale=args.time_scale))
+    register_shadow_handlers(bot)
+    register_handlers(bot)
+    return bot, responder
+
+
+async def stop_fake_bot() -> float:
+    """Дожидается фоновых обновлений профиля и закрывает хранилища; возвращает время ожидания, с."""
+    from Bot_tg.profile_store import profile_store
+    from Bot_tg.agent_cache import agent_cache
+    from Bot_tg.profile_updater import profile_updater
+    from Bot_tg.session_store import session_store
+    from Bot_tg.results_journal import results_journal
+    from Bot_tg.tracing import tracer
+    started = time.perf_counter()
+    await profile_updater.drain(timeout=600)
+    drain = time.perf_counter() - started
+    await profile_store.flush()
+    await results_journal.close()
+    await asyncio.to_thread(agent_cache.save)
+    await session_store.close()
+    await asyncio.to_thread(tracer.flush)
+    return drain
+
+
+def bot_counters() -> Dict:
+    """Внутренние счетчики бота после прогона."""
+    from Bot_tg.agent_cache import agent_cache
+    from Bot_tg.profile_updater import profile_updater
+    from Bot_tg.context_builder import context_stats
+    from Bot_tg.agents import agent_03_stats
+    from Bot_tg.metrics import snapshot
+    return {
+        "agent_03": dict(agent_03_stats),
+        "context": dict(context_stats),
+        "agent_cache": {"hits": agent_cache.hits, "misses": agent_cache.misses},
+        "profile_updater": {"rewrites": profile_updater.rewrites, "batches": profile_updater.batches,
+                            "coalesced": profile_updater.coalesced},
+        "metrics": snapshot(),
+    }
+
+
+def run_isolated(args, prefix: str, run: Callable[[], Awaitable[Dict]]) -> Dict:
+    """Запускает прогон с данными бота во временном каталоге и выводом бота в лог."""
+    data_dir = tempfile.mkdtemp(prefix=prefix)
+    configure_env(args, data_dir)
+    log_path = os.path.join(data_dir, "bot.log")
+    try:
+        with open(log_path, "w", encoding="utf-8") as log, contextlib.ExitStack() as stack:
+            if not args.verbose:
+                import logging
+                logging.basicConfig(stream=log, level=logging.INFO)
+                stack.enter_context(contextlib.redirect_stdout(log))
+            return asyncio.run(run())
+    finally:
+        if args.keep_data:
+            print(f"[BENCH] Данные и лог бота: {data_dir}")
+        else:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def report_meta(args) -> Dict:
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "args": vars(args),
+    }
+
+
+async def run_benchmark(args) -> Dict:
+    from Bot_tg.llm_scheduler import llm_scheduler
+    bot, responder = start_fake_bot(args)
+
+    stats = Stats()
+    journeys = [UserJourney(bot, args.first_chat_id + i, stats, args.think_ms * args.time_scale / 1000)
+                for i in range(args.chats)]
+
+    async def start(i: int, journey: UserJourney):
+        await asyncio.sleep(args.ramp_up * i / max(1, args.chats))
+        started = time.perf_counter()
+        try:
+            await journey.run()
+        except Exception as e:
+            stats.errors["journey"] += 1
+            print(f"[E2E] Чат {journey.chat_id}: {type(e).__name__}: {e}", file=sys.__stderr__)
+        stats.latencies["journey"].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(start(i, j) for i, j in enumerate(journeys)))
+    wall = time.perf_counter() - started
+
+    drain = await stop_fake_bot()
+
+    flows = {step: summarize(values) for step, values in stats.latencies.items()}
+    for step, count in stats.errors.items():
+        flows.setdefault(step, summarize([]))["errors"] = count
+    for step, count in stats.busy.items():
+        flows.setdefault(step, summarize([]))["busy"] = count
+
+    return {
+        "meta": report_meta(args),
+        "throughput": {
+            "chats": args.chats,
+            "wall_s": round(wall, 3),
+            "sessions_completed": stats.completed,
+            "sessions_per_s": round(stats.completed / wall, 3) if wall else 0.0,
+            "journeys_per_s": round(args.chats / wall, 3) if wall else 0.0,
+            "background_drain_s": round(drain, 3),
+        },
+        "flows": dict(sorted(flows.items())),
+        "llm": {"calls": dict(sorted(responder.calls.items())), "scheduler_running_at_end": llm_scheduler.running()},
+        "telegram": {"calls": dict(sorted(bot.api_calls.items()))},
+        "counters": bot_counters(),
+    }
+
+
+def print_report(report: Dict, baseline: Optional[Dict] = None):
+    t = report["throughput"]
+    print(f"[E2E] Чатов: {t['chats']}, время: {t['wall_s']} с, сессий: {t['sessions_completed']} "
+          f"({t['sessions_per_s']}/с), фоновые обновления профиля дописаны за {t['background_drain_s']} с")
+    base_flows = (baseline or {}).get("flows", {})
+    header = f"{'шаг':<20}{'n':>6}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'ошибки':>8}"
+    print(header + ("   Δp50 / Δp95 к базе" if base_flows else ""))
+    for step, s in report["flows"].items():
+        line = f"{step:<20}{s['count']:>6}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}" \
+               f"{s.get('errors', 0) + s.get('busy', 0):>8}"
+        base = base_flows.get(step)
+        if base and base.get("count"):
+            line += f"   {s['p50_ms'] - base['p50_ms']:+.1f} / {s['p95_ms'] - base['p95_ms']:+.1f}"
+        print(line)
+    if baseline:
+        base_rate = baseline.get("throughput", {}).get("sessions_per_s")
+        if base_rate:
+            print(f"[E2E] Сессий в секунду: {t['sessions_per_s']} (база {base_rate}, {t['sessions_per_s'] / base_rate - 1:+.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=20, help="одновременных пользователей")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="за сколько секунд стартуют все чаты")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="пауза пользователя между шагами")
+    parser.add_argument("--first-chat-id", type=int, default=900000001)
+    parser.add_argument("--out", help="куда записать JSON-отчет")
+    parser.add_argument("--baseline", help="прошлый JSON-отчет для сравнения")
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    report = run_isolated(args, "askme-e2e-", lambda: run_benchmark(args))
+    print_report(report, baseline)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"[E2E] Отчет: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
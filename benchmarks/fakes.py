@@ -0,0 +1,282 @@
+"""
+Подделки внешних зависимостей для бенчмарков: модель Gemini (FakeChatModel) и Telegram Bot API (FakeBot).
+Ответы модели детерминированы и имеют ту же форму, что у настоящих агентов (JSON с вопросами,
+профиль TELOS, патчи разделов), задержки — из распределения с фиксированным seed.
+"""
+import re
+import json
+import hashlib
+import time
+import random
+import asyncio
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+from telebot.async_telebot import AsyncTeleBot
+
+# --- Задержки ---
+
+class LatencyModel:
+    """
+    Распределение задержки в миллисекундах по строке вида:
+    fixed:800, uniform:200,1500, normal:800,200, lognormal:800,0.5 (медиана и sigma).
+    scale умножает все значения (0.1 — прогон в 10 раз быстрее реального).
+    """
+
+    KINDS = ("fixed", "uniform", "normal", "lognormal")
+
+    def __init__(self, spec: str, seed: int = 0, scale: float = 1.0):
+        kind, _, params = spec.partition(":")
+        self.kind = kind.strip().lower()
+        if self.kind not in self.KINDS:
+            raise ValueError(f"неизвестное распределение задержки: {spec}")
+        self.params = [float(p) for p in params.split(",") if p.strip()] or [0.0]
+        self.spec = spec
+        self.scale = scale
+        self._rng = random.Random(seed)
+
+    def sample(self) -> float:
+        """Задержка в секундах."""
+        p = self.params
+        if self.kind == "fixed":
+            ms = p[0]
+        elif self.kind == "uniform":
+            ms = self._rng.uniform(p[0], p[1] if len(p) > 1 else p[0])
+        elif self.kind == "normal":
+            ms = self._rng.gauss(p[0], p[1] if len(p) > 1 else 0.0)
+        else:
+            ms = p[0] * self._rng.lognormvariate(0.0, p[1] if len(p) > 1 else 0.5)
+        return max(0.0, ms) * self.scale / 1000
+
+
+# --- Ответы агентов ---
+
+TELOS_SECTIONS = [
+    "ИМЯ / ИДЕНТИФИКАЦИЯ", "ПРЕДПОЧТИТЕЛЬНЫЙ СТИЛЬ ОБЩЕНИЯ", "ЛИЧНОСТНЫЕ ХАРАКТЕРИСТИКИ",
+    "ПРОФЕССИЯ / РОД ДЕЯТЕЛЬНОСТИ", "ЦЕЛИ И МОТИВАЦИЯ", "КЛЮЧЕВЫЕ ЦЕННОСТИ", "КОГНИТИВНЫЙ ПРОФИЛЬ",
+    "ПРЕДПОЧИТАЕМЫЕ ТЕМЫ ДЛЯ ОБСУЖДЕНИЯ", "ОГРАНИЧЕНИЯ И ТАБУ", "ДОПОЛНИТЕЛЬНЫЙ КОНТЕКСТ",
+    "ЯЗЫКОВЫЕ ОСОБЕННОСТИ", "ЮМОР И ЭМОЦИОНАЛЬНОСТЬ", "КУЛЬТУРНЫЕ ПРЕДПОЧТЕНИЯ", "ЧТЕНИЕ И САМОРАЗВИТИЕ",
+    "ИСТОРИЯ"
+]
+
+
+# Подставляется хэшем промпта: профили разных пользователей различаются, как в жизни
+# (иначе кэш агентов по тексту профиля отдавал бы всем один ответ)
+DIGEST = "@digest@"
+
+
+def _section_body(number: int, title: str) -> str:
+    return "\n".join(
+        f"* {title.capitalize()}: наблюдение {i + 1} — пользователь подробно описал эту сторону жизни."
+        for i in range(2)
+    ) + f"\n* Тег раздела: telos-{number}-{DIGEST}"
+
+
+def _questions(agent: str, count: int, with_choice: bool = False) -> str:
+    questions = []
+    for i in range(count):
+        question = {"question_text": f"[{agent}] Вопрос {i + 1}: что для тебя важно в этой теме?", "type": "open_text"}
+        if with_choice and i == 0:
+            question.update(type="multiple_choice", variants=["Да", "Нет", "Пока не знаю"])
+        questions.append(question)
+    return "```json\n" + json.dumps(questions, ensure_ascii=False, indent=2) + "\n```"
+
+
+def _profile() -> str:
+    sections = [f"**{n}. {title}**\n{_section_body(n, title)}" for n, title in enumerate(TELOS_SECTIONS, 1)]
+    return "### TELOS ПРОФИЛЬ ПОЛЬЗОВАТЕЛЯ\n\n" + "\n\n".join(sections) + "\n"
+
+
+def _patches() -> str:
+    patches = [
+        {"section": f"**{n}. {TELOS_SECTIONS[n - 1]}**", "content": _section_body(n, TELOS_SECTIONS[n - 1])}
+        for n in (5, 10)
+    ]
+    return "```json\n" + json.dumps(patches, ensure_ascii=False, indent=2) + "\n```"
+
+
+def _tasks() -> str:
+    tasks = [{"task": f"Шаг {i + 1}", "deadline": f"неделя {i + 1}"} for i in range(5)]
+    return "```json\n" + json.dumps(tasks, ensure_ascii=False, indent=2) + "\n```"
+
+
+def _analysis(title: str) -> str:
+    return "\n".join(f"**{title}, часть {i + 1}.** Ответы складываются в цельную картину: " * 2 for i in range(12))
+
+
+# Имя агента -> (имя константы промпта, готовый ответ)
+AGENT_PROMPTS = {
+    "agent_01": ("PROMPT_AGENT_01_PSYCHOLOGY_INSTRUCTION", _questions("agent_01", 4, with_choice=True)),
+    "agent_02": ("PROMPT_AGENT_02_INSTRUCTION", "Переписанный текст с учетом ответов пользователя."),
+    "agent_03": ("PROMPT_AGENT_03_INSTRUCTION", _profile()),
+    "agent_03_patch": ("PROMPT_AGENT_03_PATCH", _patches()),
+    "agent_04": ("PROMPT_AGENT_04_INSTRUCTION", _questions("agent_04", 5)),
+    "agent_05": ("PROMPT_AGENT_05_TASK_DECOMPOSITION", _tasks()),
+    "agent_06": ("PROMPT_AGENT_06_DEEP_ANALYSIS", _questions("agent_06", 5)),
+    "agent_07_questions": ("PROMPT_AGENT_07_IKIGAI", _questions("agent_07", 4)),
+    "agent_07_analysis": ("PROMPT_AGENT_07_IKIGAI_ANALYSIS", _analysis("Икигай")),
+    "agent_08_questions": ("PROMPT_AGENT_08_SHADOW_WORK", _questions("agent_08", 3)),
+    "agent_08_analysis": ("PROMPT_AGENT_08_SHADOW_ANALYSIS", _analysis("Тень")),
+}
+
+
+class FakeResponder:
+    """Узнает агента по началу промпта (текст до первой подстановки) и отдает готовый ответ."""
+
+    def __init__(self):
+        from Bot_tg import prompts
+        from Bot_tg.prompts import agent_08
+        self._prefixes = []
+        for agent, (const, response) in AGENT_PROMPTS.items():
+            template = getattr(prompts, const, None) or getattr(agent_08, const)
+            self._prefixes.append((template.split("{", 1)[0], agent, response))
+        # Самый длинный префикс первым: общие вступления промптов не должны путать агентов
+        self._prefixes.sort(key=lambda item: -len(item[0]))
+        self.calls: Counter = Counter()
+
+    def respond(self, prompt: str):
+        for prefix, agent, response in self._prefixes:
+            if prompt.startswith(prefix):
+                self.calls[agent] += 1
+                if DIGEST in response:
+                    digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:12]
+                    response = response.replace(DIGEST, digest)
+                return agent, response
+        self.calls["unknown"] += 1
+        raise ValueError(f"неизвестный промпт: {prompt[:80]!r}")
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Чат-модель langchain вместо Gemini: ответ — по агенту (FakeResponder), задержка — из LatencyModel.
+    При стриминге первый кусок приходит через ttft_share задержки, остальные равномерно за оставшееся время.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    model_name: str = "fake"
+    responder: Any
+    latency: Any
+    chunk_chars: int = 80
+    ttft_share: float = 0.3
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _prompt(self, messages) -> str:
+        return "\n".join(str(m.content) for m in messages)
+
+    def _result(self, text: str) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        _, text = self.responder.respond(self._prompt(messages))
+        time.sleep(self.latency.sample())
+        return self._result(text)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        _, text = self.responder.respond(self._prompt(messages))
+        await asyncio.sleep(self.latency.sample())
+        return self._result(text)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        _, text = self.responder.respond(self._prompt(messages))
+        total = self.latency.sample()
+        chunks = [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)] or [""]
+        await asyncio.sleep(total * self.ttft_share)
+        gap = total * (1 - self.ttft_share) / len(chunks)
+        for i, chunk in enumerate(chunks):
+            if i:
+                await asyncio.sleep(gap)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=chunk))
+
+
+def install_fake_llm(pro_latency: LatencyModel, flash_latency: LatencyModel) -> FakeResponder:
+    """Подменяет config.llm_pro / llm_flash до сборки цепочек агентов."""
+    from Bot_tg import config
+    responder = FakeResponder()
+    config.llm_pro = FakeChatModel(model_name="fake-pro", responder=responder, latency=pro_latency)
+    config.llm_flash = FakeChatModel(model_name="fake-flash", responder=responder, latency=flash_latency)
+    return responder
+
+
+# --- Telegram ---
+
+class FakeBot(AsyncTeleBot):
+    """
+    AsyncTeleBot без сети: обработчики регистрируются и вызываются как обычно (process_new_updates),
+    а вызовы Bot API записываются и отвечают после задержки api_latency.
+    """
+
+    def __init__(self, api_latency: Optional[LatencyModel] = None):
+        super().__init__("123456:FAKE")
+        self.api_latency = api_latency
+        self.api_calls: Counter = Counter()
+        self.sent: Dict[int, List[SimpleNamespace]] = {}
+        self._message_id = 0
+
+    async def _api(self, method: str):
+        self.api_calls[method] += 1
+        if self.api_latency is not None:
+            await asyncio.sleep(self.api_latency.sample())
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        await self._api("sendMessage")
+        self._message_id += 1
+        message = SimpleNamespace(message_id=self._message_id, chat=SimpleNamespace(id=chat_id),
+                                  text=text, reply_markup=reply_markup)
+        self.sent.setdefault(chat_id, []).append(message)
+        return message
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        await self._api("editMessageText")
+        return True
+
+    async def set_my_commands(self, commands, *args, **kwargs):
+        await self._api("setMyCommands")
+        return True
+
+    async def remove_webhook(self):
+        await self._api("deleteWebhook")
+        return True
+
+    async def set_webhook(self, *args, **kwargs):
+        await self._api("setWebhook")
+        return True
+
+
+def reply_buttons(message) -> List[str]:
+    """Тексты обычных кнопок ответа (без WebApp) из reply_markup отправленного сообщения."""
+    keyboard = getattr(getattr(message, "reply_markup", None), "keyboard", None) or []
+    return [b["text"] for row in keyboard for b in row if isinstance(b, dict) and "web_app" not in b]
+
+
+_update_id = 0
+
+
+def make_update(chat_id: int, text: Optional[str] = None, web_app_data: Optional[str] = None,
+                first_name: str = "Bench"):
+    """Update Telegram с текстом или данными WebApp от пользователя chat_id."""
+    from telebot.types import Update
+    global _update_id
+    _update_id += 1
+    message = {
+        "message_id": _update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": first_name},
+    }
+    if web_app_data is not None:
+        message["web_app_data"] = {"data": web_app_data, "button_text": "Анкета"}
+    else:
+        message["text"] = text
+        command = re.match(r"/\S+", text or "")
+        if command:
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": command.end()}]
+    return Update.de_json({"update_id": _update_id, "message": message})
@@ -0,0 +1,70 @@
+"""
+Время импорта модулей бота по `python -X importtime` и проверка, что легкие модули
+не тянут langchain / SDK Google (они должны загружаться только при первом вызове модели).
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --modules Bot_tg.config --max-ms 150 --repeat 5
+
+Код выхода 1, если модуль превысил --max-ms или импортировал запрещенный пакет.
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+DEFAULT_MODULES = ["Bot_tg.config", "Bot_tg.agents", "Bot_tg.agents_shadow", "Bot_tg.handlers"]
+# Пакеты, которых не должно быть в импорте ни одного модуля бота
+HEAVY_PREFIXES = ("langchain", "google.genai", "google.ai", "google.generativeai", "grpc")
+
+LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def profile_import(module: str):
+    """Запускает чистый интерпретатор и возвращает [(модуль, self_us, cumulative_us, глубина)]."""
+    env = dict(os.environ, PYTHONPATH=PROJECT_ROOT)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        tail = result.stderr.strip().splitlines()[-1:] or ["?"]
+        raise RuntimeError(f"import {module} завершился с ошибкой: {tail[0]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        match = LINE_RE.match(line)
+        if match:
+            rows.append((match.group(4), int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES)
+    parser.add_argument("--repeat", type=int, default=3, help="запусков на модуль (берется лучший)")
+    parser.add_argument("--top", type=int, default=8, help="сколько самых тяжелых импортов показать")
+    parser.add_argument("--max-ms", type=float, default=None, help="порог регрессии для каждого модуля")
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        runs = [profile_import(module) for _ in range(max(1, args.repeat))]
+        best = min(runs, key=lambda rows: sum(r[1] for r in rows))
+        total_ms = sum(r[1] for r in best) / 1000
+        heavy = sorted({name for name, *_ in best if name.startswith(HEAVY_PREFIXES)})
+        print(f"{module}: {total_ms:.1f} мс, модулей импортировано: {len(best)}")
+        for name, self_us, cumulative_us, depth in sorted(best, key=lambda r: -r[2])[:args.top]:
+            print(f"    {cumulative_us / 1000:8.1f} мс  {name}")
+        if heavy:
+            failed = True
+            print(f"    ОШИБКА: импортированы тяжелые пакеты: {', '.join(heavy[:5])}")
+        if args.max_ms is not None and total_ms > args.max_ms:
+            failed = True
+            print(f"    ОШИБКА: {total_ms:.1f} мс > порога {args.max_ms:.1f} мс")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,501 @@
+"""
+Генератор нагрузки апдейтами Telegram и воспроизведение записанных потоков.
+Синтетические пользователи приходят пуассоновским потоком и проходят короткие сценарии:
+  start    — /start и ответы на анкету знакомства (web_app_data как из page.tsx),
+  dialog   — свободный текст (agent_01) и ответы на вопросы по одному,
+  continue — /continue и ответы на порцию вопросов TELOS;
+--wave-size добавляет всплеск /continue, как в ежедневную рассылку в 18:00.
+Нагрузка растет ступенями (--rates, апдейтов в секунду); для каждой ступени и каждого
+интервала времени считаются задержки и доля ошибок — по ним видно, где бот насыщается.
+
+Куда подается нагрузка (--target):
+  inproc   — прямо в зарегистрированные обработчики (как при polling), поддельные Gemini и Telegram;
+  webhook  — через HTTP в WebhookServer, поднятый в этом же процессе (видна очередь вебхука и 503);
+  http://… — во внешний вебхук (задержка — только до ответа сервера, обработку не видно).
+
+    python benchmarks/load.py --rates 1,2,5,10 --stage-seconds 30 --time-scale 0.2
+    python benchmarks/load.py --target webhook --rates 20,50,100 --wave-size 300 --wave-at 40
+    python benchmarks/load.py --rates 5 --record stream.jsonl          # сохранить сгенерированный поток
+    python benchmarks/load.py --replay stream.jsonl --speeds 1,2,4,8   # поток из лога, ускоряя по ступеням
+
+Лог для --replay — JSONL вида {"t": секунды, "update": {...}} (так пишет вебхук с WEBHOOK_RECORD_FILE)
+или просто апдейты по строке (тогда они идут с частотой первой ступени --rates).
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import asyncio
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, PROJECT_ROOT)
+
+from benchmarks.e2e import (  # noqa: E402
+    add_fake_arguments, start_fake_bot, stop_fake_bot, bot_counters, run_isolated, report_meta, summarize
+)
+
+DEFAULT_MIX = "start=1,dialog=3,continue=2"
+# Ответы бота, которые считаем ошибкой обработки (BUSY_MESSAGE считается отдельно)
+ERROR_REPLIES = ("Ошибка", "Сессия не найдена", "Не удалось", "Произошла ошибка", "Хм, возникла")
+
+
+# --- Апдейты ---
+
+class UpdateFactory:
+    """Сырые апдейты Telegram (dict, как приходят в вебхук)."""
+
+    def __init__(self):
+        self._update_id = 0
+
+    def _message(self, chat_id: int, **fields) -> Dict:
+        self._update_id += 1
+        message = {
+            "message_id": self._update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+        }
+        message.update(fields)
+        return {"update_id": self._update_id, "message": message}
+
+    def text(self, chat_id: int, text: str) -> Dict:
+        fields = {"text": text}
+        if text.startswith("/"):
+            fields["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return self._message(chat_id, **fields)
+
+    def web_app(self, chat_id: int, questions: List[Dict]) -> Dict:
+        """Ответы анкеты в формате page.tsx: [{question, answer}]."""
+        result = [
+            {"question": q["question_text"], "answer": (q.get("variants") or [f"Ответ {i + 1}: подробно о себе"])[0]}
+            for i, q in enumerate(questions)
+        ]
+        return self._message(chat_id, web_app_data={"data": json.dumps(result, ensure_ascii=False),
+                                                    "button_text": "ОТКРЫТЬ АНКЕТУ"})
+
+
+class Step:
+    """Апдейт сценария: уходит не раньше at (от старта прогона) и через delay после обработки предыдущего."""
+    __slots__ = ("at", "delay", "label", "update")
+
+    def __init__(self, at: float, delay: float, label: str, update: Dict):
+        self.at = at
+        self.delay = delay
+        self.label = label
+        self.update = update
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in SCENARIO_LENGTH:
+            raise ValueError(f"неизвестный сценарий: {name}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+# Сколько апдейтов шлет сценарий (для перевода апдейтов/с в сценарии/с)
+SCENARIO_LENGTH = {"start": 2, "dialog": 5, "continue": 2}
+
+
+class Generator:
+    def __init__(self, args, rng: random.Random):
+        from Bot_tg.config import GREETING_QUESTIONS_FILE
+        from Bot_tg.question_pool import get_telos_pool
+        with open(GREETING_QUESTIONS_FILE, "r", encoding="utf-8") as f:
+            self.greeting = json.load(f)
+        pool = get_telos_pool()
+        self.telos = [pool.questions[i] for i in pool.next_unanswered_positions(0, 10)]
+        self.factory = UpdateFactory()
+        self.rng = rng
+        self.think = args.think_seconds
+        self.next_chat_id = args.first_chat_id
+
+    def _think(self) -> float:
+        return self.think * self.rng.lognormvariate(0.0, 0.6) if self.think else 0.0
+
+    def scenario(self, kind: str, at: float) -> List[Step]:
+        chat_id = self.next_chat_id
+        self.next_chat_id += 1
+        f = self.factory
+        if kind == "start":
+            return [Step(at, 0, "start", f.text(chat_id, "/start")),
+                    Step(at, self._think(), "start_webapp", f.web_app(chat_id, self.greeting))]
+        if kind == "continue":
+            return [Step(at, 0, "continue", f.text(chat_id, "/continue")),
+                    Step(at, self._think(), "continue_webapp", f.web_app(chat_id, self.telos))]
+        steps = [Step(at, 0, "dialog_text", f.text(chat_id, "Хочу понять, чем мне заниматься дальше"))]
+        # Первый вопрос agent_01 бывает с вариантами: "Да" подходит к поддельной модели, иначе это обычный текст
+        for answer in ["Да", "Скорее свобода, чем деньги", "Страх ошибиться", "Через год"]:
+            steps.append(Step(at, self._think(), "dialog_answer", f.text(chat_id, answer)))
+        return steps
+
+    def build(self, rates: List[float], stage_seconds: float, mix: Dict[str, float],
+              wave_size: int, wave_at: float, wave_spread: float) -> List[List[Step]]:
+        """Сценарии со временем старта: пуассоновский поток по ступеням плюс всплеск /continue."""
+        kinds = list(mix)
+        weights = [mix[k] for k in kinds]
+        mean_length = sum(SCENARIO_LENGTH[k] * w for k, w in zip(kinds, weights)) / sum(weights)
+        scenarios = []
+        for stage, rate in enumerate(rates):
+            t = stage * stage_seconds
+            end = t + stage_seconds
+            while rate > 0:
+                t += self.rng.expovariate(rate / mean_length)
+                if t >= end:
+                    break
+                scenarios.append(self.scenario(self.rng.choices(kinds, weights)[0], t))
+        for _ in range(wave_size):
+            scenarios.append(self.scenario("continue", wave_at + self.rng.uniform(0, wave_spread)))
+        scenarios.sort(key=lambda steps: steps[0].at)
+        return scenarios
+
+
+def load_replay(path: str, speeds: List[float], fallback_rate: float, chat_offset: int) -> Tuple[List[List[Step]], float]:
+    """Поток из лога: по ступени на скорость, чаты каждой ступени сдвинуты на chat_offset."""
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if "update" in item:
+                records.append((float(item.get("t", i / fallback_rate)), item["update"]))
+            else:
+                records.append((i / fallback_rate, item))
+    if not records:
+        raise ValueError(f"в {path} нет апдейтов")
+    t0 = min(t for t, _ in records)
+    duration = max(t for t, _ in records) - t0 + 1.0
+    scenarios = []
+    start = 0.0
+    for stage, speed in enumerate(speeds):
+        by_chat: Dict[int, List[Step]] = defaultdict(list)
+        for t, update in records:
+            update = json.loads(json.dumps(update))
+            message = update.get("message") or update.get("edited_message") or {}
+            chat_id = (message.get("chat") or {}).get("id", 0) + stage * chat_offset
+            if message.get("chat"):
+                message["chat"]["id"] = chat_id
+            if message.get("from"):
+                message["from"]["id"] += stage * chat_offset
+            label = "web_app_data" if "web_app_data" in message else \
+                (message.get("text") or "").split()[0] if (message.get("text") or "").startswith("/") else "text"
+            by_chat[chat_id].append(Step(start + (t - t0) / speed, 0, label, update))
+        scenarios.extend(by_chat.values())
+        start += duration / speed
+    scenarios.sort(key=lambda steps: steps[0].at)
+    return scenarios, duration
+
+
+# --- Цели ---
+
+class InprocTarget:
+    """Апдейт сразу в обработчики; готово, когда обработчик отработал."""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def start(self):
+        pass
+
+    async def send(self, update: Dict):
+        from telebot.types import Update
+        await self.bot.process_new_updates([Update.de_json(json.dumps(update))])
+        return 200
+
+    async def stop(self):
+        pass
+
+    def depth(self) -> int:
+        return 0
+
+
+class WebhookTarget:
+    """
+    POST в вебхук. Для локального WebhookServer (bot задан) ждем и окончания обработки,
+    для внешнего — только ответа сервера.
+    """
+
+    def __init__(self, url: str, secret: Optional[str] = None, bot=None, queue_size: int = 1000, concurrency: int = 64):
+        self.url = url
+        self.secret = secret
+        self.bot = bot
+        self.queue_size = queue_size
+        self.concurrency = concurrency
+        self.server = None
+        self._session = None
+        self._done: Dict[int, asyncio.Future] = {}
+
+    async def start(self):
+        from aiohttp import ClientSession, ClientTimeout
+        if self.bot is not None:
+            from Bot_tg.webhook import WebhookServer
+            from urllib.parse import urlparse
+            parsed = urlparse(self.url)
+            original = self.bot.process_new_updates
+
+            async def process_and_mark(updates):
+                try:
+                    await original(updates)
+                finally:
+                    for update in updates:
+                        future = self._done.pop(update.update_id, None)
+                        if future is not None and not future.done():
+                            future.set_result(None)
+
+            self.bot.process_new_updates = process_and_mark
+            self.server = WebhookServer(self.bot, path=parsed.path, secret=self.secret,
+                                        queue_size=self.queue_size, concurrency=self.concurrency)
+            await self.server.start(parsed.hostname, parsed.port)
+        self._session = ClientSession(timeout=ClientTimeout(total=30))
+
+    async def send(self, update: Dict):
+        from Bot_tg.webhook import SECRET_HEADER
+        headers = {SECRET_HEADER: self.secret} if self.secret else {}
+        done = None
+        if self.server is not None:
+            done = self._done[update["update_id"]] = asyncio.get_running_loop().create_future()
+        try:
+            async with self._session.post(self.url, json=update, headers=headers) as response:
+                await response.read()
+                status = response.status
+        except Exception:
+            self._done.pop(update["update_id"], None)
+            raise
+        if done is not None:
+            if status == 200:
+                await done
+            else:
+                self._done.pop(update["update_id"], None)
+        return status
+
+    async def stop(self):
+        if self._session is not None:
+            await self._session.close()
+        if self.server is not None:
+            await self.server.stop(drain_timeout=60)
+
+    def depth(self) -> int:
+        return self.server.depth() if self.server is not None else 0
+
+
+# --- Прогон ---
+
+class Collector:
+    def __init__(self, stage_bounds: List[float], bucket_seconds: float):
+        self.stage_bounds = stage_bounds   # время начала каждой ступени
+        self.bucket_seconds = bucket_seconds
+        self.samples = []                  # (send_t, stage, label, latency, outcome)
+        self.gauges = []                   # (t, llm_running, llm_queued, outbound_depth, webhook_depth)
+
+    def stage_of(self, t: float) -> int:
+        stage = 0
+        for i, bound in enumerate(self.stage_bounds):
+            if t >= bound:
+                stage = i
+        return stage
+
+    def add(self, t: float, label: str, latency: float, outcome: str):
+        self.samples.append((t, self.stage_of(t), label, latency, outcome))
+
+
+def _group(samples) -> Dict:
+    latencies = [s[3] for s in samples if s[4] in ("ok", "busy", "error")]
+    result = summarize(latencies)
+    outcomes = defaultdict(int)
+    for s in samples:
+        outcomes[s[4]] += 1
+    result["sent"] = len(samples)
+    result.update({k: outcomes[k] for k in ("busy", "error", "timeout", "rejected")})
+    failed = sum(outcomes[k] for k in ("busy", "error", "timeout", "rejected"))
+    result["error_rate"] = round(failed / len(samples), 4) if samples else 0.0
+    return result
+
+
+async def run_load(args, scenarios: List[List[Step]], stage_bounds: List[float], offered: List[float]) -> Dict:
+    from Bot_tg.llm_scheduler import llm_scheduler, BUSY_MESSAGE
+    from Bot_tg.sender import outbound
+
+    bot = None
+    if args.target in ("inproc", "webhook"):
+        bot, _ = start_fake_bot(args)
+    if args.target == "inproc":
+        target = InprocTarget(bot)
+    elif args.target == "webhook":
+        target = WebhookTarget(f"http://127.0.0.1:{args.webhook_port}/telegram/webhook", secret="load",
+                               bot=bot, queue_size=args.webhook_queue, concurrency=args.webhook_concurrency)
+    else:
+        target = WebhookTarget(args.target, secret=args.secret)
+    await target.start()
+
+    collector = Collector(stage_bounds, args.bucket_seconds)
+    record = open(args.record, "w", encoding="utf-8") if args.record else None
+    started = time.perf_counter()
+
+    async def sample_gauges():
+        while True:
+            await asyncio.sleep(1.0)
+            collector.gauges.append((round(time.perf_counter() - started, 1), llm_scheduler.running(),
+                                     llm_scheduler.queued(), outbound.depth(), target.depth()))
+
+    async def run_chat(steps: List[Step]):
+        previous_done = 0.0
+        for step in steps:
+            send_at = max(step.at, previous_done + step.delay)
+            await asyncio.sleep(max(0.0, send_at - (time.perf_counter() - started)))
+            sent_t = time.perf_counter() - started
+            if record is not None:
+                record.write(json.dumps({"t": round(sent_t, 3), "update": step.update}, ensure_ascii=False) + "\n")
+            chat_id = step.update.get("message", {}).get("chat", {}).get("id")
+            replies_before = len(bot.sent.get(chat_id, [])) if bot is not None else 0
+            try:
+                status = await asyncio.wait_for(target.send(step.update), timeout=args.timeout)
+                outcome = "ok" if status == 200 else "rejected"
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+            except Exception as e:
+                outcome = "error"
+                print(f"[LOAD] {step.label} для {chat_id}: {type(e).__name__}: {e}", file=sys.__stderr__)
+            # Задержка от запланированного момента: отставание генератора тоже видно пользователю
+            latency = time.perf_counter() - started - send_at
+            if outcome == "ok" and bot is not None:
+                replies = [m.text or "" for m in bot.sent.get(chat_id, [])[replies_before:]]
+                if any(text == BUSY_MESSAGE for text in replies):
+                    outcome = "busy"
+                elif any(text.startswith(ERROR_REPLIES) for text in replies):
+                    outcome = "error"
+            collector.add(send_at, step.label, latency, outcome)
+            previous_done = time.perf_counter() - started
+            if outcome in ("timeout", "rejected"):
+                return  # пользователь не дождался ответа — сценарий обрывается
+
+    sampler = asyncio.create_task(sample_gauges())
+    try:
+        await asyncio.gather(*(run_chat(steps) for steps in scenarios))
+    finally:
+        sampler.cancel()
+        wall = time.perf_counter() - started
+        await target.stop()
+        if record is not None:
+            record.close()
+    drain = await stop_fake_bot() if bot is not None else 0.0
+
+    stages = []
+    for i, bound in enumerate(stage_bounds):
+        end = stage_bounds[i + 1] if i + 1 < len(stage_bounds) else None
+        samples = [s for s in collector.samples if s[1] == i]
+        stage = {"stage": i, "offered": offered[i], "start_s": round(bound, 1)}
+        stage.update(_group(samples))
+        span = (end if end is not None else max([s[0] for s in samples] + [bound + 1])) - bound
+        stage["achieved_rate"] = round(len(samples) / span, 2) if span > 0 else 0.0
+        stage["by_step"] = {label: _group([s for s in samples if s[2] == label])
+                            for label in sorted({s[2] for s in samples})}
+        stages.append(stage)
+
+    timeline = []
+    buckets = defaultdict(list)
+    for s in collector.samples:
+        buckets[int(s[0] // args.bucket_seconds)].append(s)
+    for b in sorted(buckets):
+        row = {"t": b * args.bucket_seconds}
+        row.update({k: v for k, v in _group(buckets[b]).items() if k in ("sent", "p50_ms", "p95_ms", "error_rate")})
+        timeline.append(row)
+
+    saturation = None
+    for stage in stages:
+        reasons = []
+        if stage["p95_ms"] > args.slo_p95_ms:
+            reasons.append(f"p95 {stage['p95_ms']:.0f} мс > {args.slo_p95_ms:.0f} мс")
+        if stage["error_rate"] > args.max_error_rate:
+            reasons.append(f"ошибок {stage['error_rate']:.1%} > {args.max_error_rate:.1%}")
+        if reasons and stage["sent"]:
+            saturation = {"stage": stage["stage"], "offered": stage["offered"], "reason": "; ".join(reasons)}
+            break
+
+    return {
+        "meta": report_meta(args),
+        "target": args.target,
+        "wall_s": round(wall, 2),
+        "background_drain_s": round(drain, 2),
+        "stages": stages,
+        "timeline": timeline,
+        "gauges": [dict(zip(("t", "llm_running", "llm_queued", "outbound_depth", "webhook_depth"), g))
+                   for g in collector.gauges],
+        "saturation": saturation,
+        "counters": bot_counters() if bot is not None else {},
+    }
+
+
+def print_report(report: Dict, unit: str):
+    print(f"[LOAD] Цель: {report['target']}, время: {report['wall_s']} с")
+    print(f"{'ступень':<9}{unit:>10}{'факт/с':>9}{'n':>7}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}"
+          f"{'ошибки':>9}{'busy':>6}{'отказ':>7}{'таймаут':>9}")
+    for s in report["stages"]:
+        print(f"{s['stage']:<9}{s['offered']:>10}{s['achieved_rate']:>9.2f}{s['sent']:>7}{s['p50_ms']:>10.1f}"
+              f"{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}{s['error_rate']:>9.1%}{s['busy']:>6}{s['rejected']:>7}"
+              f"{s['timeout']:>9}")
+    saturation = report["saturation"]
+    if saturation:
+        print(f"[LOAD] Насыщение на ступени {saturation['stage']} ({saturation['offered']} {unit}): {saturation['reason']}")
+    else:
+        print("[LOAD] Насыщение не достигнуто: все ступени в пределах SLO.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default="inproc", help="inproc, webhook или URL внешнего вебхука")
+    parser.add_argument("--secret", help="секрет внешнего вебхука (WEBHOOK_SECRET)")
+    parser.add_argument("--rates", default="1,2,5,10", help="апдейтов в секунду по ступеням")
+    parser.add_argument("--stage-seconds", type=float, default=30.0)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="веса сценариев start, dialog, continue")
+    parser.add_argument("--think-seconds", type=float, default=5.0, help="медианная пауза пользователя между шагами")
+    parser.add_argument("--wave-size", type=int, default=0, help="пользователей во всплеске /continue (18:00)")
+    parser.add_argument("--wave-at", type=float, default=0.0, help="секунда начала всплеска")
+    parser.add_argument("--wave-spread", type=float, default=5.0, help="за сколько секунд приходит всплеск")
+    parser.add_argument("--replay", help="JSONL с записанными апдейтами вместо генератора")
+    parser.add_argument("--speeds", default="1", help="ускорения записанного потока по ступеням (для --replay)")
+    parser.add_argument("--record", help="записать отправленный поток в JSONL (для --replay)")
+    parser.add_argument("--first-chat-id", type=int, default=700000001)
+    parser.add_argument("--timeout", type=float, default=120.0, help="сколько ждать обработки апдейта, с")
+    parser.add_argument("--slo-p95-ms", type=float, default=15000.0, help="p95, выше которого ступень считается насыщенной")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--bucket-seconds", type=float, default=10.0, help="шаг временной кривой")
+    parser.add_argument("--webhook-port", type=int, default=18080)
+    parser.add_argument("--webhook-queue", type=int, default=1000)
+    parser.add_argument("--webhook-concurrency", type=int, default=64)
+    parser.add_argument("--out", help="куда записать JSON-отчет")
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+
+    async def run():
+        rng = random.Random(args.seed)
+        if args.replay:
+            speeds = [float(x) for x in args.speeds.split(",")]
+            scenarios, duration = load_replay(args.replay, speeds, float(args.rates.split(",")[0]), 10 ** 11)
+            bounds, t = [], 0.0
+            for speed in speeds:
+                bounds.append(t)
+                t += duration / speed
+            return await run_load(args, scenarios, bounds, speeds)
+        rates = [float(x) for x in args.rates.split(",")]
+        scenarios = Generator(args, rng).build(rates, args.stage_seconds, parse_mix(args.mix),
+                                               args.wave_size, args.wave_at, args.wave_spread)
+        return await run_load(args, scenarios, [i * args.stage_seconds for i in range(len(rates))], rates)
+
+    report = run_isolated(args, "askme-load-", run)
+    print_report(report, "ускор." if args.replay else "апд/с")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"[LOAD] Отчет: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
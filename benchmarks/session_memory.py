@@ -0,0 +1,97 @@
+"""
+Память на простаивающие сессии опросов: старый формат (dict со своей копией вопросов
+и списком Interaction) против Session со ссылкой на интернированный QuestionSet.
+
+    python benchmarks/session_memory.py --sessions 100000 --answers 3
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from datetime import datetime
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, PROJECT_ROOT)
+
+from Bot_tg.config import GREETING_QUESTIONS_FILE, TELOS_QUESTIONS_FILE, Interaction  # noqa: E402
+from Bot_tg.session import Session, SessionMode, load_question_set, intern_questions  # noqa: E402
+
+
+def legacy_session(mode, questions_raw, answers):
+    """Сессия в прежнем виде: каждый /start заново загружал анкету из файла."""
+    questions = json.loads(questions_raw)
+    return {
+        "mode": mode,
+        "questions": questions,
+        "step": len(answers),
+        "interactions": [Interaction(question=questions[i]["question_text"], answer=a) for i, a in enumerate(answers)],
+        "last_activity": datetime.now()
+    }
+
+
+def compact_session(mode, question_set, answers):
+    session = Session(mode, question_set)
+    for i, answer in enumerate(answers):
+        session.add_answer(i, answer)
+    session.step = len(answers)
+    return session
+
+
+def measure(build, count):
+    """Пиковая и удерживаемая память (байт) на count сессий, лежащих в словаре по chat_id."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    sessions = {}
+    for n in range(count):
+        sessions[str(100000000 + n)] = build(n)
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del sessions
+    return current, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100000)
+    parser.add_argument("--answers", type=int, default=3, help="сколько ответов уже дано в каждой сессии")
+    args = parser.parse_args()
+
+    with open(GREETING_QUESTIONS_FILE, "r", encoding="utf-8") as f:
+        greeting_raw = f.read()
+    with open(TELOS_QUESTIONS_FILE, "r", encoding="utf-8") as f:
+        telos = json.load(f)
+    # Ежедневные порции TELOS: у пользователей с одинаковым прогрессом порция совпадает
+    batches = [telos[i:i + 10] for i in range(0, max(len(telos), 1), 10)] or [[]]
+    batches_raw = [json.dumps(b, ensure_ascii=False) for b in batches]
+    answers = [f"Ответ пользователя номер {i}, пара предложений о себе." for i in range(args.answers)]
+
+    greeting_set = load_question_set(GREETING_QUESTIONS_FILE)
+    batch_sets = [intern_questions(b) for b in batches]
+
+    def build_legacy(n):
+        if n % 2:
+            return legacy_session("onboarding", greeting_raw, answers)
+        return legacy_session("continuing_profile", batches_raw[n % len(batches_raw)], answers)
+
+    def build_compact(n):
+        if n % 2:
+            item = compact_session(SessionMode.ONBOARDING, greeting_set, answers)
+        else:
+            item = compact_session(SessionMode.CONTINUING_PROFILE, batch_sets[n % len(batch_sets)], answers)
+        return (time.time() + 3600, item)  # так запись лежит в MemorySessionStore
+
+    results = {}
+    for name, build in (("dict", build_legacy), ("session", build_compact)):
+        current, peak, elapsed = measure(build, args.sessions)
+        results[name] = current
+        print(f"{name:>8}: {current / 2**20:8.1f} MiB удерживается, пик {peak / 2**20:8.1f} MiB, "
+              f"{current / args.sessions:7.0f} B/сессию, создание {elapsed:.2f} с")
+    print(f"Экономия: в {results['dict'] / max(results['session'], 1):.1f} раза "
+          f"({args.sessions} сессий, {args.answers} ответа в каждой).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Размер и скорость сборки ссылки WebApp: формат v1 (#d=, base64 JSON) против v2 (#v=2&z=, deflate)
+на реальных наборах вопросов из data/*.json и на ежедневных порциях TELOS по 10 вопросов.
+
+    python benchmarks/webapp_payload.py --repeat 2000
+"""
+import os
+import sys
+import glob
+import json
+import zlib
+import base64
+import timeit
+import argparse
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, PROJECT_ROOT)
+
+from Bot_tg.config import GITHUB_PAGES_URL, TELOS_QUESTIONS_FILE  # noqa: E402
+from Bot_tg.utils import generate_webapp_url  # noqa: E402
+
+
+def question_sets():
+    for path in sorted(glob.glob(os.path.join(PROJECT_ROOT, "data", "*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            questions = json.load(f)
+        yield os.path.basename(path), questions
+        if path == TELOS_QUESTIONS_FILE:
+            for start in range(0, len(questions), 10):
+                yield f"telos batch {start // 10 + 1}", questions[start:start + 10]
+
+
+def decode_v2(url: str):
+    payload = url.split("&z=", 1)[1]
+    data = base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+    return json.loads(zlib.decompress(data))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000, help="сколько раз собирать каждую ссылку")
+    parser.add_argument("--batches", action="store_true", help="печатать каждую порцию TELOS, а не только сводку")
+    args = parser.parse_args()
+
+    print(f"{'набор':<26}{'вопр.':>6}{'v1, симв.':>11}{'v2, симв.':>11}{'v2/v1':>7}{'v1, мкс':>9}{'v2, мкс':>9}")
+    batch_rows = []
+    for name, questions in question_sets():
+        v1 = generate_webapp_url(GITHUB_PAGES_URL, questions, version=1)
+        v2 = generate_webapp_url(GITHUB_PAGES_URL, questions, version=2)
+        assert decode_v2(v2) == questions
+        t1 = timeit.timeit(lambda: generate_webapp_url(GITHUB_PAGES_URL, questions, version=1), number=args.repeat)
+        t2 = timeit.timeit(lambda: generate_webapp_url(GITHUB_PAGES_URL, questions, version=2), number=args.repeat)
+        row = (name, len(questions), len(v1), len(v2), t1 / args.repeat * 1e6, t2 / args.repeat * 1e6)
+        if name.startswith("telos batch"):
+            batch_rows.append(row)
+            if not args.batches:
+                continue
+        print(f"{row[0]:<26}{row[1]:>6}{row[2]:>11}{row[3]:>11}{row[3] / row[2]:>7.2f}{row[4]:>9.1f}{row[5]:>9.1f}")
+
+    if batch_rows:
+        n = len(batch_rows)
+        v1 = sum(r[2] for r in batch_rows) / n
+        v2 = sum(r[3] for r in batch_rows) / n
+        print(f"{'telos batch, среднее':<26}{sum(r[1] for r in batch_rows) / n:>6.0f}{v1:>11.0f}{v2:>11.0f}"
+              f"{v2 / v1:>7.2f}{sum(r[4] for r in batch_rows) / n:>9.1f}{sum(r[5] for r in batch_rows) / n:>9.1f}")
+        print(f"telos batch, максимум: v1 {max(r[2] for r in batch_rows)} / v2 {max(r[3] for r in batch_rows)} символов")
+
+
+if __name__ == "__main__":
+    main()
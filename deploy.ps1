@@ -1,5 +1,15 @@
 # Скрипт для деплоя UI на GitHub Pages
 
+Write-Host "📚 Собираем паки вопросов..." -ForegroundColor Cyan
+
+# Статические анкеты -> web/public/packs/<хэш>.json (попадут в docs/packs)
+python scripts/build_question_packs.py
+
+if ($LASTEXITCODE -ne 0) {
+    Write-Host "❌ Ошибка при сборке паков вопросов!" -ForegroundColor Red
+    exit 1
+}
+
 Write-Host "🔨 Начинаем сборку приложения..." -ForegroundColor Cyan
 
 # Переходим в папку web и собираем приложение
@@ -0,0 +1,48 @@
+"""
+Собирает статические анкеты (data/greeting_questions.json, data/telos_questions.json) в паки
+<id>.json для WebApp, где id — хэш содержимого. Пак кладется в web/public/packs (попадет в
+следующую сборку сайта) и сразу в docs/packs (уже экспортированный сайт на GitHub Pages).
+
+    python scripts/build_question_packs.py
+    python scripts/build_question_packs.py --check   # код 1, если какой-то пак не собран
+
+Старые паки не удаляются: ссылки на них остаются в истории чатов.
+"""
+import os
+import sys
+import json
+import argparse
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, PROJECT_ROOT)
+
+from Bot_tg.config import WEBAPP_PACKS_DIR, WEBAPP_PACKS_SOURCE_DIR  # noqa: E402
+from Bot_tg.question_packs import PACK_SOURCES, write_pack  # noqa: E402
+from Bot_tg.session import question_set_id  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--check", action="store_true", help="только проверить, что все паки собраны")
+    args = parser.parse_args()
+
+    missing = 0
+    for source in PACK_SOURCES:
+        with open(source, "r", encoding="utf-8") as f:
+            questions = json.load(f)
+        name = os.path.relpath(source, PROJECT_ROOT)
+        if args.check:
+            pack_id = question_set_id(questions)
+            for out_dir in (WEBAPP_PACKS_SOURCE_DIR, WEBAPP_PACKS_DIR):
+                if not os.path.exists(os.path.join(out_dir, f"{pack_id}.json")):
+                    print(f"[PACKS] {name}: нет {os.path.relpath(out_dir, PROJECT_ROOT)}/{pack_id}.json")
+                    missing += 1
+            continue
+        for out_dir in (WEBAPP_PACKS_SOURCE_DIR, WEBAPP_PACKS_DIR):
+            pack_id = write_pack(questions, out_dir)
+        print(f"[PACKS] {name}: {len(questions)} вопросов -> packs/{pack_id}.json")
+    sys.exit(1 if missing else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Проверка бэкендов хранилища сессий одним сценарием: чтение/запись, compare-and-set,
+параллельные update(), touch, delete, истечение по TTL и шардирование.
+
+    python scripts/check_session_store.py                       # memory, sqlite и redis на заглушке
+    python scripts/check_session_store.py --redis-url redis://127.0.0.1:6379/15
+
+Без --redis-url RedisSessionStore работает с RespStandIn — RESP2-сервером в этом же процессе.
+Он проверяет клиент протокола (кодирование команд, разбор ответов, переподключение), но
+Lua-скрипты не исполняет, а повторяет их логику на Python: сами скрипты проверяются только
+на настоящем сервере (--redis-url; ключи пишутся с префиксом askme:check: и живут ttl секунд).
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, PROJECT_ROOT)
+
+from Bot_tg.session import SessionMode  # noqa: E402
+from Bot_tg.session_store import (  # noqa: E402
+    MemorySessionStore, SQLiteSessionStore, RedisSessionStore, ShardedSessionStore, new_session
+)
+
+QUESTIONS = [{"question_text": f"Вопрос {i}: что важно?", "type": "text"} for i in range(3)]
+
+
+class RespStandIn:
+    """Redis-совместимый сервер в памяти: ровно те команды, которые шлет RedisSessionStore."""
+
+    def __init__(self):
+        self.data = {}      # ключ -> {поле: строка}
+        self.expires = {}   # ключ -> time.monotonic() истечения
+        self.commands = 0
+        self.connections = 0
+        self._server = None
+        self._writers = set()
+
+    async def start(self) -> str:
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        port = self._server.sockets[0].getsockname()[1]
+        return f"redis://127.0.0.1:{port}/0"
+
+    async def stop(self):
+        self.drop_connections()
+        self._server.close()
+        await self._server.wait_closed()
+        while self._writers:
+            await asyncio.sleep(0.01)
+
+    def drop_connections(self):
+        """Рвет открытые соединения, как при рестарте сервера: клиент должен переподключиться."""
+        for writer in list(self._writers):
+            writer.close()
+
+    def _live(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key)
+
+    async def _read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        assert line[:1] == b"*", line
+        args = []
+        for _ in range(int(line[1:-2])):
+            header = await reader.readline()
+            assert header[:1] == b"$", header
+            args.append((await reader.readexactly(int(header[1:-2]) + 2))[:-2].decode("utf-8"))
+        return args
+
+    @staticmethod
+    def _encode(value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, Exception):
+            return f"-ERR {value}\r\n".encode()
+        if isinstance(value, bool) or value == "OK":
+            return b"+OK\r\n"
+        if isinstance(value, int):
+            return f":{value}\r\n".encode()
+        if isinstance(value, list):
+            return f"*{len(value)}\r\n".encode() + b"".join(RespStandIn._encode(v) for v in value)
+        data = str(value).encode("utf-8")
+        return f"${len(data)}\r\n".encode() + data + b"\r\n"
+
+    async def _serve(self, reader, writer):
+        self._writers.add(writer)
+        self.connections += 1
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                self.commands += 1
+                try:
+                    reply = self._execute(args[0].upper(), args[1:])
+                except Exception as e:
+                    reply = e
+                writer.write(self._encode(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def _execute(self, name, args):
+        if name in ("AUTH", "SELECT"):
+            return "OK"
+        if name == "HMGET":
+            item = self._live(args[0]) or {}
+            return [item.get(field) for field in args[1:]]
+        if name == "DEL":
+            existed = self._live(args[0]) is not None
+            self.data.pop(args[0], None)
+            self.expires.pop(args[0], None)
+            return int(existed)
+        if name == "EXPIRE":
+            if self._live(args[0]) is None:
+                return 0
+            self.expires[args[0]] = time.monotonic() + int(args[1])
+            return 1
+        if name == "EVAL":
+            script, numkeys = args[0], int(args[1])
+            keys, argv = args[2:2 + numkeys], args[2 + numkeys:]
+            return self._eval(script, keys, argv)
+        raise ValueError(f"unknown command '{name}'")
+
+    def _eval(self, script, keys, argv):
+        if script not in (RedisSessionStore._SET, RedisSessionStore._CAS):
+            raise ValueError("NOSCRIPT stand-in knows only RedisSessionStore scripts")
+        key, counter = keys
+        current = int((self._live(key) or {}).get("v", "0"))
+        if script == RedisSessionStore._CAS and current != int(argv[2]):
+            return 0
+        # Счетчик версий без TTL; если его потеряли, версия все равно растет
+        version = max(int(self.data.get(counter, "0")) + 1, current + 1)
+        self.data[counter] = str(version)
+        self.data[key] = {"v": str(version), "s": argv[0]}
+        self.expires[key] = time.monotonic() + int(argv[1])
+        return version
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+async def run_scenario(store, chat_id: int = 42, ttl: float = 1.0):
+    check(await store.get(chat_id) is None, "пустое хранилище вернуло сессию")
+
+    session = new_session(SessionMode.PROFILING, QUESTIONS)
+    session.add_answer(0, "Свобода — «главное» ✓")
+    version = await store.set(chat_id, session)
+    check(version >= 1 and session.version == version, f"set вернул версию {version}")
+
+    loaded = await store.get(chat_id)
+    check(loaded is not None and loaded.version == version, "get после set")
+    check(loaded.mode == SessionMode.PROFILING and [i.answer for i in loaded.interactions] == ["Свобода — «главное» ✓"],
+          "содержимое сессии не совпало после чтения")
+
+    stale = loaded.copy()
+    loaded.step = 1
+    check(await store.compare_and_set(chat_id, loaded), "CAS с актуальной версией отклонен")
+    check(not await store.compare_and_set(chat_id, stale), "CAS со старой версией прошел")
+    check((await store.get(chat_id)).step == 1, "CAS не записал изменения")
+
+    def bump(s):
+        s.step += 1
+    await asyncio.gather(*(store.update(chat_id, bump) for _ in range(5)))
+    check((await store.get(chat_id)).step == 6, "параллельные update() потеряли изменения")
+
+    await store.touch(chat_id)
+    await store.delete(chat_id)
+    check(await store.get(chat_id) is None, "delete не удалил сессию")
+
+    fresh = new_session(SessionMode.DEFAULT, QUESTIONS)
+    check(await store.compare_and_set(chat_id, fresh), "CAS с версией 0 не создал сессию")
+    check(not await store.compare_and_set(chat_id + 1, fresh), "CAS с версией 1 создал отсутствующую сессию")
+
+    await asyncio.sleep(ttl + 1.1)
+    await store.expire()
+    check(await store.get(chat_id) is None, "сессия не истекла по TTL")
+
+    # Новая сессия после истечения не повторяет старые версии: устаревший CAS не пройдет
+    await store.set(chat_id, new_session(SessionMode.DEFAULT, QUESTIONS))
+    check(not await store.compare_and_set(chat_id, fresh), "CAS с версией истекшей сессии прошел")
+    await store.delete(chat_id)
+
+
+async def main_async(args) -> int:
+    failed = 0
+    stand_ins = []
+
+    async def redis_store(prefix: str):
+        if args.redis_url:
+            return RedisSessionStore(args.redis_url, ttl=args.ttl, prefix=f"askme:check:{prefix}:")
+        stand_in = RespStandIn()
+        stand_ins.append(stand_in)
+        return RedisSessionStore(await stand_in.start(), ttl=args.ttl, prefix=f"askme:check:{prefix}:")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cases = [
+            ("memory", lambda: MemorySessionStore(ttl=args.ttl)),
+            ("sqlite", lambda: SQLiteSessionStore(os.path.join(tmp, "sessions.sqlite3"), ttl=args.ttl)),
+            ("redis", lambda: redis_store("single")),
+            ("redis x2 (шарды)", None),
+        ]
+        for name, factory in cases:
+            if factory is None:
+                store = ShardedSessionStore([await redis_store("a"), await redis_store("b")])
+            else:
+                store = factory()
+                if asyncio.iscoroutine(store):
+                    store = await store
+            started = time.perf_counter()
+            try:
+                await run_scenario(store, ttl=args.ttl)
+                if name == "redis" and not args.redis_url:
+                    # Соединение оборвалось между командами: следующая команда переподключается
+                    stand_ins[0].drop_connections()
+                    await asyncio.sleep(0)
+                    await store.set(7, new_session(SessionMode.DEFAULT, QUESTIONS))
+                    check(await store.get(7) is not None, "после переподключения сессия не читается")
+                    check(stand_ins[0].connections == 2, "клиент не переподключился")
+                print(f"[CHECK] {name}: OK ({time.perf_counter() - started:.1f} с)")
+            except Exception as e:
+                failed += 1
+                print(f"[CHECK] {name}: ОШИБКА — {type(e).__name__}: {e}")
+            finally:
+                await store.close()
+    for stand_in in stand_ins:
+        await stand_in.stop()
+    if not args.redis_url:
+        print("[CHECK] redis проверен на RespStandIn: Lua-скрипты не исполнялись (нужен --redis-url).")
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis-url", help="настоящий Redis/Valkey вместо заглушки")
+    parser.add_argument("--ttl", type=float, default=1.0, help="TTL сессий в проверке, с")
+    args = parser.parse_args(argv)
+    return asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""
+Отправляет записанный апдейт Telegram в локальный сервер вебхука (BOT_MODE=webhook).
+
+    python scripts/post_update.py scripts/updates/start_command.json
+    python scripts/post_update.py update.json --url http://127.0.0.1:8080/telegram/webhook --chat-id 42 --text "/profile"
+
+Файл может содержать один апдейт или список апдейтов. Секрет берется из --secret или WEBHOOK_SECRET.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import urllib.error
+import urllib.request
+
+
+def load_updates(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data if isinstance(data, list) else [data]
+
+
+def patch_update(update: dict, chat_id=None, text=None, fresh_id=False) -> dict:
+    message = update.get("message") or update.get("edited_message")
+    if message is not None:
+        if chat_id is not None:
+            message["chat"]["id"] = chat_id
+            if "from" in message:
+                message["from"]["id"] = chat_id
+        if text is not None:
+            message["text"] = text
+            message.pop("entities", None)
+            if text.startswith("/"):
+                command = text.split()[0]
+                message["entities"] = [{"offset": 0, "length": len(command), "type": "bot_command"}]
+        message["date"] = int(time.time())
+    if fresh_id:
+        update["update_id"] = int(time.time() * 1000) % 2_000_000_000
+    return update
+
+
+def post(url: str, update: dict, secret=None):
+    body = json.dumps(update, ensure_ascii=False).encode("utf-8")
+    request = urllib.request.Request(url, data=body, method="POST", headers={"Content-Type": "application/json"})
+    if secret:
+        request.add_header("X-Telegram-Bot-Api-Secret-Token", secret)
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, response.read().decode("utf-8", "replace")
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode("utf-8", "replace")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="POST recorded Telegram updates to the local webhook server.")
+    parser.add_argument("file", help="JSON-файл с апдейтом или списком апдейтов")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{os.getenv('WEBHOOK_PORT', '8080')}"
+                                         f"{os.getenv('WEBHOOK_PATH', '/telegram/webhook')}")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET"))
+    parser.add_argument("--chat-id", type=int, help="подменить chat_id (и from.id) в сообщении")
+    parser.add_argument("--text", help="подменить текст сообщения")
+    parser.add_argument("--fresh-id", action="store_true", help="выдать новый update_id")
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for update in load_updates(args.file):
+        update = patch_update(update, args.chat_id, args.text, args.fresh_id)
+        status, body = post(args.url, update, args.secret)
+        print(f"update_id={update.get('update_id')} -> {status} {body}")
+        failed += status != 200
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
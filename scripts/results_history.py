@@ -0,0 +1,57 @@
+"""
+Результаты сессий одного чата из журнала (results/journal, см. Bot_tg/results_journal.py).
+
+    python scripts/results_history.py 123456
+    python scripts/results_history.py 123456 --since 2026-01-01 --until 2026-02-01 --limit 5
+    python scripts/results_history.py 123456 --json > chat.jsonl
+
+Записи находятся по индексу .idx и читаются точечно по оффсетам, без просмотра сегментов.
+Журнал открывается только на чтение: скрипт можно запускать рядом с работающим ботом.
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, PROJECT_ROOT)
+
+from Bot_tg.config import RESULTS_JOURNAL_DIR  # noqa: E402
+from Bot_tg.results_journal import ResultsJournal  # noqa: E402
+
+
+def print_record(record: dict):
+    print(f"{record.get('timestamp', '')}  {record.get('session_id', '')}")
+    if record.get("original_text"):
+        print(f"    запрос: {record['original_text']}")
+    for item in record.get("interactions", []):
+        print(f"    — {item.get('question', '')}\n      {item.get('answer', '')}")
+    print(f"    итог: {record.get('final_text', '')}\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("chat_id", help="chat_id пользователя")
+    parser.add_argument("--since", help="не раньше этого времени (ISO, например 2026-01-01)")
+    parser.add_argument("--until", help="не позже этого времени (ISO; дата без времени — включая весь день)")
+    parser.add_argument("--limit", type=int, help="только последние N результатов")
+    parser.add_argument("--dir", default=RESULTS_JOURNAL_DIR, help="каталог журнала")
+    parser.add_argument("--json", action="store_true", help="печатать записи как JSONL")
+    args = parser.parse_args(argv)
+
+    journal = ResultsJournal(args.dir)
+    journal.open(read_only=True)
+    records = asyncio.run(journal.history(args.chat_id, since=args.since, until=args.until, limit=args.limit))
+    for record in records:
+        if args.json:
+            print(json.dumps(record, ensure_ascii=False))
+        else:
+            print_record(record)
+    if not args.json:
+        print(f"Результатов: {len(records)} (журнал: {args.dir})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
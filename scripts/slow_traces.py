@@ -0,0 +1,186 @@
+"""
+Самые медленные трассы апдейтов из TRACE_FILE (JSONL в формате OTLP/JSON, см. Bot_tg/tracing.py)
+с разбивкой по этапам: прокси/Gemini (agent_*), ожидание слота LLM, разбор JSON, файлы, отправка в Telegram.
+
+    python scripts/slow_traces.py
+    python scripts/slow_traces.py results/traces.jsonl --top 5 --tree
+    python scripts/slow_traces.py --chat 123456 --name "/profile"
+
+Время этапа — собственное (self): длительность спана минус время вложенных спанов, поэтому
+сумма по этапам равна длительности трассы. Работа, закончившаяся после ответа (фоновое
+обновление профиля), показывается отдельно.
+"""
+import os
+import sys
+import json
+import argparse
+from collections import defaultdict
+from datetime import datetime
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, PROJECT_ROOT)
+
+from Bot_tg.config import TRACE_FILE  # noqa: E402
+
+
+def _attr_value(value: dict):
+    for key in ("stringValue", "doubleValue", "boolValue"):
+        if key in value:
+            return value[key]
+    if "intValue" in value:
+        return int(value["intValue"])
+    return None
+
+
+def load_spans(paths):
+    """{traceId: [span]}; span — dict с полями OTLP плюс start/end (нс), attrs и error."""
+    traces = defaultdict(list)
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # строка, оборванная при остановке
+                for resource in record.get("resourceSpans", []):
+                    for scope in resource.get("scopeSpans", []):
+                        for span in scope.get("spans", []):
+                            span["start"] = int(span["startTimeUnixNano"])
+                            span["end"] = int(span["endTimeUnixNano"])
+                            span["attrs"] = {a["key"]: _attr_value(a["value"]) for a in span.get("attributes", [])}
+                            status = span.get("status") or {}
+                            span["error"] = status.get("message") or ("error" if status.get("code") == 2 else None)
+                            traces[span["traceId"]].append(span)
+    return traces
+
+
+def _covered(intervals, start: int, end: int) -> int:
+    """Сколько нс из [start, end] покрыто объединением интервалов (дети могут идти параллельно)."""
+    total, cursor = 0, start
+    for s, e in sorted(intervals):
+        s, e = max(s, cursor), min(e, end)
+        if e > s:
+            total += e - s
+            cursor = e
+    return total
+
+
+class Trace:
+    def __init__(self, spans):
+        self.spans = spans
+        roots = [s for s in spans if not s.get("parentSpanId")]
+        self.root = min(roots or spans, key=lambda s: s["start"])
+        self.duration = self.root["end"] - self.root["start"]
+        self.children = defaultdict(list)
+        for span in spans:
+            if span.get("parentSpanId"):
+                self.children[span["parentSpanId"]].append(span)
+
+    @property
+    def chat_id(self):
+        for span in self.spans:
+            if "chat_id" in span["attrs"]:
+                return span["attrs"]["chat_id"]
+        return None
+
+    @property
+    def label(self) -> str:
+        # Имя обработчика информативнее, чем webhook.update
+        handlers = [s["name"] for s in self.spans if s["name"].startswith("handler ")]
+        return handlers[0] if handlers else self.root["name"]
+
+    @property
+    def errors(self):
+        return [f"{s['name']}: {s['error']}" for s in self.spans if s["error"]]
+
+    def self_time(self, span) -> int:
+        children = [(c["start"], c["end"]) for c in self.children.get(span["spanId"], [])]
+        return span["end"] - span["start"] - _covered(children, span["start"], span["end"])
+
+    def breakdown(self):
+        """(этапы в пределах ответа, этапы после ответа): {имя: [count, total_ns, self_ns]}."""
+        inside, after = defaultdict(lambda: [0, 0, 0]), defaultdict(lambda: [0, 0, 0])
+        for span in self.spans:
+            target = after if span["end"] > self.root["end"] else inside
+            row = target[span["name"]]
+            row[0] += 1
+            row[1] += span["end"] - span["start"]
+            row[2] += self.self_time(span)
+        return inside, after
+
+
+def _ms(ns: int) -> str:
+    return f"{ns / 1e6:.1f}"
+
+
+def print_breakdown(rows, base_ns: int, indent: str = "    "):
+    print(f"{indent}{'этап':<34}{'n':>5}{'всего мс':>11}{'свое мс':>11}{'доля':>8}")
+    for name, (count, total, own) in sorted(rows.items(), key=lambda item: -item[1][2]):
+        share = f"{100 * own / base_ns:.0f}%" if base_ns else "—"
+        print(f"{indent}{name:<34}{count:>5}{_ms(total):>11}{_ms(own):>11}{share:>8}")
+
+
+def print_tree(trace: Trace, span=None, depth: int = 0):
+    span = span or trace.root
+    offset = span["start"] - trace.root["start"]
+    attrs = ", ".join(f"{k}={v}" for k, v in span["attrs"].items() if k not in ("chat_id",))
+    error = f"  !! {span['error']}" if span["error"] else ""
+    print(f"    {'  ' * depth}+{_ms(offset):>8} мс  {span['name']}  {_ms(span['end'] - span['start'])} мс"
+          f"{f'  ({attrs})' if attrs else ''}{error}")
+    for child in sorted(trace.children.get(span["spanId"], []), key=lambda s: s["start"]):
+        print_tree(trace, child, depth + 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="файлы трасс (по умолчанию TRACE_FILE и его .1)")
+    parser.add_argument("--top", type=int, default=10, help="сколько трасс показать")
+    parser.add_argument("--name", help="только трассы, где обработчик или корень содержит эту строку")
+    parser.add_argument("--chat", help="только трассы этого chat_id")
+    parser.add_argument("--errors", action="store_true", help="только трассы с ошибками")
+    parser.add_argument("--tree", action="store_true", help="печатать дерево спанов каждой трассы")
+    args = parser.parse_args(argv)
+
+    paths = args.files or [p for p in (TRACE_FILE + ".1", TRACE_FILE) if TRACE_FILE and os.path.exists(p)]
+    if not paths:
+        print(f"Нет файлов трасс (TRACE_FILE={TRACE_FILE}).")
+        return 1
+    traces = [Trace(spans) for spans in load_spans(paths).values()]
+    if args.name:
+        traces = [t for t in traces if args.name in t.label or args.name in t.root["name"]]
+    if args.chat:
+        traces = [t for t in traces if str(t.chat_id) == args.chat]
+    if args.errors:
+        traces = [t for t in traces if t.errors]
+    traces.sort(key=lambda t: -t.duration)
+    print(f"Трасс: {len(traces)} (файлы: {', '.join(paths)})")
+
+    totals = defaultdict(lambda: [0, 0, 0])
+    shown = traces[:args.top]
+    for i, trace in enumerate(shown, 1):
+        started = datetime.fromtimestamp(trace.root["start"] / 1e9).strftime("%Y-%m-%d %H:%M:%S")
+        print(f"\n#{i} {_ms(trace.duration)} мс  {trace.label}  chat={trace.chat_id}  {started}  "
+              f"trace={trace.root['traceId']}")
+        for error in trace.errors:
+            print(f"    ошибка: {error}")
+        inside, after = trace.breakdown()
+        print_breakdown(inside, trace.duration)
+        if after:
+            print("    после ответа:")
+            print_breakdown(after, trace.duration)
+        if args.tree:
+            print_tree(trace)
+        for name, row in inside.items():
+            for k in range(3):
+                totals[name][k] += row[k]
+
+    if len(shown) > 1:
+        print(f"\nИтого по {len(shown)} самым медленным трассам:")
+        print_breakdown(totals, sum(t.duration for t in shown))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
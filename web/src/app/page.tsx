@@ -26,6 +26,85 @@ interface Result {
   answer: string;
 }
 
+// --- Payload ---
+// Бот передает вопросы во фрагменте URL:
+//   #p=<id>&i=0-2,5 — статический пак packs/<id>.json (нужные номера вопросов, без i — все);
+//   #v=2&z=<base64url(deflate(JSON))> — вопросы целиком;
+//   #d=<base64url(JSON)> — старые ссылки.
+// Telegram дописывает во фрагмент свои параметры (tgWebAppData и т.п.), их пропускаем.
+const PACK_ID_RE = /^[0-9a-f]{8,64}$/;
+
+function base64UrlToBytes(b64: string) {
+  const normalized = b64.replace(/-/g, "+").replace(/_/g, "/");
+  const binary = atob(normalized + "=".repeat((4 - (normalized.length % 4)) % 4));
+  const bytes = new Uint8Array(binary.length);
+  for (let i = 0; i < binary.length; i++) bytes[i] = binary.charCodeAt(i);
+  return bytes;
+}
+
+async function inflate(bytes: BufferSource): Promise<string> {
+  const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream("deflate"));
+  return new Response(stream).text();
+}
+
+function parseIndices(spec: string): number[] {
+  const indices: number[] = [];
+  for (const part of spec.split(",")) {
+    const [from, to] = part.split("-").map(Number);
+    for (let i = from; i <= (to ?? from); i++) indices.push(i);
+  }
+  return indices;
+}
+
+// Паки неизменяемы (имя — хэш содержимого), поэтому кэшируем их без срока годности
+async function loadPack(packId: string): Promise<Question[]> {
+  if (!PACK_ID_RE.test(packId)) {
+    throw new Error(`Bad pack id: ${packId}`);
+  }
+  const cacheKey = `pack:${packId}`;
+  try {
+    const cached = localStorage.getItem(cacheKey);
+    if (cached) return JSON.parse(cached);
+  } catch {
+    // localStorage может быть недоступен — просто загружаем заново
+  }
+  const response = await fetch(new URL(`packs/${packId}.json`, window.location.href), { cache: "force-cache" });
+  if (!response.ok) {
+    throw new Error(`Pack ${packId}: HTTP ${response.status}`);
+  }
+  const text = await response.text();
+  try {
+    localStorage.setItem(cacheKey, text);
+  } catch {
+    // Переполнение хранилища не мешает показать анкету
+  }
+  return JSON.parse(text);
+}
+
+async function decodePayload(hash: string): Promise<Question[] | null> {
+  const params = new URLSearchParams(hash);
+  const packId = params.get("p");
+  if (packId) {
+    const pack = await loadPack(packId);
+    const indices = params.get("i");
+    return indices ? parseIndices(indices).map((i) => pack[i]).filter(Boolean) : pack;
+  }
+  let jsonStr = "";
+  const version = params.get("v");
+  const compressed = params.get("z");
+  const legacy = params.get("d");
+  if (version === "2" && compressed) {
+    jsonStr = await inflate(base64UrlToBytes(compressed));
+  } else if (version && version !== "1") {
+    throw new Error(`Unsupported payload version: ${version}`);
+  } else if (legacy) {
+    jsonStr = new TextDecoder().decode(base64UrlToBytes(legacy));
+  } else {
+    jsonStr = decodeURIComponent(hash.split(/[?&]/)[0]);
+  }
+  return jsonStr ? JSON.parse(jsonStr) : null;
+}
+
 export default function SurveyPage() {
   const [currentStep, setCurrentStep] = useState(0);
   const [questions, setQuestions] = useState<Question[]>([]);
@@ -44,49 +123,37 @@ export default function SurveyPage() {
     }
 
     // Load Data
-    try {
-      const hash = window.location.hash.substring(1);
-      if (!hash) {
-        // Fallback demo data
-        setQuestions([{
-          question_text: "Какой стиль интерфейса вам нравится?",
-          type: "multiple_choice",
-          variants: ["Минимализм", "Глассморфизм", "Нео-брутализм", "Киберпанк"]
-        }, {
-          question_text: "Как часто вы используете Telegram Apps?",
-          type: "multiple_choice",
-          variants: ["Ежедневно", "Иногда", "Редко", "Впервые вижу"]
-        }]);
-        setLoading(false);
-        return;
-      }
-
-      let jsonStr = "";
-      const cleanHash = hash.split(/[?&]/)[0];
-
-      if (cleanHash.startsWith("d=")) {
-        const b64 = cleanHash.substring(2);
-        const binary = atob(b64.replace(/-/g, "+").replace(/_/g, "/"));
-        const bytes = new Uint8Array(binary.length);
-        for (let i = 0; i < binary.length; i++) bytes[i] = binary.charCodeAt(i);
-        jsonStr = new TextDecoder().decode(bytes);
-      } else {
-        jsonStr = decodeURIComponent(cleanHash);
-      }
-
-      if (jsonStr) {
-        const parsed = JSON.parse(jsonStr);
-        setQuestions(parsed);
-      }
-    } catch (e) {
-      console.error("Parse error:", e);
+    const hash = window.location.hash.substring(1);
+    if (!hash) {
+      // Fallback demo data
       setQuestions([{
-        question_text: "Ошибка загрузки данных",
+        question_text: "Какой стиль интерфейса вам нравится?",
+        type: "multiple_choice",
+        variants: ["Минимализм", "Глассморфизм", "Нео-брутализм", "Киберпанк"]
+      }, {
+        question_text: "Как часто вы используете Telegram Apps?",
         type: "multiple_choice",
-        variants: ["Перезагрузить"]
+        variants: ["Ежедневно", "Иногда", "Редко", "Впервые вижу"]
       }]);
+      setLoading(false);
+      return;
     }
-    setLoading(false);
+
+    decodePayload(hash)
+      .then((parsed) => {
+        if (parsed && parsed.length) {
+          setQuestions(parsed);
+        }
+      })
+      .catch((e) => {
+        console.error("Parse error:", e);
+        setQuestions([{
+          question_text: "Ошибка загрузки данных",
+          type: "multiple_choice",
+          variants: ["Перезагрузить"]
+        }]);
+      })
+      .finally(() => setLoading(false));
   }, []);
 
   const handleFinish = useCallback((finalAnswers: string[]) => {